@@ -52,8 +52,9 @@ setup(name='tax2tree',
       maintainer_email=__email__,
       url='https://github.com/biocore/tax2tree',
       packages=['t2t'],
-      scripts=['scripts/t2t'],
+      scripts=['scripts/t2t', 'scripts/t2t-benchmark'],
       install_requires=install_requires,
       extras_require={'test': ['nose >= 0.10.1', 'pep8'],
-                      'doc': ['Sphinx >= 1.2.2']},
+                      'doc': ['Sphinx >= 1.2.2'],
+                      'zstd': ['zstandard']},
       long_description=long_description)
@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+
+"""Synthetic benchmarks at reference database scale
+
+Generates seeded trees of a given shape along with a 7-rank consensus map that
+follows the tree, with configurable noise and polyphyly, and times the
+nlevel, Consistency, validate and remap entry points on them, along with the
+startup time of short t2t commands. Results are written as JSON lines, one
+record per stage, so runs can be compared.
+"""
+
+import os
+import sys
+import json
+import subprocess
+from random import Random
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+from distutils.spawn import find_executable
+
+import t2t
+import t2t.nlevel as nl
+import t2t.remap as rmap
+import t2t.validate as val
+from t2t.consistency import Consistency
+from t2t.pipeline import run_decorate
+from t2t.stats import StageStats
+from t2t.treecache import newick_to_arrays
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+SHAPES = ('balanced', 'caterpillar', 'polytomous')
+
+# the depth of a caterpillar tree grows with its tips, and walking the
+# ancestors of every node costs n * depth, so these shapes are not timed above
+# MAX_QUADRATIC_TIPS tips unless asked to
+QUADRATIC_SHAPES = ('caterpillar',)
+MAX_QUADRATIC_TIPS = 5000
+
+# the numbers of tips timed by default, which finish within an hour on one
+# core, and those of a full run, up to the size of the largest references
+SIZES = (1000, 10000, 100000)
+FULL_SIZES = (10000, 100000, 1000000, 2000000)
+RANKS = ('d', 'p', 'c', 'o', 'f', 'g', 's')
+
+# the number of child taxa of a domain, phylum, ..., genus, e.g., 5 species
+# per genus, and the number of tips per species
+TAXA_WIDTH = (40, 3, 4, 4, 5, 5)
+TIPS_PER_SPECIES = 10
+
+
+def tip_name(idx):
+    """Returns the name of the idx'th tip"""
+    return 'T%d' % idx
+
+
+def _split_balanced(lo, hi, rng):
+    mid = (lo + hi) // 2
+    return [(lo, mid), (mid, hi)]
+
+
+def _split_caterpillar(lo, hi, rng):
+    return [(lo, lo + 1), (lo + 1, hi)]
+
+
+def _split_polytomous(lo, hi, rng, max_degree=6):
+    n_children = rng.randint(2, min(max_degree, hi - lo))
+    cuts = sorted(rng.sample(xrange(lo + 1, hi), n_children - 1))
+    bounds = [lo] + cuts + [hi]
+    return zip(bounds[:-1], bounds[1:])
+
+
+_SPLITS = {'balanced': _split_balanced,
+           'caterpillar': _split_caterpillar,
+           'polytomous': _split_polytomous}
+
+
+def make_tree(n_tips, shape='balanced', seed=0, support=0.5):
+    """Returns a newick string of a tree with n_tips tips
+
+    The tree is built without recursion, so very deep trees (e.g., a
+    caterpillar of millions of tips) can be generated. Tips are named by
+    tip_name in left to right order.
+
+    Parameters
+    ----------
+    n_tips : int
+        The number of tips, at least 2
+    shape : str
+        One of SHAPES
+    seed : int
+        Seed of the random number generator
+    support : float
+        The fraction of internal nodes given a support value
+
+    Returns
+    -------
+    str
+    """
+    if shape not in _SPLITS:
+        raise ValueError("Unknown shape %s" % shape)
+    if n_tips < 2:
+        raise ValueError("A tree needs at least two tips")
+
+    split = _SPLITS[shape]
+    rng = Random(seed)
+
+    out = []
+    stack = [(0, n_tips)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+            continue
+
+        lo, hi = item
+        if hi - lo == 1:
+            out.append(tip_name(lo))
+            continue
+
+        if rng.random() < support:
+            stack.append(')%.2f' % rng.random())
+        else:
+            stack.append(')')
+
+        children = split(lo, hi, rng)
+        for child in reversed(children[1:]):
+            stack.append(child)
+            stack.append(',')
+        stack.append(children[0])
+        out.append('(')
+
+    out.append(';')
+    return ''.join(out)
+
+
+def make_consensus_map(n_tips, seed=0, noise=0.0, polyphyly=0.0,
+                       missing=0.1):
+    """Returns consensus map lines for the tips of make_tree
+
+    Neighboring tips are given the same taxa, so the taxonomy follows the
+    tree. A tip's lineage is the index of its species broken down by
+    TAXA_WIDTH.
+
+    Parameters
+    ----------
+    n_tips : int
+        The number of tips
+    seed : int
+        Seed of the random number generator
+    noise : float
+        The fraction of tips that get the lineage of a random other tip
+    polyphyly : float
+        The fraction of genera that reuse the name of another genus
+    missing : float
+        The fraction of tips whose species is unknown
+
+    Returns
+    -------
+    list of str
+    """
+    rng = Random(seed)
+
+    n_species = (n_tips + TIPS_PER_SPECIES - 1) // TIPS_PER_SPECIES
+    n_genera = (n_species + TAXA_WIDTH[-1] - 1) // TAXA_WIDTH[-1]
+
+    genus_names = range(n_genera)
+    for idx in xrange(n_genera):
+        if rng.random() < polyphyly:
+            genus_names[idx] = rng.randrange(n_genera)
+
+    def lineage(species):
+        ids = [species]
+        for width in reversed(TAXA_WIDTH):
+            ids.append(ids[-1] // width)
+        ids.reverse()
+        ids[5] = genus_names[ids[5]]
+        names = ['%s__%s%d' % (r, r.upper(), i) for r, i in zip(RANKS, ids)]
+        return names
+
+    lines = []
+    for idx in xrange(n_tips):
+        species = idx // TIPS_PER_SPECIES
+        if rng.random() < noise:
+            species = rng.randrange(n_species)
+        names = lineage(species)
+        if rng.random() < missing:
+            names[-1] = 's__'
+        lines.append('%s\t%s' % (tip_name(idx), '; '.join(names)))
+    return lines
+
+
+def make_otu_map(n_tips, seed=0, size=3):
+    """Returns OTU map lines clustering neighboring tips, size per OTU"""
+    lines = []
+    for otu, lo in enumerate(xrange(0, n_tips, size)):
+        members = [tip_name(i) for i in xrange(lo, min(lo + size, n_tips))]
+        lines.append('\t'.join(['%d' % otu] + members))
+    return lines
+
+
+def bench_decorate(newick, lines, stats):
+    """Time the decorate pipeline"""
+    context = nl.TaxonomyContext.from_consensus(lines[0].split('\t')[1])
+    with stats.stage('load_consensus_map'):
+        tipname_map = nl.load_consensus_map(lines, False, context=context)
+    with stats.stage('parse_tree'):
+        arrays = newick_to_arrays(StringIO(newick))
+    run_decorate(arrays, tipname_map, stats=stats, context=context)
+
+
+def bench_consistency(newick, lines, stats):
+    """Time the consistency calculation"""
+    context = nl.TaxonomyContext.from_consensus(lines[0].split('\t')[1])
+    tipname_map = nl.load_consensus_map(lines, False, context=context)
+    with stats.stage('parse_tree'):
+        arrays = newick_to_arrays(StringIO(newick))
+    with stats.stage('load_tree') as record:
+        tree = nl.load_tree(arrays, tipname_map, context=context)
+        record['tree'] = tree
+    with stats.stage('collect_names_at_ranks_counts', tree):
+        counts = nl.collect_names_at_ranks_counts(tree, context=context)
+    with stats.stage('decorate_ntips_rank', tree):
+        nl.decorate_ntips_rank(tree, context=context)
+    with stats.stage('decorate_name_counts', tree):
+        nl.decorate_name_counts(tree, context=context)
+    with stats.stage('calculate', tree):
+        Consistency(counts, context.n_ranks).calculate(tree, True)
+
+
+def bench_validate(newick, lines, stats):
+    """Time the taxonomy validation"""
+    context = val.lines_context(lines)
+    with stats.stage('flat_errors'):
+        val.flat_errors(lines, context)
+    with stats.stage('hierarchy_errors'):
+        val.hierarchy_errors(lines, context)
+
+
+def bench_remap(newick, lines, stats, otu_lines):
+    """Time remapping the taxonomy of OTU representatives over the OTUs"""
+    with stats.stage('parse_otu_map'):
+        otus = rmap.parse_otu_map(otu_lines)
+
+    mapping = {}
+    for line in lines:
+        id_, tax = line.split('\t')
+        if id_ in otus:
+            mapping[id_] = tax.split('; ')
+
+    with stats.stage('remap_taxonomy'):
+        rmap.remap_taxonomy(otus, mapping)
+
+
+def find_script():
+    """Returns the path to the t2t script, preferring the one in the source"""
+    path = os.path.join(os.path.dirname(os.path.abspath(t2t.__file__)),
+                        os.pardir, 'scripts', 't2t')
+    if os.path.exists(path):
+        return path
+    return find_executable('t2t')
+
+
+def bench_startup(lines, stats, otu_lines, n_lines=100):
+    """Time short invocations of the t2t script
+
+    The commands are run on the first n_lines of the consensus and OTU maps
+    so that the time is dominated by starting the interpreter and importing
+    what the command needs.
+    """
+    script = find_script()
+    if script is None:
+        raise ValueError("Unable to find the t2t script")
+
+    tmp_dir = mkdtemp()
+    try:
+        cons_fp = os.path.join(tmp_dir, 'cons.txt')
+        reps_fp = os.path.join(tmp_dir, 'reps.txt')
+        otu_fp = os.path.join(tmp_dir, 'otus.txt')
+        out_fp = os.path.join(tmp_dir, 'out.txt')
+
+        # as with bench_remap, only the representatives have a taxonomy
+        reps = set(rmap.parse_otu_map(otu_lines[:n_lines]))
+        with open(cons_fp, 'w') as fh:
+            fh.write('\n'.join(lines[:n_lines]))
+        with open(reps_fp, 'w') as fh:
+            fh.write('\n'.join(line for line in lines
+                               if line.split('\t')[0] in reps))
+        with open(otu_fp, 'w') as fh:
+            fh.write('\n'.join(otu_lines[:n_lines]))
+
+        commands = [('version', ['--version']),
+                    ('validate', ['validate', '-t', cons_fp]),
+                    ('validate_flat', ['validate', '-t', cons_fp,
+                                       '--no-hierarchy-errors']),
+                    ('remap', ['remap', '-i', otu_fp, '-m', reps_fp,
+                               '-o', out_fp])]
+
+        # make sure the script uses this t2t
+        env = os.environ.copy()
+        root = os.path.dirname(os.path.dirname(os.path.abspath(t2t.__file__)))
+        env['PYTHONPATH'] = os.pathsep.join([root] + filter(None, [
+            env.get('PYTHONPATH')]))
+
+        with open(os.devnull, 'w') as devnull:
+            for name, args in commands:
+                with stats.stage(name):
+                    subprocess.check_call([sys.executable, script] + args,
+                                          stdout=devnull, env=env)
+    finally:
+        rmtree(tmp_dir)
+
+
+ENTRY_POINTS = ('decorate', 'consistency', 'validate', 'remap', 'startup')
+TREE_ENTRY_POINTS = ENTRY_POINTS[:-1]
+
+# the number of lines of the maps the startup commands are run on
+STARTUP_LINES = 100
+
+
+def _stage_records(params, entry, stats):
+    records = []
+    for stage in stats.stages:
+        record = params.copy()
+        record['entry'] = entry
+        record['stage'] = stage['name']
+        for key in ('wall_time', 'cpu_time', 'peak_rss_delta',
+                    'children_cpu_time'):
+            record[key] = stage[key]
+        records.append(record)
+    return records
+
+
+def run_benchmark(n_tips, shape='balanced', seed=0, noise=0.0,
+                  polyphyly=0.0, entry_points=TREE_ENTRY_POINTS):
+    """Time the entry points on a synthetic tree and consensus map
+
+    The startup of the script does not depend on the tree, see run_startup.
+
+    Returns
+    -------
+    list of dict
+        A record per stage, with the parameters of the benchmark
+    """
+    newick = make_tree(n_tips, shape, seed)
+    lines = make_consensus_map(n_tips, seed, noise, polyphyly)
+    otu_lines = make_otu_map(n_tips, seed)
+
+    params = {'version': t2t.__version__,
+              'n_tips': n_tips,
+              'shape': shape,
+              'seed': seed,
+              'noise': noise,
+              'polyphyly': polyphyly}
+
+    records = []
+    for entry in entry_points:
+        stats = StageStats(entry)
+        if entry == 'decorate':
+            bench_decorate(newick, lines, stats)
+        elif entry == 'consistency':
+            bench_consistency(newick, lines, stats)
+        elif entry == 'validate':
+            bench_validate(newick, lines, stats)
+        elif entry == 'remap':
+            bench_remap(newick, lines, stats, otu_lines)
+        else:
+            raise ValueError("Unknown entry point %s" % entry)
+        records.extend(_stage_records(params, entry, stats))
+
+    return records
+
+
+def run_startup(seed=0, noise=0.0, polyphyly=0.0, n_lines=STARTUP_LINES):
+    """Time short invocations of the script, see bench_startup
+
+    Returns
+    -------
+    list of dict
+        A record per command, without a tree shape, and with n_lines as the
+        number of tips
+    """
+    lines = make_consensus_map(n_lines, seed, noise, polyphyly)
+    otu_lines = make_otu_map(n_lines, seed)
+
+    params = {'version': t2t.__version__,
+              'n_tips': n_lines,
+              'shape': None,
+              'seed': seed,
+              'noise': noise,
+              'polyphyly': polyphyly}
+
+    stats = StageStats('startup')
+    bench_startup(lines, stats, otu_lines, n_lines)
+    return _stage_records(params, 'startup', stats)
+
+
+def write_results(records, fh):
+    """Write benchmark records to fh as JSON lines"""
+    for record in records:
+        fh.write(json.dumps(record, sort_keys=True))
+        fh.write('\n')
+
+
+def read_results(fh):
+    """Read the records written by write_results"""
+    return [json.loads(line) for line in fh if line.strip()]
+
+
+def _key(record):
+    return (record['entry'], record['stage'], record['shape'],
+            record['n_tips'], record['seed'], record['noise'],
+            record['polyphyly'])
+
+
+def compare_results(baseline, current, field='wall_time'):
+    """Compare two sets of benchmark records
+
+    Returns
+    -------
+    list of tuple
+        (entry, stage, shape, n_tips, baseline, current, current / baseline)
+        for the stages present in both
+    """
+    base = {_key(r): r[field] for r in baseline}
+    rows = []
+    for record in current:
+        key = _key(record)
+        if key not in base:
+            continue
+        ratio = record[field] / base[key] if base[key] else float('nan')
+        rows.append(key[:4] + (base[key], record[field], ratio))
+    return rows
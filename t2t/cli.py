@@ -1,40 +1,42 @@
-from skbio import TreeNode
+import os
 
-import t2t.nlevel as nl
 import t2t.validate as val
+from t2t.compression import strip_compression_ext
+from t2t.stats import timed
 
 
-def fetch(tree):
-    t = TreeNode.from_newick(open(tree))
-    ranks = set(nl.RANK_ORDER)
-    res = []
-    error = True
-
-    failed_nodes = []
-    for n in t.non_tips():
-        if n.name and n.name[0] not in ranks:
-            failed_nodes.append(n)
+def fetch(tree, context=None):
+    """Fetch the lineages of the tips of a decorated tree
 
-    if failed_nodes:
-        for n in failed_nodes:
-            tip = list(n.tips())[0]
-            tip_id = tip.name
-            path = [a.name for a in tip.ancestors() if a.name is not None]
-            res.append("Unknown rank: %s" % n.name)
-            res.append("\tA tip ID from the clade: %s" % tip_id)
-            res.append("\tCurrent lineage in tree: %s" % '; '.join(path[::-1]))
+    Parameters
+    ----------
+    tree : file
+        The newick of the tree
+    context : TaxonomyContext, optional
 
-    else:
-        res = nl.pull_consensus_strings(t)
-        error = False
+    Returns
+    -------
+    iterable of str
+        The lineage of each tip, or the report of the nodes whose names
+        have an unknown rank
+    bool
+        Whether there are such nodes
+    """
+    import t2t.fetch as ft
 
-    return res, error
+    scanned = ft.scan_newick(tree)
+    unknown = ft.unknown_ranks(scanned, context=context)
+    if unknown:
+        return unknown, True
+    return ft.iter_lineages(scanned, context=context), False
 
 
-def validate(lines, limit, flat_errors, hierarchy_errors):
+def validate(lines, limit, flat_errors, hierarchy_errors, stats=None):
     res = []
+    context = val.lines_context(lines)
     if flat_errors:
-        flat = val.flat_errors(lines)
+        with timed(stats, 'flat_errors'):
+            flat = val.flat_errors(lines, context)
         for err_type in sorted(flat):
             ids = ','.join(flat[err_type][:10])
 
@@ -47,7 +49,8 @@ def validate(lines, limit, flat_errors, hierarchy_errors):
             res.append('\t%s%s' % (ids, ellipse))
 
     if hierarchy_errors:
-        hier = val.hierarchy_errors(lines)
+        with timed(stats, 'hierarchy_errors'):
+            hier = val.hierarchy_errors(lines, context)
         if hier:
             res.append("Multiple parents")
         for err in hier:
@@ -56,3 +59,71 @@ def validate(lines, limit, flat_errors, hierarchy_errors):
                 res.append("\t\t%s, %s" % (parent, err['Parents'][parent]))
 
     return res, False
+
+
+def parse_manifest(lines, base_dir=''):
+    """Parse a manifest of consensus maps for a batch decorate
+
+    Each line is either the path to a consensus map, or a label and a path
+    separated by a tab. Blank lines and lines starting with # are ignored.
+    Relative paths are relative to base_dir.
+
+    Returns
+    -------
+    list of (str, str)
+        (label, path) for each consensus map
+
+    Raises
+    ------
+    ValueError
+        If a line has more than two fields or labels are not unique
+    """
+    labels = []
+    paths = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        fields = line.split('\t')
+        if len(fields) == 1:
+            labels.append(None)
+        elif len(fields) == 2:
+            labels.append(fields[0])
+        else:
+            raise ValueError("Unable to parse manifest line: %r" % line)
+        paths.append(os.path.join(base_dir, fields[-1]))
+
+    return batch_labels(paths, labels)
+
+
+def batch_labels(paths, labels=None):
+    """Label the consensus maps of a batch decorate
+
+    A consensus map without a label is labeled by its file name, without
+    the extension, and without that of a codec, e.g., .gz.
+
+    Returns
+    -------
+    list of (str, str)
+        (label, path) for each consensus map
+
+    Raises
+    ------
+    ValueError
+        If the labels are not unique
+    """
+    if labels is None:
+        labels = [None] * len(paths)
+
+    result = []
+    seen = set()
+    for label, path in zip(labels, paths):
+        if label is None:
+            name = os.path.basename(strip_compression_ext(path))
+            label = os.path.splitext(name)[0]
+        if label in seen:
+            raise ValueError("Consensus map label %s is not unique" % label)
+        seen.add(label)
+        result.append((label, path))
+    return result
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+"""Transparently compressed input and output files
+
+Inputs are recognized as gzip, bzip2 or zstd by their leading bytes, and are
+decompressed as they are read rather than into a temporary file first. Outputs
+are compressed according to the extension of their path. zstd requires the
+optional zstandard package, e.g., pip install tax2tree[zstd].
+"""
+
+import io
+import os
+import bz2
+import gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+# the leading bytes of each codec
+MAGIC = (('gzip', '\x1f\x8b'),
+         ('bz2', 'BZh'),
+         ('zstd', '\x28\xb5\x2f\xfd'))
+
+# the file extension of each codec
+EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.zst': 'zstd'}
+
+# the size of the buffers of decompressed input
+BUFFER_SIZE = 2 ** 20
+
+
+def sniff_compression(path):
+    """Returns the codec of the file at path, or None if it is uncompressed
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    str or None
+        'gzip', 'bz2' or 'zstd'
+    """
+    with open(path, 'rb') as fh:
+        head = fh.read(4)
+    for codec, magic in MAGIC:
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def codec_from_path(path):
+    """Returns the codec implied by the extension of path, or None"""
+    return EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def strip_compression_ext(path):
+    """Returns path without an extension of a codec, e.g., map.txt.gz"""
+    base, ext = os.path.splitext(path)
+    if ext.lower() in EXTENSIONS:
+        return base
+    return path
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise IOError("zstd files require the zstandard package, install "
+                      "it with pip install tax2tree[zstd]")
+
+
+def _open_decompressed(path, codec):
+    if codec == 'gzip':
+        # GzipFile iterates lines in Python, the buffered reader in C
+        return io.BufferedReader(gzip.GzipFile(path, 'rb'), BUFFER_SIZE)
+    elif codec == 'bz2':
+        return bz2.BZ2File(path, 'rb', BUFFER_SIZE)
+    elif codec == 'zstd':
+        _require_zstd()
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+        return io.BufferedReader(reader, BUFFER_SIZE)
+    raise ValueError("Unknown codec: %s" % codec)
+
+
+class CompressedInput(object):
+    """A read only file handle over a compressed file
+
+    Parameters
+    ----------
+    path : str
+    codec : str
+        'gzip', 'bz2' or 'zstd'
+
+    Notes
+    -----
+    The handle has the name of the compressed file. It can only be sought to
+    its start, by opening the file again, which is what the commands need to
+    read the first line of a consensus map twice.
+    """
+    def __init__(self, path, codec):
+        self.name = path
+        self.codec = codec
+        self.mode = 'rb'
+        self._fh = _open_decompressed(path, codec)
+
+    @property
+    def closed(self):
+        return self._fh.closed
+
+    def read(self, size=-1):
+        return self._fh.read(size)
+
+    def readline(self, size=-1):
+        return self._fh.readline(size)
+
+    def readlines(self):
+        return self._fh.readlines()
+
+    def __iter__(self):
+        return iter(self._fh)
+
+    def next(self):
+        return next(self._fh)
+
+    def tell(self):
+        return self._fh.tell()
+
+    def seek(self, offset, whence=0):
+        if (offset, whence) != (0, 0):
+            raise IOError("A compressed input can only be sought to its "
+                          "start")
+        self._fh.close()
+        self._fh = _open_decompressed(self.name, self.codec)
+
+    def close(self):
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_input(path):
+    """Open path for reading, decompressing it if needed
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    file or CompressedInput
+        A file in universal newline mode if path is not compressed
+    """
+    codec = sniff_compression(path)
+    if codec is None:
+        return open(path, 'U')
+    return CompressedInput(path, codec)
+
+
+def is_compressed(fh):
+    """Whether the file handle fh was opened through a codec"""
+    return isinstance(fh, CompressedInput)
+
+
+class _ZstdOutput(object):
+    """Closes the file of a zstd stream writer with it"""
+    def __init__(self, path, level):
+        _require_zstd()
+        self.name = path
+        self._raw = open(path, 'wb')
+        compressor = zstandard.ZstdCompressor(level=level)
+        self._fh = compressor.stream_writer(self._raw)
+
+    def write(self, data):
+        self._fh.write(data)
+
+    def close(self):
+        if self._raw.closed:
+            return
+        try:
+            self._fh.flush(zstandard.FLUSH_FRAME)
+        finally:
+            self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_output(path, codec=None):
+    """Open path for writing, compressing if needed
+
+    Parameters
+    ----------
+    path : str
+    codec : str, optional
+        'gzip', 'bz2' or 'zstd'. Defaults to the codec implied by the
+        extension of path, if any.
+
+    Returns
+    -------
+    file
+    """
+    if codec is None:
+        codec = codec_from_path(path)
+
+    if codec is None:
+        return open(path, 'wb')
+    elif codec == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=6)
+    elif codec == 'bz2':
+        return bz2.BZ2File(path, 'wb', compresslevel=9)
+    elif codec == 'zstd':
+        return _ZstdOutput(path, level=3)
+    raise ValueError("Unknown codec: %s" % codec)
@@ -0,0 +1,526 @@
+#!/usr/bin/env python
+
+"""Loading of large consensus maps
+
+load_consensus_map parses a map line by line in one process. For maps of tens
+of millions of lines, load_consensus_map_parallel splits the file into byte
+ranges that start on a line, loads each range in a pool of worker processes
+with load_consensus_map, and merges the ranges in file order. The workers
+return their lineages encoded as integer codes, which are cheap to send
+back, and the result is either the usual dict or a ConsensusMatrix.
+
+A taxonomy can also cover many more sequences than a tree has tips. A
+ConsensusIndex stores a consensus map in an SQLite database, built once and
+keyed by the content hash of the map, and an IndexedConsensusMap loads only
+the lineages that are asked for, so that load_tree cleans only the lineages of
+the tips of the tree.
+"""
+
+import os
+import sqlite3
+from itertools import izip
+from multiprocessing import Pool
+
+from numpy import array, concatenate, int32, zeros
+
+import t2t.nlevel as nl
+from t2t.compression import open_input, sniff_compression
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+# the default number of bytes loaded by a worker at a time
+CHUNK_SIZE = 2 ** 24
+
+# bump if the layout of the index changes so stale indexes are not reused
+INDEX_VERSION = 1
+
+# the number of ids looked up by one query, below the SQLite limit of 999
+FETCH_BATCH = 500
+
+
+class ConsensusMatrix(object):
+    """A consensus map encoded as integer codes
+
+    Parameters
+    ----------
+    ids : list of str
+        The ids
+    lineages : ndarray of int
+        The row of table of each id
+    table : ndarray of int32
+        The distinct lineages, one column per rank. A code indexes names.
+    names : list of str
+        The distinct names. names[0] is None, for missing names.
+    """
+    def __init__(self, ids, lineages, table, names):
+        self.ids = ids
+        self.lineages = lineages
+        self.table = table
+        self.names = names
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __reduce__(self):
+        # ids are lines of a file, so never contain a newline, and one string
+        # pickles far faster than many
+        return (_unpickle_matrix, ('\n'.join(self.ids), self.lineages,
+                                   self.table, self.names))
+
+    @property
+    def codes(self):
+        """The name codes of each id, one row per id"""
+        return self.table[self.lineages]
+
+    def to_dict(self):
+        """Returns the map as load_consensus_map does"""
+        return matrices_to_dict([self])
+
+
+def _unpickle_matrix(ids, lineages, table, names):
+    return ConsensusMatrix(ids.split('\n') if ids else [], lineages, table,
+                           names)
+
+
+def _encode_names(names, name_index, new_names):
+    """Returns the codes of names, adding unseen names to name_index"""
+    codes = []
+    for name in names:
+        try:
+            codes.append(name_index[name])
+        except KeyError:
+            name_index[name] = len(new_names)
+            codes.append(len(new_names))
+            new_names.append(name)
+    return codes
+
+
+def encode_consensus_map(mapping, n_ranks):
+    """Returns a ConsensusMatrix of a dict from load_consensus_map
+
+    Lineages that are the same list, as load_consensus_map returns for
+    identical lineages, are encoded once.
+    """
+    names = [None]
+    name_index = {None: 0}
+    ids = mapping.keys()
+    keys = map(id, mapping.itervalues())
+    distinct = dict(izip(keys, mapping.itervalues()))
+    row_index = dict(izip(distinct, xrange(len(distinct))))
+    lineages = map(row_index.__getitem__, keys)
+    rows = [_encode_names(lineage, name_index, names)
+            for lineage in distinct.itervalues()]
+
+    table = array(rows, dtype=int32).reshape((len(rows), n_ranks))
+    return ConsensusMatrix(ids, array(lineages, dtype=int), table, names)
+
+
+def chunk_offsets(fp, chunk_size=CHUNK_SIZE):
+    """Returns byte ranges of fp that start and end on line boundaries
+
+    Returns
+    -------
+    list of (int, int)
+        The start and stop of each range. The ranges cover the file.
+    """
+    size = os.path.getsize(fp)
+    offsets = []
+    with open(fp, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(start + chunk_size)
+            f.readline()
+            stop = min(f.tell(), size)
+            if stop <= start:
+                stop = size
+            offsets.append((start, stop))
+            start = stop
+    return offsets
+
+
+def _read_range(fp, start, stop):
+    """Returns the lines of fp from start to stop"""
+    with open(fp, 'rb') as f:
+        f.seek(start)
+        lines = f.read(stop - start).split('\n')
+    if lines and not lines[-1]:
+        lines.pop()
+    return lines
+
+
+# the context of a worker, set by _init_worker
+_CONTEXT = None
+
+
+def _init_worker(rank_order, bad_names):
+    global _CONTEXT
+    _CONTEXT = nl.TaxonomyContext(rank_order, bad_names)
+
+
+def _load_range(context, fp, start, stop, options):
+    """Loads a byte range of fp
+
+    Returns
+    -------
+    ConsensusMatrix or None
+        The loaded range, or None on an error
+    tuple of (int, str) or None
+        The line number within the range and the reason for an error
+    """
+    try:
+        mapping = _load_lines(_read_range(fp, start, stop), context, options)
+    except nl.ConsensusMapError as e:
+        return None, (e.lineno, e.reason)
+    return encode_consensus_map(mapping, context.n_ranks), None
+
+
+def _load_range_in_worker(args):
+    return _load_range(_CONTEXT, *args)
+
+
+def _load_lines(lines, context, options):
+    """load_consensus_map of lines, with options in the order of its args"""
+    append_rank, check_bad, check_min_inform, assert_nranks, check_euk_unc = \
+        options
+    return nl.load_consensus_map(lines, append_rank, check_bad=check_bad,
+                                 check_min_inform=check_min_inform,
+                                 assert_nranks=assert_nranks,
+                                 check_euk_unc=check_euk_unc,
+                                 context=context)
+
+
+def _count_lines(fp, stop):
+    """Returns the number of lines of fp before the byte offset stop"""
+    count = 0
+    with open(fp, 'rb') as f:
+        while f.tell() < stop:
+            block = f.read(min(2 ** 20, stop - f.tell()))
+            if not block:
+                break
+            count += block.count('\n')
+    return count
+
+
+def matrices_to_dict(matrices):
+    """Returns the map of several ConsensusMatrix, later ones winning for an id
+
+    Identical lineages share the same list, as they do for
+    load_consensus_map.
+    """
+    name_pool = {}
+    shared = {}
+    mapping = {}
+    for m in matrices:
+        names = [name_pool.setdefault(n, n) for n in m.names]
+        lists = []
+        for row in m.table.tolist():
+            lineage = [names[c] for c in row]
+            lists.append(shared.setdefault(tuple(lineage), lineage))
+        mapping.update(izip(m.ids, [lists[i] for i in m.lineages.tolist()]))
+    return mapping
+
+
+def merge_matrices(matrices, n_ranks):
+    """Returns one ConsensusMatrix of several, later ones winning for an id
+
+    The names and lineages of each matrix are recoded to those of the result.
+    """
+    names = [None]
+    name_index = {None: 0}
+    rows = []
+    row_index = {}
+    ids = []
+    parts = []
+
+    for m in matrices:
+        recode = array(_encode_names(m.names, name_index, names), dtype=int32)
+        relineage = []
+        for row in recode[m.table].tolist():
+            key = tuple(row)
+            try:
+                relineage.append(row_index[key])
+            except KeyError:
+                row_index[key] = len(rows)
+                relineage.append(len(rows))
+                rows.append(row)
+        parts.append(array(relineage, dtype=int)[m.lineages])
+        ids.extend(m.ids)
+
+    if parts:
+        lineages = concatenate(parts)
+    else:
+        lineages = zeros(0, dtype=int)
+
+    # an id seen again replaces the earlier one, as in a dict
+    positions = dict(izip(ids, xrange(len(ids))))
+    if len(positions) < len(ids):
+        keep = array(sorted(positions.itervalues()), dtype=int)
+        ids = [ids[i] for i in keep]
+        lineages = lineages[keep]
+
+    table = array(rows, dtype=int32).reshape((len(rows), n_ranks))
+    return ConsensusMatrix(ids, lineages, table, names)
+
+
+def load_consensus_map_parallel(fp, append_rank, check_bad=True,
+                                check_min_inform=True, assert_nranks=True,
+                                check_euk_unc=False, context=None, jobs=None,
+                                chunk_size=CHUNK_SIZE, encoded=False):
+    """Loads the consensus map in the file fp with a pool of processes
+
+    Parameters
+    ----------
+    fp : str
+        The path of the consensus map
+    append_rank, check_bad, check_min_inform, assert_nranks, check_euk_unc
+        As for load_consensus_map
+    context : TaxonomyContext, optional
+        The context, defaults to the module level settings
+    jobs : int, optional
+        The number of worker processes, defaults to the number of CPUs
+    chunk_size : int
+        The number of bytes loaded by a worker at a time
+    encoded : bool
+        Return a ConsensusMatrix rather than a dict
+
+    Returns
+    -------
+    dict or ConsensusMatrix
+        The map, equal to that of load_consensus_map
+
+    Raises
+    ------
+    ConsensusMapError
+        For the first line, in file order, that cannot be loaded
+    """
+    context = nl.get_context(context)
+    options = (append_rank, check_bad, check_min_inform, assert_nranks,
+               check_euk_unc)
+    # the byte ranges of a compressed file cannot be read independently, it
+    # is loaded serially
+    offsets = []
+    if sniff_compression(fp) is None:
+        offsets = chunk_offsets(fp, chunk_size)
+    args = [(fp, start, stop, options) for start, stop in offsets]
+
+    if jobs == 1 or len(args) <= 1:
+        with open_input(fp) as lines:
+            mapping = _load_lines(lines, context, options)
+        if encoded:
+            return encode_consensus_map(mapping, context.n_ranks)
+        return mapping
+
+    # each worker keeps a context, and its caches, for all of its ranges
+    pool = Pool(jobs, _init_worker, (context.rank_order, context.bad_names))
+    try:
+        results = pool.map(_load_range_in_worker, args, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    matrices = []
+    for (start, stop), (matrix, error) in zip(offsets, results):
+        if error is not None:
+            lineno, reason = error
+            raise nl.ConsensusMapError(_count_lines(fp, start) + lineno,
+                                       reason)
+        matrices.append(matrix)
+
+    if encoded:
+        return merge_matrices(matrices, context.n_ranks)
+    return matrices_to_dict(matrices)
+
+
+def index_path(index_dir, digest):
+    """Returns the path of the index of a consensus map with digest"""
+    return os.path.join(index_dir,
+                        'consensus-v%d-%s.sqlite' % (INDEX_VERSION, digest))
+
+
+def _index_rows(lines):
+    """Yields (id, line number, consensus string) of each line"""
+    for lineno, line in enumerate(lines, 1):
+        fields = line.strip().split('\t')
+        if len(fields) != 2:
+            raise nl.ConsensusMapError(lineno, "expected an id and a "
+                                               "consensus string separated "
+                                               "by a tab")
+        yield fields[0].strip(), lineno, fields[1]
+
+
+def build_index(lines, path):
+    """Writes an SQLite index of the consensus map lines to path
+
+    The index is written to a temporary file that is renamed into place, so
+    an interrupted build does not leave a partial index behind. As for
+    load_consensus_map, a later line replaces an earlier one with the same id.
+    """
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    conn = sqlite3.connect(tmp)
+    conn.text_factory = str
+    built = False
+    try:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("CREATE TABLE consensus (id TEXT PRIMARY KEY, "
+                     "line INTEGER NOT NULL, consensus TEXT NOT NULL)")
+        conn.executemany("INSERT OR REPLACE INTO consensus VALUES (?, ?, ?)",
+                         _index_rows(lines))
+        conn.execute("CREATE INDEX consensus_line ON consensus (line)")
+        conn.commit()
+        built = True
+    finally:
+        conn.close()
+        if not built:
+            os.remove(tmp)
+
+    os.rename(tmp, path)
+
+
+class ConsensusIndex(object):
+    """A consensus map stored in an SQLite database
+
+    Parameters
+    ----------
+    path : str
+        The database, as written by build_index
+    """
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.text_factory = str
+
+    @classmethod
+    def from_file(cls, fp, index_dir):
+        """Returns the index of the consensus map fp, building it if needed"""
+        from t2t.treecache import file_digest
+
+        path = index_path(index_dir, file_digest(fp))
+        if not os.path.exists(path):
+            if not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+            with open_input(fp) as lines:
+                build_index(lines, path)
+        return cls(path)
+
+    def __len__(self):
+        query = "SELECT COUNT(*) FROM consensus"
+        return self.conn.execute(query).fetchone()[0]
+
+    def items(self):
+        """Yields (id, consensus string) of every line, in file order"""
+        return iter(self.conn.execute("SELECT id, consensus FROM consensus "
+                                      "ORDER BY line"))
+
+    def lines(self):
+        """Yields the lines of the consensus map, in file order"""
+        for id_, consensus in self.items():
+            yield "%s\t%s" % (id_, consensus)
+
+    def rows(self, ids):
+        """Returns (line number, id, consensus string) of ids in the index
+
+        Ids that are not in the index are skipped. The rows are in file order.
+        """
+        ids = list(set(ids))
+        rows = []
+        for start in xrange(0, len(ids), FETCH_BATCH):
+            batch = ids[start:start + FETCH_BATCH]
+            query = ("SELECT line, id, consensus FROM consensus WHERE id IN "
+                     "(%s)" % ', '.join('?' * len(batch)))
+            rows.extend(self.conn.execute(query, batch))
+        rows.sort()
+        return rows
+
+    def distinct_rows(self):
+        """Returns (line number, consensus string) of each distinct lineage
+
+        The line number is that of the first line with the lineage.
+        """
+        return self.conn.execute("SELECT MIN(line), consensus FROM consensus "
+                                 "GROUP BY consensus ORDER BY MIN(line)"
+                                 ).fetchall()
+
+    def consensus_map(self, append_rank, check_bad=True,
+                      check_min_inform=True, assert_nranks=True,
+                      check_euk_unc=False, context=None):
+        """Returns an IndexedConsensusMap, see load_consensus_map"""
+        options = (append_rank, check_bad, check_min_inform, assert_nranks,
+                   check_euk_unc)
+        return IndexedConsensusMap(self, options, nl.get_context(context))
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class IndexedConsensusMap(object):
+    """A consensus map whose lineages are loaded from an index on demand
+
+    load_tree fetches the lineages of the tips of the tree, and values
+    returns each distinct lineage of the whole map once. A line that cannot
+    be loaded raises a ConsensusMapError with its line number in the file,
+    but only when its lineage is loaded.
+
+    Parameters
+    ----------
+    index : ConsensusIndex
+    options : tuple
+        append_rank, check_bad, check_min_inform, assert_nranks and
+        check_euk_unc, as for load_consensus_map
+    context : TaxonomyContext
+    """
+    def __init__(self, index, options, context):
+        self.index = index
+        self.options = options
+        self.context = context
+
+    def _load(self, rows):
+        """Returns the map of (line number, id, consensus string) rows"""
+        lines = ["%s\t%s" % (id_, consensus) for _, id_, consensus in rows]
+        try:
+            return _load_lines(lines, self.context, self.options)
+        except nl.ConsensusMapError as e:
+            raise nl.ConsensusMapError(rows[e.lineno - 1][0], e.reason)
+
+    def fetch(self, ids):
+        """Returns {id_: [tax, string]} for ids in the map"""
+        return self._load(self.index.rows(i for i in ids if i is not None))
+
+    def get(self, id_, default=None):
+        return self.fetch([id_]).get(id_, default)
+
+    def __getitem__(self, id_):
+        result = self.fetch([id_])
+        if id_ not in result:
+            raise KeyError(id_)
+        return result[id_]
+
+    def __contains__(self, id_):
+        return bool(self.index.rows([id_]))
+
+    def __len__(self):
+        return len(self.index)
+
+    def values(self):
+        """Returns each distinct lineage of the map once"""
+        rows = [(lineno, str(i), consensus)
+                for i, (lineno, consensus) in
+                enumerate(self.index.distinct_rows())]
+        return self._load(rows).values()
@@ -6,13 +6,14 @@ load_consensus_map
 make_consensus_tree
 etc...
 """
-from nlevel import RANK_ORDER
 from numpy import zeros, where, logical_or
 
+from t2t.nlevel import get_context
 
-def taxa_score(master, reps):
+
+def taxa_score(master, reps, context=None):
     """Score taxa strings by contradictions observed in reps"""
-    n_ranks = len(RANK_ORDER)
+    n_ranks = get_context(context).n_ranks
     master_ids = frozenset(master.keys())
 
     master_order = master.keys()
@@ -52,9 +53,9 @@ def merge_taxa_strings_and_scores(master, scores):
     return {k: zip(v, scores[k]) for k, v in master.items()}
 
 
-def taxa_score_hash(master, reps):
+def taxa_score_hash(master, reps, context=None):
     """Score each taxonomy string based on contradictions observed in reps"""
-    n_ranks = len(RANK_ORDER)
+    n_ranks = get_context(context).n_ranks
 
     master_order = master.keys()
     scores = zeros((len(master_order), n_ranks), dtype=float)
@@ -124,9 +125,9 @@ def get_consensus_stats(consensus_map):
     return (n_seqs, n_names)
 
 
-def pretty_print_consensus_stats(stats):
+def pretty_print_consensus_stats(stats, context=None):
     seqs, names = stats
     print '\t'.join(['rank', 'num_classified', 'num_unclassified',
                      'num_names'])
-    for k in RANK_ORDER:
+    for k in get_context(context).rank_order:
         print '\t'.join(map(str, [k, seqs[k][0], seqs[k][1], len(names[k])]))
@@ -1,5 +1,11 @@
 #!/usr/bin/env python
 
+from collections import defaultdict
+
+from numpy import mean
+
+from t2t.compression import open_output
+
 __author__ = "Donovan Park"
 __copyright__ = "Copyright 2014, The tax2tree project"
 __credits__ = ["Donovan Park"]
@@ -9,10 +15,6 @@ __maintainer__ = "Donovan Park"
 __email__ = "donovan.parks@gmail.com"
 __status__ = "Development"
 
-from collections import defaultdict
-
-from numpy import mean
-
 
 class Consistency(object):
     """Calculates the consistency of taxonomic groups within a reference tree.
@@ -90,7 +92,7 @@ class Consistency(object):
           Taxonomic consistency returned by Consistency.calculate()
         """
 
-        fout = open(output_file, 'w')
+        fout = open_output(output_file)
         fout.write('Taxon\tCount\tConsistency\n')
         for rank in xrange(self.n_ranks):
             for name, consistency in consistency_index[rank].iteritems():
@@ -112,7 +114,7 @@ class Consistency(object):
         min_taxa: minimum taxa in group for inclusion in calculated average
         """
 
-        fout = open(output_file, 'w')
+        fout = open_output(output_file)
         fout.write('Rank #\tRank prefix\t# taxon\tAverage consistency\n')
         for rank in xrange(self.n_ranks):
             val = []
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""Lineages of a decorated newick, without building a TreeNode
+
+The newick is scanned once, in blocks, into the name and parent of each node
+in postorder. Walking the nodes in reverse postorder visits each parent before
+its children, so the lineage of every node is derived from that of its parent
+with the names of the node applied, and the lineages of the tips follow in
+O(n). Nodes with names of an unknown rank are reported with the first of
+their tips and the names above that tip, without a traversal per node.
+"""
+
+from t2t.newick import read_tokens, newick_nodes
+import t2t.nlevel as nl
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+class ScannedTree(object):
+    """The nodes of a newick, in postorder
+
+    Attributes
+    ----------
+    names : list of str or None
+    parents : list of int
+        The index of the parent of each node, -1 for the root
+    first_tips : list of int
+        The index of the first tip of each node, its own for a tip
+    tips : list of int
+        The indices of the tips, in the order of the newick
+    """
+    def __init__(self, names, parents, first_tips, tips):
+        self.names = names
+        self.parents = parents
+        self.first_tips = first_tips
+        self.tips = tips
+
+
+def scan_newick(fh):
+    """Scan the newick in fh, see ScannedTree
+
+    Parameters
+    ----------
+    fh : file
+
+    Returns
+    -------
+    ScannedTree
+    """
+    names = []
+    parents = []
+    first_tips = []
+    tips = []
+    # the nodes whose parent has not been closed yet
+    pending = []
+
+    for idx, (name, _, n_children) in \
+            enumerate(newick_nodes(read_tokens(fh))):
+        names.append(name)
+        parents.append(-1)
+        if n_children:
+            children = pending[-n_children:]
+            del pending[-n_children:]
+            for child in children:
+                parents[child] = idx
+            first_tips.append(first_tips[children[0]])
+        else:
+            tips.append(idx)
+            first_tips.append(idx)
+        pending.append(idx)
+
+    return ScannedTree(names, parents, first_tips, tips)
+
+
+def _split_names(name):
+    """The names of a node, as iter_consensus_strings applies them"""
+    if ';' in name:
+        return [n.strip() for n in name.split(';')]
+    return [name]
+
+
+def unknown_ranks(scanned, context=None):
+    """Report the internal nodes with a name of an unknown rank
+
+    Parameters
+    ----------
+    scanned : ScannedTree
+    context : TaxonomyContext, optional
+
+    Returns
+    -------
+    list of str
+        For each node, in postorder, its name, the id of its first tip and
+        the names over that tip, as fetch reports them. Empty if every name
+        has a known rank.
+    """
+    rank_index = nl.get_context(context).rank_index
+    names = scanned.names
+    parents = scanned.parents
+
+    failed = []
+    for idx, name in enumerate(names):
+        if not name or scanned.first_tips[idx] == idx:
+            continue
+        if any(not n or n[0] not in rank_index for n in _split_names(name)):
+            failed.append(idx)
+    if not failed:
+        return []
+
+    # the lineage of the closest named node at or over each node, carried down
+    # in reverse postorder so that the parent of a node is set before it,
+    # rather than walking up from every node. Unnamed nodes share the string
+    # of their parent, and the tips need none
+    first_tips = scanned.first_tips
+    lineages = [None] * len(names)
+    for idx in xrange(len(names) - 1, -1, -1):
+        if first_tips[idx] == idx:
+            continue
+        parent = parents[idx]
+        over = lineages[parent] if parent >= 0 else None
+        if names[idx]:
+            lineages[idx] = names[idx] if over is None else \
+                '; '.join((over, names[idx]))
+        else:
+            lineages[idx] = over
+
+    res = []
+    for idx in failed:
+        tip = first_tips[idx]
+        lineage = lineages[parents[tip]]
+        res.append("Unknown rank: %s" % names[idx])
+        res.append("\tA tip ID from the clade: %s" % names[tip])
+        res.append("\tCurrent lineage in tree: %s" % (lineage or ''))
+    return res
+
+
+def iter_lineages(scanned, append_prefix=True, context=None):
+    """Yields the consensus string of each tip, as iter_consensus_strings
+
+    Parameters
+    ----------
+    scanned : ScannedTree
+        A tree whose names all have known ranks, see unknown_ranks
+    append_prefix : bool
+        Give the ranks without a name their prefix, e.g., g__
+    context : TaxonomyContext, optional
+
+    Returns
+    -------
+    generator of str
+        The tab separated tip id and consensus string of each tip, in the
+        order of the newick
+    """
+    context = nl.get_context(context)
+    rank_index = context.rank_index
+    if append_prefix:
+        empty = ['%s__' % r for r in context.rank_order]
+    else:
+        empty = ['' for r in context.rank_order]
+
+    names = scanned.names
+    parents = scanned.parents
+
+    # the lineage, its consensus string and the ranks it names, of each
+    # internal node. A node without a name shares those of its parent. As
+    # iter_consensus_strings walks up and overwrites, the name of a rank
+    # closest to the root wins, so a node only names the ranks that its
+    # ancestors leave empty.
+    lineages = [None] * len(names)
+    root = (empty, '; '.join(empty), (False,) * len(empty))
+    for idx in xrange(len(names) - 1, -1, -1):
+        if scanned.first_tips[idx] == idx:
+            continue
+
+        parent = parents[idx]
+        lineage = root if parent < 0 else lineages[parent]
+        name = names[idx]
+        if name:
+            consensus = lineage[0][:]
+            named = list(lineage[2])
+            for n in _split_names(name):
+                rank = rank_index[n[0]]
+                if not lineage[2][rank]:
+                    consensus[rank] = n
+                    named[rank] = True
+            lineage = (consensus, '; '.join(consensus), tuple(named))
+        lineages[idx] = lineage
+
+    for tip in scanned.tips:
+        parent = parents[tip]
+        lineage = root if parent < 0 else lineages[parent]
+        yield '\t'.join([names[tip] or '', lineage[1]])
@@ -0,0 +1,628 @@
+#!/usr/bin/env python
+
+"""Incremental decoration
+
+The decorate pipeline counts the names of the tips below every node from the
+tips themselves. An IncrementalDecoration instead keeps those counts on each
+node, as TaxaCount, along with the names each node picked before the fold.
+When tips are inserted, or the lineages of tips change, only the counts of
+the nodes on their paths to the root change. Those nodes are rescored. The
+relative frequencies of the other nodes change only for the names whose
+totals changed, and only frequencies of at least 0.5 decide RankSafe and the
+names picked. These are held by the few nodes with at least half of the tips
+of a name, which are the only other nodes rescored. The fold is then redone
+only for the names the rescored nodes picked, before or after the change.
+
+The stages from set_preliminary_name_and_rank on are single walks of the tree
+and are rerun over the whole tree, as make_names_unique numbers each name
+over the whole tree. The decorated tree and consensus strings are those of
+run_decorate on the same tree and consensus map.
+"""
+
+import os
+import gzip
+import cPickle
+
+import t2t.nlevel as nl
+import t2t.pipeline as pl
+from t2t.stats import timed
+from t2t.treecache import tree_to_arrays, arrays_to_tree
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+# bump if the layout of a saved decoration changes
+CACHE_VERSION = 2
+
+# the node attributes kept by a saved decoration
+NODE_ATTRS = ('Consensus', 'Bootstrap', 'NumTips', 'TaxaCount',
+              'ConsensusRelFreq', 'ValidRelFreq', 'RankSafe', 'PickedNames',
+              'RankNameScores', 'RankNames')
+
+# the stages rerun after the counts and scores are updated
+NAMING_STAGES = pl.DECORATE_STAGES[
+    pl.STAGE_NAMES.index('set_preliminary_name_and_rank'):]
+
+
+def parse_insertions(lines):
+    """Parse the tips to insert into a decorated tree
+
+    Each line is the id of the new tip, the comma separated ids of the tips
+    whose lowest common ancestor the new tip is placed beside, and optionally
+    the branch length of the new tip, separated by tabs.
+
+    Returns
+    -------
+    list of (str, list of str, float or None)
+    """
+    insertions = []
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        fields = line.split('\t')
+        if len(fields) not in (2, 3):
+            raise ValueError("Line %d of the insertions: expected 2 or 3 "
+                             "fields, found %d" % (lineno, len(fields)))
+
+        anchors = [a.strip() for a in fields[1].split(',') if a.strip()]
+        if not anchors:
+            raise ValueError("Line %d of the insertions: no anchor tips" %
+                             lineno)
+
+        length = None
+        if len(fields) == 3:
+            try:
+                length = float(fields[2])
+            except ValueError:
+                raise ValueError("Line %d of the insertions: bad length %r" %
+                                 (lineno, fields[2]))
+
+        insertions.append((fields[0].strip(), anchors, length))
+    return insertions
+
+
+def parse_lineage_diff(lines, context=None):
+    """Parse changes to the lineages of ids
+
+    Each line is an id, its old consensus string and its new one, separated
+    by tabs. The consensus strings are cleaned as load_consensus_map does.
+
+    Returns
+    -------
+    list of (str, list, list)
+    """
+    diff = []
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        fields = line.split('\t')
+        if len(fields) != 3:
+            raise ValueError("Line %d of the lineage diff: expected 3 "
+                             "fields, found %d" % (lineno, len(fields)))
+
+        id_ = fields[0].strip()
+        try:
+            old, new = [nl.load_consensus_map(['%s\t%s' % (id_, con)], False,
+                                              context=context)[id_]
+                        for con in fields[1:]]
+        except nl.ConsensusMapError as e:
+            raise ValueError("Line %d of the lineage diff: %s" %
+                             (lineno, e.reason))
+        diff.append((id_, old, new))
+    return diff
+
+
+def _add_counts(counts, other, step=1):
+    """Add the name counts of other to counts, or subtract if step is -1"""
+    for rank, names in other.iteritems():
+        rank_counts = counts[rank]
+        for name, count in names.iteritems():
+            count = rank_counts.get(name, 0) + step * count
+            if count:
+                rank_counts[name] = count
+            else:
+                del rank_counts[name]
+
+
+def _picked(names):
+    """Returns the (rank, name) of the names a node picked before the fold"""
+    return [(rank, name) for rank, name in enumerate(names)
+            if name is not None]
+
+
+def _lowest_common_ancestor(nodes):
+    """Returns the deepest node that all of nodes descend from"""
+    lca = nodes[0]
+    path = set()
+    node = lca
+    while node is not None:
+        path.add(node)
+        node = node.parent
+
+    for node in nodes[1:]:
+        while node not in path:
+            node = node.parent
+        # trim the path to the ancestors of the new lca
+        while lca is not node:
+            path.discard(lca)
+            lca = lca.parent
+    return lca
+
+
+class IncrementalDecoration(object):
+    """A decoration that is updated in place as tips and lineages change
+
+    Parameters
+    ----------
+    tree : str, file or TreeNode
+        The input tree, as accepted by load_tree
+    tipname_map : dict
+        {id_: [tax, string]}, as returned by load_consensus_map
+    min_count, no_suffix, suffix_char
+        As for run_decorate
+    context : TaxonomyContext, optional
+
+    Attributes
+    ----------
+    tree : TreeNode
+        The decorated tree, named once decorate is called
+    totals : dict of dict
+        [rank][name] -> count, as collect_names_at_ranks_counts
+    """
+    def __init__(self, tree, tipname_map, min_count=2, no_suffix=False,
+                 suffix_char='_', context=None):
+        self.tipname_map = tipname_map
+        self.min_count = min_count
+        self.no_suffix = no_suffix
+        self.suffix_char = suffix_char
+        self.context = nl.get_context(context)
+
+        n_ranks = self.context.n_ranks
+        self.tree = nl.load_tree(tree, tipname_map, context=self.context)
+        self.totals = {i: {} for i in range(n_ranks)}
+
+        for node in self.tree.postorder(include_self=True):
+            if node.is_tip():
+                self._init_tip(node)
+                continue
+
+            counts = {i: {} for i in range(n_ranks)}
+            for child in node.children:
+                _add_counts(counts, self._counts(child))
+            node.TaxaCount = counts
+            node.NumTips = sum(c.NumTips for c in node.children)
+
+        nodes = list(self.tree.non_tips(include_self=True))
+        for node in nodes:
+            self._score(node)
+
+        self._index()
+        self._holders = {}
+        for node in nodes:
+            for key in _picked(node.PickedNames):
+                self._holders.setdefault(key, set()).add(node)
+
+        self._winners = {}
+        for key in self._holders:
+            self._fold(key)
+        for node in nodes:
+            self._set_rank_names(node)
+
+    def _init_tip(self, tip):
+        """Set the attributes the pipeline sets on a tip, and count it"""
+        n_ranks = self.context.n_ranks
+        tip.NumTips = tip.Consensus != [None] * n_ranks
+        tip.ConsensusRelFreq = None
+        tip.ValidRelFreq = None
+        tip.RankSafe = 0
+        _add_counts(self.totals, self._counts(tip))
+
+    def _counts(self, node):
+        """Returns the name counts of the tips of node"""
+        if node.children:
+            return node.TaxaCount
+        return {rank: {name: 1}
+                for rank, name in enumerate(node.Consensus)
+                if name is not None}
+
+    def _score(self, node):
+        """Compute the frequencies, RankSafe and names picked at a node"""
+        node.ConsensusRelFreq, node.ValidRelFreq = nl.node_relative_freqs(
+            node.TaxaCount, node.NumTips, self.totals, self.min_count)
+        self._pick(node)
+
+    def _pick(self, node):
+        """Compute the RankSafe and names picked at a node"""
+        n_ranks = self.context.n_ranks
+        node.RankSafe = nl.node_ranksafe(node.ConsensusRelFreq, n_ranks)
+        node.PickedNames = nl.node_rank_names(node.RankSafe,
+                                              node.ConsensusRelFreq, n_ranks)
+        node.RankNameScores = [None] * n_ranks
+        for rank, name in _picked(node.PickedNames):
+            self._score_name(node, rank)
+
+    def _score_name(self, node, rank):
+        """Score the name picked at rank, as name_node_score_fold"""
+        name = node.PickedNames[rank]
+        node.RankNameScores[rank] = nl.fmeasure(
+            node.ValidRelFreq[rank][name], node.ConsensusRelFreq[rank][name])
+
+    def _record_totals(self, changed, lineage):
+        """Keep the totals of the names of lineage before they change"""
+        for rank, name in enumerate(lineage):
+            if name is not None and (rank, name) not in changed:
+                changed[(rank, name)] = self.totals[rank].get(name, 0)
+
+    def _tip_lookup(self):
+        """Returns {name: tip} of the tips of the tree"""
+        return {tip.name: tip for tip in self.tree.tips()}
+
+    def _index(self):
+        """Number the tips and nodes of the tree in postorder"""
+        self._postorder = {}
+        n_tips = 0
+        for idx, node in enumerate(self.tree.postorder(include_self=True)):
+            self._postorder[node] = idx
+            if node.children:
+                node.TipStart = node.children[0].TipStart
+                node.TipStop = node.children[-1].TipStop
+            else:
+                node.TipStart = node.TipStop = n_tips
+                n_tips += 1
+
+    def _fold(self, key):
+        """Pick the node that keeps the name key, see name_node_score_fold"""
+        rank, name = key
+        holders = self._holders.get(key)
+        if not holders:
+            self._holders.pop(key, None)
+            self._winners.pop(key, None)
+            return
+
+        nodes = sorted(holders, key=self._postorder.__getitem__)
+        node_scores = [(n, n.RankNameScores[rank]) for n in nodes]
+        self._winners[key] = nl.best_scoring_node(node_scores)
+
+    def _set_rank_names(self, node):
+        """Set the names a node keeps after the fold"""
+        winners = self._winners
+        node.RankNames = [name if winners.get((rank, name)) is node else None
+                          for rank, name in enumerate(node.PickedNames)]
+
+    def _nodes_with_name(self, rank, name, count):
+        """Returns the nodes with at least count, and min_count, tips of a name
+
+        Counts do not grow toward the tips, so the walk stops below the nodes
+        with fewer.
+        """
+        count = max(count, self.min_count)
+        nodes = []
+        stack = [self.tree]
+        while stack:
+            node = stack.pop()
+            if node.TaxaCount[rank].get(name, 0) < count:
+                continue
+            nodes.append(node)
+            stack.extend(c for c in node.children if c.children)
+        return nodes
+
+    def _update(self, touched, changed):
+        """Rescore nodes and refold names after the counts changed
+
+        Parameters
+        ----------
+        touched : list of TreeNode
+            The nodes whose TaxaCount or number of tips changed
+        changed : dict
+            {(rank, name): total} of the names whose totals changed, with
+            their totals before the change
+
+        Notes
+        -----
+        The relative frequency of a name changes at every node with the name
+        when its total changes, but is only updated where it is, or was, at
+        least 0.5. Below that it does not change RankSafe or the names
+        picked, see pick_names, and a stale ConsensusRelFreq stays below 0.5.
+        """
+        # the picks and scores of each node before the update, to find the
+        # names to refold
+        before = {}
+        touched_set = set(touched)
+
+        for node in touched:
+            if hasattr(node, 'PickedNames'):
+                before[node] = (node.PickedNames, node.RankNameScores)
+            else:
+                before[node] = ([], None)
+            self._score(node)
+
+        for (rank, name), old_total in changed.iteritems():
+            total = self.totals[rank].get(name)
+            if not total:
+                continue
+
+            # a count is at least half of the total if 2 * count >= total
+            half = (min(total, old_total) + 1) // 2
+            for node in self._nodes_with_name(rank, name, half):
+                if node in touched_set:
+                    continue
+
+                relfreq = node.ConsensusRelFreq[rank]
+                old = relfreq[name]
+                new = float(node.TaxaCount[rank][name]) / total
+                if new == old:
+                    continue
+                relfreq[name] = new
+
+                if node not in before:
+                    before[node] = (node.PickedNames, node.RankNameScores[:])
+
+                if (old >= 0.5) != (new >= 0.5):
+                    self._pick(node)
+                elif node.PickedNames[rank] == name:
+                    self._score_name(node, rank)
+
+        refold = set()
+        renamed = set()
+        for node, (old_names, old_scores) in before.iteritems():
+            # the touched nodes are always refolded, their number of tips
+            # breaks ties
+            if node not in touched_set and old_names == node.PickedNames and \
+                    old_scores == node.RankNameScores:
+                continue
+
+            renamed.add(node)
+            for key in _picked(old_names):
+                self._holders[key].discard(node)
+                refold.add(key)
+            for key in _picked(node.PickedNames):
+                self._holders.setdefault(key, set()).add(node)
+                refold.add(key)
+
+        # only the nodes that lost or won a name are renamed
+        for key in refold:
+            renamed.add(self._winners.get(key))
+            self._fold(key)
+            renamed.add(self._winners.get(key))
+        renamed.discard(None)
+        for node in renamed:
+            self._set_rank_names(node)
+
+    def insert_tips(self, insertions, tipname_map):
+        """Insert tips into the tree and update the decoration
+
+        Each new tip is placed on the branch above the lowest common ancestor
+        of its anchor tips, which is split in half as util.reroot does, with
+        the new tip after the existing subtree.
+
+        Parameters
+        ----------
+        insertions : list of (str, list of str, float or None)
+            The id of each new tip, the ids of its anchor tips and the branch
+            length of the new tip, as returned by parse_insertions
+        tipname_map : dict
+            The consensus map of the tree with the new tips, which replaces
+            the one the decoration was built with
+
+        Raises
+        ------
+        ValueError
+            If a new tip is already in the tree or an anchor tip is not
+        """
+        from skbio import TreeNode
+
+        tips = self._tip_lookup()
+        missing = [None] * self.context.n_ranks
+        self.tipname_map = tipname_map
+
+        touched = []
+        touched_set = set()
+        changed = {}
+        for name, anchors, length in insertions:
+            name = name.replace("'", "")
+            if name in tips:
+                raise ValueError("%s is already in the tree" % name)
+            try:
+                anchor_nodes = [tips[a.replace("'", "")] for a in anchors]
+            except KeyError as e:
+                raise ValueError("Anchor %s is not in the tree" % e.args[0])
+
+            anchor = _lowest_common_ancestor(anchor_nodes)
+            parent = anchor.parent
+
+            node = TreeNode()
+            node.Consensus = missing
+            node.Bootstrap = None
+            if anchor.length is not None:
+                node.length = anchor.length / 2.0
+                anchor.length = anchor.length / 2.0
+            node.TaxaCount = {i: {} for i in range(self.context.n_ranks)}
+            _add_counts(node.TaxaCount, self._counts(anchor))
+            node.NumTips = anchor.NumTips
+
+            tip = TreeNode(name=name, length=length)
+            tip.Consensus = tipname_map.get(name, missing)
+            self._record_totals(changed, tip.Consensus)
+            self._init_tip(tip)
+            tips[name] = tip
+
+            if parent is None:
+                self.tree = node
+            else:
+                idx = [c is anchor for c in parent.children].index(True)
+                parent.children[idx] = node
+            node.parent = parent
+            node.children = [anchor, tip]
+            anchor.parent = node
+            tip.parent = node
+
+            tip_counts = self._counts(tip)
+            ancestor = node
+            while ancestor is not None:
+                _add_counts(ancestor.TaxaCount, tip_counts)
+                ancestor.NumTips += tip.NumTips
+                if ancestor not in touched_set:
+                    touched_set.add(ancestor)
+                    touched.append(ancestor)
+                ancestor = ancestor.parent
+
+        self.tree.invalidate_caches()
+        self._index()
+        self._update(touched, changed)
+
+    def update_lineages(self, diff):
+        """Change the lineages of ids and update the decoration
+
+        The ids need not be tips of the tree, their lineages are still used
+        for the consensus lookup of backfill_names_gap. The consensus map of
+        the decoration is changed in place.
+
+        Parameters
+        ----------
+        diff : list of (str, list, list)
+            The id, old and new lineage of each change, applied in order, as
+            returned by parse_lineage_diff
+
+        Raises
+        ------
+        ValueError
+            If the old lineage of a change is not the lineage of the id. No
+            change is applied.
+        """
+        missing = [None] * self.context.n_ranks
+        current = {}
+        for id_, old, new in diff:
+            lineage = current.get(id_, self.tipname_map.get(id_, missing))
+            if lineage != old:
+                raise ValueError("The lineage of %s is %r, not %r" %
+                                 (id_, lineage, old))
+            current[id_] = new
+
+        tips = self._tip_lookup()
+        touched = []
+        touched_set = set()
+        changed = {}
+        for id_, old, new in diff:
+            self.tipname_map[id_] = new
+            tip = tips.get(id_)
+            if tip is None:
+                continue
+
+            old_counts = self._counts(tip)
+            old_ntips = tip.NumTips
+            self._record_totals(changed, old)
+            self._record_totals(changed, new)
+            _add_counts(self.totals, old_counts, -1)
+            tip.Consensus = new
+            self._init_tip(tip)
+            new_counts = self._counts(tip)
+
+            ancestor = tip.parent
+            while ancestor is not None:
+                _add_counts(ancestor.TaxaCount, old_counts, -1)
+                _add_counts(ancestor.TaxaCount, new_counts)
+                ancestor.NumTips += tip.NumTips - old_ntips
+                if ancestor not in touched_set:
+                    touched_set.add(ancestor)
+                    touched.append(ancestor)
+                ancestor = ancestor.parent
+
+        self._update(touched, changed)
+
+    def decorate(self, verbose=False, stats=None):
+        """Name the tree from the current scores
+
+        Returns
+        -------
+        list of str
+            The consensus strings, as pull_consensus_strings
+        """
+        state = {'tree': self.tree,
+                 'tipname_map': self.tipname_map,
+                 'no_suffix': self.no_suffix,
+                 'suffix_char': self.suffix_char,
+                 'verbose': verbose,
+                 'context': self.context}
+        for stage in NAMING_STAGES:
+            with timed(stats, stage.name, tree=self.tree):
+                stage.func(state)
+        return state['constrings']
+
+    def save(self, path):
+        """Write the decoration to path, see load"""
+        nodes = list(self.tree.preorder(include_self=True))
+        data = {'version': CACHE_VERSION,
+                'tree': tree_to_arrays(self.tree),
+                'attrs': {a: [getattr(n, a, pl._MISSING) for n in nodes]
+                          for a in NODE_ATTRS},
+                'tipname_map': self.tipname_map,
+                'totals': self.totals,
+                'min_count': self.min_count,
+                'no_suffix': self.no_suffix,
+                'suffix_char': self.suffix_char,
+                'rank_order': self.context.rank_order,
+                'bad_names': self.context.bad_names}
+
+        # gzip files are slow to pickle to and from in small pieces
+        fh = gzip.open(path + '.tmp', 'wb', compresslevel=1)
+        try:
+            fh.write(cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL))
+        finally:
+            fh.close()
+        os.rename(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a decoration written by save
+
+        Raises
+        ------
+        ValueError
+            If the decoration was written by an incompatible version
+        """
+        fh = gzip.open(path, 'rb')
+        try:
+            data = cPickle.loads(fh.read())
+        finally:
+            fh.close()
+
+        if data.get('version') != CACHE_VERSION:
+            raise ValueError("%s is not a decoration of version %d" %
+                             (path, CACHE_VERSION))
+
+        self = cls.__new__(cls)
+        self.tipname_map = data['tipname_map']
+        self.totals = data['totals']
+        self.min_count = data['min_count']
+        self.no_suffix = data['no_suffix']
+        self.suffix_char = data['suffix_char']
+        self.context = nl.TaxonomyContext(data['rank_order'],
+                                          data['bad_names'])
+
+        self.tree = arrays_to_tree(data['tree'])
+        nodes = list(self.tree.preorder(include_self=True))
+        for attr, values in data['attrs'].iteritems():
+            for node, value in zip(nodes, values):
+                if value != pl._MISSING:
+                    setattr(node, attr, value)
+
+        self._index()
+        self._holders = {}
+        self._winners = {}
+        for node in self.tree.non_tips(include_self=True):
+            for rank, name in _picked(node.PickedNames):
+                self._holders.setdefault((rank, name), set()).add(node)
+                if node.RankNames[rank] is not None:
+                    self._winners[(rank, name)] = node
+        return self
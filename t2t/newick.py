@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+
+"""Streaming newick readers and writers
+
+The decorated tree is written as newick tokens and the consensus strings a
+line at a time, gathered into chunks for buffered file handles, rather than
+joined into a single string first. A BackgroundWriter writes, and compresses,
+the chunks in a thread, which overlaps with producing the next ones as zlib
+and file writes release the GIL.
+
+A newick is read in blocks by read_tokens, which matches whole labels with a
+regular expression rather than a character at a time, and newick_nodes yields
+its nodes in postorder without building a TreeNode.
+"""
+
+import re
+from threading import Thread
+from Queue import Queue
+
+import t2t.compression as cz
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+# the size of the chunks handed to a file handle
+CHUNK_SIZE = 2 ** 16
+
+# characters that require a name to be quoted
+_OPERATORS = frozenset(",:_;()[]")
+
+# a quoted label, whose quotes are escaped by doubling them, a comment, a
+# structure character, an unquoted label or whitespace
+_TOKEN = re.compile(r"'(?:[^']+|'')*'(?!')|\[[^\]]*\]|[(),;:]|"
+                    r"[^(),;:'\[\s]+|\s+")
+
+_STRUCTURE = frozenset("(),;:")
+
+
+def newick_tokens(tree):
+    """Yields the newick of tree, as TreeNode.write writes it, in pieces
+
+    Parameters
+    ----------
+    tree : TreeNode
+
+    Returns
+    -------
+    generator of str
+    """
+    current_depth = 0
+    nodes_left = [(tree, 0)]
+    while nodes_left:
+        entry = nodes_left.pop()
+        node, node_depth = entry
+        if node.children and node_depth >= current_depth:
+            yield '('
+            nodes_left.append(entry)
+            nodes_left.extend((child, node_depth + 1)
+                              for child in reversed(node.children))
+            current_depth = node_depth + 1
+            continue
+
+        token = ''
+        if node_depth < current_depth:
+            token = ')'
+            current_depth -= 1
+
+        # None and '' are both the absence of a name
+        name = node.name
+        if name:
+            escaped = name.replace("'", "''")
+            if not _OPERATORS.isdisjoint(name):
+                token += "'%s'" % escaped
+            else:
+                token += escaped.replace(" ", "_")
+        if node.length is not None:
+            token += ':%s' % node.length
+        if nodes_left and nodes_left[-1][1] == current_depth:
+            token += ','
+        yield token
+
+    yield ';\n'
+
+
+def line_tokens(lines):
+    """Yields lines separated by newlines, as '\\n'.join(lines) would"""
+    lines = iter(lines)
+    for line in lines:
+        yield line
+        break
+    for line in lines:
+        yield '\n'
+        yield line
+
+
+def write_tokens(tokens, fh, chunk_size=CHUNK_SIZE):
+    """Write tokens to fh in chunks of about chunk_size characters"""
+    chunk = []
+    size = 0
+    for token in tokens:
+        chunk.append(token)
+        size += len(token)
+        if size >= chunk_size:
+            fh.write(''.join(chunk))
+            chunk = []
+            size = 0
+    if chunk:
+        fh.write(''.join(chunk))
+
+
+def write_newick(tree, fh, chunk_size=CHUNK_SIZE):
+    """Write tree to fh as newick, see newick_tokens"""
+    write_tokens(newick_tokens(tree), fh, chunk_size)
+
+
+def write_lines(lines, fh, chunk_size=CHUNK_SIZE):
+    """Write lines to fh, separated by newlines"""
+    write_tokens(line_tokens(lines), fh, chunk_size)
+
+
+def read_tokens(fh, convert_underscores=False, block_size=CHUNK_SIZE):
+    """Yields the structure characters and labels of the newick in fh
+
+    fh is read in blocks of block_size characters. Quoted labels are
+    unquoted, and comments are dropped.
+
+    Parameters
+    ----------
+    fh : file
+    convert_underscores : bool
+        Replace the underscores of unquoted labels with spaces, as
+        TreeNode.read does by default
+    block_size : int
+
+    Returns
+    -------
+    generator of str
+        The characters of (),;: and the labels between them
+
+    Raises
+    ------
+    ValueError
+        If a quote or comment is not closed, or an unquoted label contains
+        whitespace
+    """
+    buf = ''
+    pos = 0
+    eof = False
+    label = []
+    spaced = False
+
+    while True:
+        match = _TOKEN.match(buf, pos)
+        # a token at the end of the block may continue in the next one
+        if match is None or (match.end() == len(buf) and not eof):
+            if eof:
+                if pos == len(buf):
+                    break
+                raise ValueError("Could not parse newick: a quote or " +
+                                 "comment is not closed")
+            block = fh.read(block_size)
+            eof = not block
+            buf = buf[pos:] + block
+            pos = 0
+            continue
+
+        pos = match.end()
+        token = match.group()
+        first = token[0]
+        if first in _STRUCTURE:
+            if label:
+                yield ''.join(label)
+                label = []
+            spaced = False
+            yield token
+        elif first == '[':
+            continue
+        elif first.isspace():
+            spaced = bool(label)
+        elif spaced:
+            raise ValueError("Newick labels cannot have unquoted " +
+                             "whitespace: %s %s" % (''.join(label), token))
+        elif first == "'":
+            label.append(token[1:-1].replace("''", "'"))
+        elif convert_underscores:
+            label.append(token.replace('_', ' '))
+        else:
+            label.append(token)
+
+    if label:
+        yield ''.join(label)
+
+
+def newick_nodes(tokens):
+    """Yields the nodes of a newick in postorder, from read_tokens
+
+    Only the first tree is read, up to its ;
+
+    Parameters
+    ----------
+    tokens : iterable of str
+
+    Returns
+    -------
+    generator of tuple
+        The (name, length, number of children) of each node. name and length
+        are None if the node has none.
+
+    Raises
+    ------
+    ValueError
+        If the parentheses are unbalanced, the ; is missing or a length is
+        not a number
+    """
+    open_clades = []
+    name = None
+    length = None
+    n_children = 0
+    is_length = False
+
+    for token in tokens:
+        if token in ',);':
+            if token == ';' and open_clades or token != ';' and \
+                    not open_clades:
+                raise ValueError("Could not parse newick: the " +
+                                 "parentheses are unbalanced")
+            yield name, length, n_children
+
+            name = None
+            length = None
+            n_children = 0
+            is_length = False
+            if token == ',':
+                open_clades[-1] += 1
+            elif token == ')':
+                n_children = open_clades.pop() + 1
+            else:
+                return
+        elif token == '(':
+            if name is not None or length is not None or n_children:
+                raise ValueError("Could not parse newick: a clade opens " +
+                                 "after a label")
+            open_clades.append(0)
+        elif token == ':':
+            is_length = True
+        elif is_length:
+            try:
+                length = float(token)
+            except ValueError:
+                raise ValueError("Could not read length as numeric type: " +
+                                 token)
+            is_length = False
+        else:
+            name = token or None
+
+    raise ValueError("Could not parse newick: the tree does not end with ;")
+
+
+def open_output(path, compress=False):
+    """Open path for writing, through gzip if compress
+
+    Otherwise path is compressed if its extension is that of a codec, see
+    t2t.compression.open_output
+    """
+    return cz.open_output(path, 'gzip' if compress else None)
+
+
+def decoration_paths(basename, compress=False):
+    """Returns the paths of a decorated tree and of its consensus strings
+
+    With compress, both are gzipped and named with .gz in place of any
+    extension of a codec, e.g., out.gz or out.bz2 give out.gz and
+    out-consensus-strings.gz. Otherwise, if basename has the extension of a
+    codec, the consensus strings are compressed alike, e.g., out.bz2 and
+    out-consensus-strings.bz2, see open_output
+    """
+    stem = cz.strip_compression_ext(basename)
+    ext = '.gz' if compress else basename[len(stem):]
+    return stem + ext, stem + '-consensus-strings' + ext
+
+
+class BackgroundWriter(object):
+    """A file handle that writes, and closes, another one in a thread
+
+    Parameters
+    ----------
+    fh : file
+        The handle written to. It is closed with the BackgroundWriter.
+    max_chunks : int
+        The number of chunks that may wait to be written before write blocks
+
+    Notes
+    -----
+    An error of the thread is raised by the next write or by close.
+    """
+    def __init__(self, fh, max_chunks=16):
+        self.fh = fh
+        self._queue = Queue(max_chunks)
+        self._error = None
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        data = None
+        try:
+            data = self._queue.get()
+            while data is not None:
+                self.fh.write(data)
+                data = self._queue.get()
+            self.fh.close()
+        except Exception as e:
+            self._error = e
+            # keep taking the chunks, so that write does not block
+            while data is not None:
+                data = self._queue.get()
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, data):
+        self._check()
+        self._queue.put(data)
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -4,8 +4,9 @@ from collections import defaultdict
 from string import lower
 from operator import itemgetter
 from numpy import argmin, array, where
-from skbio import TreeNode
-from t2t.util import unzip
+# skbio is slow to import, so it is imported by the functions that build
+# trees rather than here
+from t2t.util import unzip, BoundedDict
 import re
 
 __author__ = "Daniel McDonald"
@@ -26,29 +27,159 @@ BAD_NAMES = [
 BAD_NAMES_REGEX = re.compile("(%s)" % ')|('.join(map(lower, BAD_NAMES)))
 
 
+class TaxonomyContext(object):
+    """The rank order and bad name rules of a decoration
+
+    A context is passed to the functions of this module, and of consensus,
+    validate and consistency, in place of the module level RANK_ORDER and
+    BAD_NAMES, so that decorations with different rank schemes can run in the
+    same process. Functions given no context use the module level settings.
+
+    Parameters
+    ----------
+    rank_order : list of str, optional
+        The rank prefixes, e.g., ['d', 'p', 'c', 'o', 'f', 'g', 's']. Defaults
+        to RANK_ORDER.
+    bad_names : list of str, optional
+        Names containing any of these, ignoring case, are treated as missing.
+        Defaults to BAD_NAMES.
+    cache_size : int
+        The number of names, and separately of lineages, remembered by
+        clean_name and load_consensus_map
+
+    Notes
+    -----
+    A taxonomy has far fewer distinct names and lineages than lines, so the
+    context memoizes the cleaning of each name and load_consensus_map returns
+    the same list for identical lineages. The lists are shared and must not be
+    modified.
+    """
+    def __init__(self, rank_order=None, bad_names=None, cache_size=2 ** 20):
+        if rank_order is None:
+            rank_order = RANK_ORDER
+        if bad_names is None:
+            bad_names = BAD_NAMES
+
+        self.rank_order = list(rank_order)
+        self.n_ranks = len(self.rank_order)
+        self.rank_index = {r: i for i, r in enumerate(self.rank_order)}
+        self.bad_names = list(bad_names)
+        self.bad_names_regex = re.compile(
+            "(%s)" % ')|('.join(map(lower, self.bad_names)))
+
+        self.names = BoundedDict(cache_size)
+        self.ranked_names = BoundedDict(cache_size)
+        self.lineages = BoundedDict(cache_size)
+
+    @classmethod
+    def from_consensus(cls, con, bad_names=None):
+        """Returns a context with the ranks of the consensus string con"""
+        return cls(parse_rank_order(con), bad_names)
+
+    def has_badname(self, name):
+        """Boolean, if name contains a badname"""
+        return len(self.bad_names_regex.findall(name)) > 0
+
+    def clean_name(self, name):
+        """Returns what is known of a raw name of a consensus string
+
+        Returns
+        -------
+        str
+            The name, the same object for every call with an equal name
+        bool
+            True if the name is missing, e.g., '', 'None' or 'g__'
+        bool
+            True if the name contains a bad name
+        """
+        try:
+            return self.names[name]
+        except KeyError:
+            pass
+
+        missing = name == '' or name == 'None' or \
+            ('__' in name and name.split('__')[1] == '')
+        result = (name, missing, self.has_badname(name.lower()))
+        self.names[name] = result
+        return result
+
+    def ranked_name(self, rank, name):
+        """Returns name prefixed by the rank, or the empty rank if None"""
+        key = (rank, name)
+        try:
+            return self.ranked_names[key]
+        except KeyError:
+            pass
+
+        if name is None:
+            result = "%s__" % self.rank_order[rank]
+        else:
+            result = '__'.join([self.rank_order[rank], name])
+        self.ranked_names[key] = result
+        return result
+
+
+class ConsensusMapError(ValueError):
+    """A line of a consensus map that cannot be loaded
+
+    Parameters
+    ----------
+    lineno : int
+        The line number, starting at 1
+    reason : str
+        What is wrong with the line
+    """
+    def __init__(self, lineno, reason):
+        super(ConsensusMapError, self).__init__(
+            "Line %d of the consensus map: %s" % (lineno, reason))
+        self.lineno = lineno
+        self.reason = reason
+
+    def __reduce__(self):
+        return (self.__class__, (self.lineno, self.reason))
+
+
+def get_context(context=None):
+    """Returns context, or a context of the module level settings if None"""
+    if context is None:
+        return TaxonomyContext()
+    return context
+
+
 def set_rank_order(order):
     """Reset the global RANK_ORDER"""
     global RANK_ORDER
     RANK_ORDER = order
 
 
+def parse_rank_order(con):
+    """Returns the rank order of the con string, e.g., 'd__x; p__y'"""
+    return [s.strip()[0] for s in con.split(';')]
+
+
 def determine_rank_order(con):
-    """Determines dynamically rank order based on first input con string"""
-    order = [s.strip()[0] for s in con.split(';')]
+    """Determines dynamically rank order based on first input con string
+
+    This sets the global RANK_ORDER, see TaxonomyContext.from_consensus for
+    a rank order that is local to a decoration.
+    """
+    order = parse_rank_order(con)
     global RANK_ORDER
     RANK_ORDER = order
 
     return order
 
 
-def has_badname(name):
+def has_badname(name, context=None):
     """Boolean, if name contains a badname"""
-    return len(BAD_NAMES_REGEX.findall(name)) > 0
+    if context is None:
+        return len(BAD_NAMES_REGEX.findall(name)) > 0
+    return context.has_badname(name)
 
 
 def load_consensus_map(lines, append_rank, check_bad=True,
                        check_min_inform=True, assert_nranks=True,
-                       verbose=False, check_euk_unc=False):
+                       verbose=False, check_euk_unc=False, context=None):
     """Input is tab delimited mapping from tipname to a consensus string
 
     tipname is the tipnames in the loaded tree
@@ -64,60 +195,86 @@ def load_consensus_map(lines, append_rank, check_bad=True,
     check_euk_unc : check for eukarayota or unclassified, set to none if found
     and true
 
+    context : the TaxonomyContext, defaults to the module level settings
+
     Output is a dictionary mapping tipname to consensus strings split into
-    a list.
+    a list. A line that cannot be loaded raises a ConsensusMapError, a
+    ValueError that gives the line number.
     """
     if verbose:
         print "loading consensus map..."
 
+    context = get_context(context)
+    options = (append_rank, check_bad, check_min_inform, assert_nranks,
+               check_euk_unc)
+    lineages = context.lineages
+
     mapping = {}
-    n_ranks = len(RANK_ORDER)
-    for line in lines:
-        id_, consensus = line.strip().split('\t')
+    for lineno, line in enumerate(lines, 1):
+        fields = line.strip().split('\t')
+        if len(fields) != 2:
+            raise ConsensusMapError(lineno, "expected an id and a consensus "
+                                            "string separated by a tab")
+        id_, consensus = fields
         id_ = id_.strip()
 
-        names = [n.strip() for n in consensus.split(';')]
+        # identical lineages share the same list
+        key = (consensus, options)
+        try:
+            names = lineages[key]
+        except KeyError:
+            try:
+                names = _clean_lineage(consensus, context, *options)
+            except ValueError as e:
+                raise ConsensusMapError(lineno, str(e))
+            lineages[key] = names
+
+        mapping[id_] = names
+
+    return mapping
+
 
-        if check_euk_unc and 'Eukaryota' in names[0] or \
-                'Unclassified' in names[0]:
-            names = [None] * n_ranks
+def _clean_lineage(consensus, context, append_rank, check_bad,
+                   check_min_inform, assert_nranks, check_euk_unc):
+    """Returns the names of a consensus string, see load_consensus_map"""
+    n_ranks = context.n_ranks
+    clean_name = context.clean_name
 
-        if assert_nranks:
-            if len(names) != n_ranks:
-                raise ValueError
+    names = [clean_name(n.strip()) for n in consensus.split(';')]
 
-        # clean up missing names
+    if check_euk_unc and 'Eukaryota' in names[0][0] or \
+            'Unclassified' in names[0][0]:
+        names = [(None, True, False)] * n_ranks
+
+    if assert_nranks:
+        if len(names) != n_ranks:
+            raise ValueError("expected %d ranks, found %d" % (n_ranks,
+                                                              len(names)))
+
+    # clean up missing names
+    for idx in range(n_ranks):
+        if names[idx][1]:
+            names[idx] = (None, True, False)
+
+    if check_min_inform:
+        if names[1][0] is None:
+            names = [(None, True, False)] * n_ranks
+
+    # clean up bad names
+    if check_bad:
+        names = [None if bad else name for name, missing, bad in names]
+    else:
+        names = [name for name, missing, bad in names]
+
+    # append rank if needed
+    if append_rank:
         for idx in range(n_ranks):
-            if names[idx] == '' or names[idx] == 'None':
-                names[idx] = None
-            if names[idx] is not None and \
-                    '__' in names[idx] and \
-                    names[idx].split('__')[1] == '':
-                names[idx] = None
-
-        if check_min_inform:
-            if names[1] is None:
-                names = [None] * n_ranks
-
-        # clean up bad names
-        if check_bad:
-            for idx, name in enumerate(names):
-                if name is not None and has_badname(name.lower()):
-                    names[idx] = None
-
-        # append rank if needed
-        if append_rank:
-            for idx in range(n_ranks):
-                if names[idx] is not None:
-                    names[idx] = '__'.join([RANK_ORDER[idx], names[idx]])
-                else:
-                    names[idx] = "%s__" % RANK_ORDER[idx]
-        mapping[id_] = names
+            names[idx] = context.ranked_name(idx, names[idx])
 
-    return mapping
+    return names
 
 
-def load_tree(tree, tipname_map):
+def load_tree(tree, tipname_map, context=None):
     """Returns a PhyloNode tree decorated with helper attrs
 
     The following attributes and descriptions are decorated onto the tree:
@@ -136,31 +293,59 @@ def load_tree(tree, tipname_map):
 
     Parameters
     ----------
-    tree : str or TreeNode
-        A newick string or a TreeNode
-    tipname_map : dict
-        {id_: [tax, string]}
+    tree : str, file, dict or TreeNode
+        The path of a newick file, an open newick file, the arrays of a tree
+        or a TreeNode. A newick is parsed with t2t.treecache.newick_to_arrays.
+    tipname_map : dict or IndexedConsensusMap
+        {id_: [tax, string]}, or a map with a fetch method that returns that
+        dict for the names of the tips, see t2t.conmap
+    context : TaxonomyContext, optional
 
     Returns
     -------
     TreeNode
 
     """
-    if not isinstance(tree, TreeNode):
-        tree = TreeNode.read(tree, convert_underscores=False)
+    from skbio import TreeNode
+    from t2t.compression import open_input
+    from t2t.treecache import newick_to_arrays, arrays_to_tree
 
-    n_ranks = len(RANK_ORDER)
+    n_ranks = get_context(context).n_ranks
 
     missing_tax = [None] * n_ranks
 
-    for idx, tip in enumerate(tree.tips()):
+    # a parsed newick comes with the TipStart, TipStop, Bootstrap and
+    # Consensus of its internal nodes already set
+    parsed = not isinstance(tree, TreeNode)
+    if parsed:
+        if isinstance(tree, dict):
+            arrays = tree
+        elif isinstance(tree, basestring):
+            with open_input(tree) as fh:
+                arrays = newick_to_arrays(fh)
+        else:
+            arrays = newick_to_arrays(tree)
+        tree = arrays_to_tree(arrays, bootstrap=True,
+                              internal_attrs={'Consensus': missing_tax})
+        del arrays
+
+    tips = list(tree.tips())
+    for tip in tips:
         if tip.name:
             tip.name = tip.name.replace("'", "")
 
+    # a map held out of core only loads the lineages of the tips
+    if hasattr(tipname_map, 'fetch'):
+        tipname_map = tipname_map.fetch([tip.name for tip in tips])
+
+    for idx, tip in enumerate(tips):
         tip.TipStart = idx
         tip.TipStop = idx
         tip.Consensus = tipname_map.get(tip.name, missing_tax)
 
+    if parsed:
+        return tree
+
     for node in tree.postorder(include_self=True):
         if node.is_tip():
             continue
@@ -181,7 +366,7 @@ def load_tree(tree, tipname_map):
     return tree
 
 
-def collect_names_at_ranks_counts(tree):
+def collect_names_at_ranks_counts(tree, context=None):
     """Returns total name counts for a given name at a given rank
 
     Assumes the Consensus attribute is present on the tips
@@ -189,6 +374,7 @@ def collect_names_at_ranks_counts(tree):
     Parameters
     ----------
     tree : TreeNode
+    context : TaxonomyContext, optional
 
     Returns
     -------
@@ -196,7 +382,8 @@ def collect_names_at_ranks_counts(tree):
         Returns a 2d dict, [RANK][name] -> count
 
     """
-    total_counts = {i: defaultdict(int) for i in range(len(RANK_ORDER))}
+    n_ranks = get_context(context).n_ranks
+    total_counts = {i: defaultdict(int) for i in range(n_ranks)}
 
     for consensus in (tip.Consensus for tip in tree.tips()):
         for rank, name in enumerate(consensus):
@@ -206,7 +393,8 @@ def collect_names_at_ranks_counts(tree):
     return total_counts
 
 
-def decorate_name_relative_freqs(tree, total_counts, min_count):
+def decorate_name_relative_freqs(tree, total_counts, min_count, context=None,
+                                 min_relfreq=0.0):
     """Decorates relative frequency information for names on the tree
 
     Adds on the attribute ConsensusRelFreq which is a 2d dict containing
@@ -227,13 +415,18 @@ def decorate_name_relative_freqs(tree, total_counts, min_count):
     min_count : int
         is the minimum number of tips that must represent a name for that
         frequency to be retained
+    context : TaxonomyContext, optional
+    min_relfreq : float
+        The names with a lower ConsensusRelFreq are not retained, nor are
+        the ranks left without names. With 0.5, only the names set_ranksafe,
+        pick_names and name_node_score_fold look at are kept.
 
     """
     tips = list(tree.tips())
     for tip in tips:
         tip.ConsensusRelFreq = None
 
-    n_ranks = len(RANK_ORDER)
+    n_ranks = get_context(context).n_ranks
     n_ranks_it = range(n_ranks)
 
     for n in tree.traverse(include_self=True):
@@ -252,25 +445,52 @@ def decorate_name_relative_freqs(tree, total_counts, min_count):
                     continue
                 counts[cur_rank][cur_name] += 1
 
-        res_freq = {i: {} for i in n_ranks_it}
-        res_valid = {i: {} for i in n_ranks_it}
+        n.ConsensusRelFreq, n.ValidRelFreq = node_relative_freqs(
+            counts, n.NumTips, total_counts, min_count, min_relfreq)
 
-        # collect frequency information of the names per rank
-        for rank, names in counts.iteritems():
-            for name, name_counts in counts[rank].iteritems():
-                if name_counts < min_count:
-                    continue
 
-                relfreq = float(name_counts) / total_counts[rank][name]
-                validfreq = float(name_counts) / n.NumTips
-                res_freq[rank][name] = relfreq
-                res_valid[rank][name] = validfreq
+def node_relative_freqs(counts, num_tips, total_counts, min_count,
+                        min_relfreq=0.0):
+    """Returns the ConsensusRelFreq and ValidRelFreq of a node
+
+    Parameters
+    ----------
+    counts : dict of dict
+        [rank][name] -> the number of tips of the node with the name
+    num_tips : int
+        The number of informative tips of the node
+    total_counts : dict of dict
+        The return data from collect_names_at_ranks_counts
+    min_count, min_relfreq
+        See decorate_name_relative_freqs
+    """
+    res_freq = {}
+    res_valid = {}
+
+    # collect frequency information of the names per rank
+    for rank, names in counts.iteritems():
+        rank_freq = res_freq[rank] = {}
+        rank_valid = res_valid[rank] = {}
+        rank_totals = total_counts[rank]
+        for name, name_counts in names.iteritems():
+            if name_counts < min_count:
+                continue
+
+            freq = float(name_counts) / rank_totals[name]
+            if freq < min_relfreq:
+                continue
+
+            rank_freq[name] = freq
+            rank_valid[name] = float(name_counts) / num_tips
+
+        if min_relfreq and not rank_freq:
+            del res_freq[rank]
+            del res_valid[rank]
 
-        n.ConsensusRelFreq = res_freq
-        n.ValidRelFreq = res_valid
+    return res_freq, res_valid
 
 
-def decorate_name_counts(tree):
+def decorate_name_counts(tree, context=None):
     """Decorates count information for names on the tree
 
     Adds on the attribute TaxaCount which is a 2d dict containing
@@ -282,10 +502,11 @@ def decorate_name_counts(tree):
     tree : TreeNode
     total_counts : dict of dict
         The return data from collect_names_at_ranks_counts
+    context : TaxonomyContext, optional
     """
 
     tips = list(tree.tips())
-    n_ranks = len(RANK_ORDER)
+    n_ranks = get_context(context).n_ranks
     n_ranks_it = range(n_ranks)
 
     for n in tree.traverse(include_self=True):
@@ -302,31 +523,47 @@ def decorate_name_counts(tree):
         n.TaxaCount = counts
 
 
-def set_ranksafe(tree):
+def set_ranksafe(tree, context=None):
     """Determines what ranks are safe for a given node
 
-    RankSafe is a len(RANK_ORDER) boolean list. True means at that rank, there
-    is only a single name with > 50% relative abundance
+    RankSafe is an integer bitmask over the ranks of RANK_ORDER. Bit i is set
+    if at rank i there is only a single name with >= 50% relative abundance
 
     Parameters
     ----------
     tree : TreeNode
+    context : TaxonomyContext, optional
 
     """
-    ranksafe = [False] * len(RANK_ORDER)
+    n_ranks = get_context(context).n_ranks
     for node in tree.traverse(include_self=True):
-        node.RankSafe = ranksafe[:]
-
         if node.is_tip():
-            continue
+            node.RankSafe = 0
+        else:
+            node.RankSafe = node_ranksafe(node.ConsensusRelFreq, n_ranks)
 
-        for rank, names in node.ConsensusRelFreq.items():
-            # this is strict
-            if sum(x >= 0.5 for x in names.values()) == 1:
-                node.RankSafe[rank] = True
 
+def node_ranksafe(relfreq, n_ranks):
+    """Returns the RankSafe of a node with the ConsensusRelFreq relfreq"""
+    ranksafe = 0
+    for rank, names in relfreq.iteritems():
+        # this is strict
+        n_safe = 0
+        for freq in names.itervalues():
+            if freq >= 0.5:
+                n_safe += 1
+        if n_safe == 1:
+            ranksafe |= 1 << rank
+    return ranksafe
 
-def decorate_ntips(tree):
+
+def ranksafe_ranks(ranksafe):
+    """Returns the ranks set in a RankSafe bitmask"""
+    return [rank for rank in range(ranksafe.bit_length())
+            if ranksafe >> rank & 1]
+
+
+def decorate_ntips(tree, context=None):
     """Cache the number of informative tips on the tree.
 
     This method will set NumTips as the number of informative tips that descend
@@ -337,9 +574,10 @@ def decorate_ntips(tree):
     Parameters
     ----------
     tree : TreeNode
+    context : TaxonomyContext, optional
 
     """
-    n_ranks = len(RANK_ORDER)
+    n_ranks = get_context(context).n_ranks
     missing = [None] * n_ranks
 
     for node in tree.postorder(include_self=True):
@@ -349,7 +587,7 @@ def decorate_ntips(tree):
             node.NumTips = sum(c.NumTips for c in node.children)
 
 
-def decorate_ntips_rank(tree):
+def decorate_ntips_rank(tree, context=None):
     """Cache the number of informative tips for each rank for each node.
 
     This method will set NumTipsRank as the number of informative tips that
@@ -359,9 +597,10 @@ def decorate_ntips_rank(tree):
     Parameters
     ----------
     tree : TreeNode
+    context : TaxonomyContext, optional
 
     """
-    n_ranks = len(RANK_ORDER)
+    n_ranks = get_context(context).n_ranks
 
     for node in tree.postorder(include_self=True):
         counts = defaultdict(int)
@@ -374,7 +613,7 @@ def decorate_ntips_rank(tree):
         node.NumTipsRank = counts
 
 
-def pick_names(tree):
+def pick_names(tree, context=None):
     """Does an initial decoration of names on the tree
 
     The best name by relative frequency is placed, from kingdom -> species,
@@ -382,26 +621,34 @@ def pick_names(tree):
     placed
 
     """
-    names_prealloc = [None] * len(RANK_ORDER)
+    n_ranks = get_context(context).n_ranks
 
     for node in tree.non_tips(include_self=True):
-        names = names_prealloc[:]
-        count = 0
-
-        # set names at ranksafe nodes, stop if we've set a name and descendent
-        # rank names are not safe.
-        for rank, is_safe in enumerate(node.RankSafe):
-            if is_safe:
-                # place best name
-                count += 1
-                relfreq = node.ConsensusRelFreq[rank].items()
-                names[rank] = sorted(relfreq, key=itemgetter(1))[-1][0]
-            else:
-                # if we've had one or more useless rank, set remaining to None
-                if count >= 1:
-                    break
+        node.RankNames = node_rank_names(node.RankSafe, node.ConsensusRelFreq,
+                                         n_ranks)
+
+
+def node_rank_names(ranksafe, relfreq, n_ranks):
+    """Returns the RankNames picked for a node, see pick_names"""
+    names = [None] * n_ranks
+    if not ranksafe:
+        return names
+
+    # set names at ranksafe nodes, stop if we've set a name and descendent
+    # rank names are not safe. These are the run of set bits starting at the
+    # lowest one.
+    first = (ranksafe & -ranksafe).bit_length() - 1
+    run = ranksafe >> first
+    stop = first + (run ^ (run + 1)).bit_length() - 1
+
+    for rank in range(first, stop):
+        # a safe rank has a single name at >= 0.5, the most frequent one
+        for name, freq in relfreq[rank].iteritems():
+            if freq >= 0.5:
+                names[rank] = name
+                break
 
-        node.RankNames = names
+    return names
 
 
 def fmeasure(precision, recall):
@@ -442,7 +689,7 @@ def min_tips(nodes):
 
 
 def name_node_score_fold(tree, score_f=fmeasure, tiebreak_f=min_tips,
-                         verbose=False):
+                         verbose=False, context=None):
     """Compute name scores for internal nodes, pick the 'best'
 
     For this method, we traverse the tree once building up a dict of scores
@@ -453,63 +700,105 @@ def name_node_score_fold(tree, score_f=fmeasure, tiebreak_f=min_tips,
     if verbose:
         print "Starting name_node_score_fold..."
 
-    name_node_score = {i: {} for i in range(len(RANK_ORDER))}
-    n_ranks = len(RANK_ORDER)
-
     for node in tree.non_tips(include_self=True):
-        node.RankNameScores = [None] * n_ranks
+        node.RankNameScores = node_rank_name_scores(node.RankNames,
+                                                    node.ValidRelFreq,
+                                                    node.ConsensusRelFreq,
+                                                    score_f)
 
-        for rank, name in enumerate(node.RankNames):
-            if name is None:
-                continue
+    fold_rank_names(tree, tiebreak_f, context=context)
 
-            # precision in this case is the percent of informative tips that
-            # descend that are of the name relative to the number of
-            # informative tips that descend
-            precision = node.ValidRelFreq[rank][name]
 
-            # recall in this case is the percent of informative tips that
-            # descent that are of the name relative to the total number of
-            # tips in the tree with name
-            recall = node.ConsensusRelFreq[rank][name]
+def node_rank_name_scores(rank_names, valid, relfreq, score_f=fmeasure):
+    """Returns the RankNameScores of a node, see name_node_score_fold
 
-            # calculate score and save it for the corrisponding rank position
-            # so that these values can be examined later in other contexts
-            score = score_f(precision, recall)
-            node.RankNameScores[rank] = score
+    Parameters
+    ----------
+    rank_names : list of str or None
+        The RankNames of the node
+    valid, relfreq : dict of dict
+        The ValidRelFreq and ConsensusRelFreq of the node
+    score_f : function
+        Scores a name from its precision and recall
+    """
+    scores = [None] * len(rank_names)
+    for rank, name in enumerate(rank_names):
+        if name is None:
+            continue
+
+        # precision in this case is the percent of informative tips that
+        # descend that are of the name relative to the number of
+        # informative tips that descend
+        precision = valid[rank][name]
+
+        # recall in this case is the percent of informative tips that
+        # descent that are of the name relative to the total number of
+        # tips in the tree with name
+        recall = relfreq[rank][name]
+
+        # calculate score and save it for the corrisponding rank position
+        # so that these values can be examined later in other contexts
+        scores[rank] = score_f(precision, recall)
+    return scores
+
+
+def fold_rank_names(tree, tiebreak_f=min_tips, context=None):
+    """Keep each name only on the node with its best RankNameScores
+
+    Expects RankNames and RankNameScores on the internal nodes, see
+    name_node_score_fold
+    """
+    n_ranks = get_context(context).n_ranks
+    name_node_score = {i: {} for i in range(n_ranks)}
+
+    for node in tree.non_tips(include_self=True):
+        for rank, name in enumerate(node.RankNames):
+            if name is None:
+                continue
 
             if name not in name_node_score[rank]:
                 name_node_score[rank][name] = []
-            name_node_score[rank][name].append((node, score))
+            name_node_score[rank][name].append((node,
+                                                node.RankNameScores[rank]))
 
     # run through the built up dict and pick the best node for a name
     for rank, names in name_node_score.items():
         for name, node_scores in names.items():
-            node_scores_sorted = sorted(node_scores, key=itemgetter(1))[::-1]
-            nodes, scores = unzip(node_scores_sorted)
-            scores = array(scores)
-
-            # if there is a tie in scores...
-            if sum(scores == scores[0]) > 1:
-                # ugly hack to get around weird shape mismatch
-                indices = where(scores == scores[0], range(len(nodes)), None)
-                tie_nodes = []
-                for i in indices:
-                    if i is not None:
-                        tie_nodes.append(nodes[i])
-                    else:
-                        tie_nodes.append(None)
-                node_to_keep = tiebreak_f(tie_nodes)
-                for node, score in node_scores_sorted:
-                    if node == node_to_keep:
-                        continue
-                    else:
-                        node.RankNames[rank] = None
-            else:
-                for node, score in node_scores_sorted[1:]:
+            node_to_keep = best_scoring_node(node_scores, tiebreak_f)
+            for node, score in node_scores:
+                if node is not node_to_keep:
                     node.RankNames[rank] = None
 
 
+def best_scoring_node(node_scores, tiebreak_f=min_tips):
+    """Returns the node that keeps a name, see name_node_score_fold
+
+    Parameters
+    ----------
+    node_scores : list of (TreeNode, float)
+        The nodes with the name and their scores, in postorder
+    tiebreak_f : function
+        Picks one of the nodes tied for the best score
+    """
+    node_scores_sorted = sorted(node_scores, key=itemgetter(1))[::-1]
+    nodes, scores = unzip(node_scores_sorted)
+    scores = array(scores)
+
+    # if there is a tie in scores...
+    if sum(scores == scores[0]) > 1:
+        # ugly hack to get around weird shape mismatch
+        indices = where(scores == scores[0], range(len(nodes)), None)
+        tie_nodes = []
+        for i in indices:
+            if i is not None:
+                tie_nodes.append(nodes[i])
+            else:
+                tie_nodes.append(None)
+        return tiebreak_f(tie_nodes)
+
+    return nodes[0]
+
+
 def score_tree(tree, verbose=False):
     """Scores the tree based on RankNameScores and tip coverage
 
@@ -533,13 +822,13 @@ def score_tree(tree, verbose=False):
     return total_score / tip_count
 
 
-def set_preliminary_name_and_rank(tree):
+def set_preliminary_name_and_rank(tree, context=None):
     """Sets names and rank at a node
 
     This method is destructive: will destroy the Name attribute on tree
     """
 
-    n_ranks = len(RANK_ORDER)
+    n_ranks = get_context(context).n_ranks
     empty_ranknames = [None] * n_ranks
 
     for node in tree.non_tips(include_self=True):
@@ -560,6 +849,7 @@ def set_preliminary_name_and_rank(tree):
 
 def make_consensus_tree(cons_split, check_for_rank=True, tips=None):
     """Returns a mapping by rank for names to their parent names and counts"""
+    from skbio import TreeNode
 
     god_node = TreeNode(name=None)
     god_node.Rank = None
@@ -614,6 +904,73 @@ def make_consensus_tree(cons_split, check_for_rank=True, tips=None):
     return god_node, lookup
 
 
+class ConsensusNode(object):
+    """A taxon of the trie built by make_consensus_lookup
+
+    Has the name, Rank and parent that walk_consensus_tree uses of the
+    TreeNodes of make_consensus_tree, without the cost of a TreeNode.
+    """
+    __slots__ = ('name', 'Rank', 'parent', 'children', 'child_lookup')
+
+    def __init__(self, name, rank, parent):
+        self.name = name
+        self.Rank = rank
+        self.parent = parent
+        self.children = []
+        self.child_lookup = {}
+
+
+def make_consensus_lookup(cons_split, check_for_rank=True):
+    """Returns the lookup of make_consensus_tree, without building a tree
+
+    Identical lineages are walked once, so the cost is proportional to the
+    number of distinct lineages. The nodes are ConsensusNodes, and a name
+    that occurs in several places maps to the same node as it does for
+    make_consensus_tree, the last in preorder.
+    """
+    # keep the first occurrence of each lineage, so children are added in
+    # the same order as in make_consensus_tree
+    # the lists are held by cons_split, so their ids are not reused
+    cons_split = list(cons_split)
+    seen_lists = set()
+    seen = set()
+    distinct = []
+    for con in cons_split:
+        if id(con) in seen_lists:
+            continue
+        seen_lists.add(id(con))
+        key = tuple(con)
+        if key not in seen:
+            seen.add(key)
+            distinct.append(key)
+
+    root = ConsensusNode(None, None, None)
+    for con in distinct:
+        cur_node = root
+        for rank, name in enumerate(con):
+            child = cur_node.child_lookup.get(name)
+            if child is None:
+                child = ConsensusNode(name, rank, cur_node)
+                cur_node.child_lookup[name] = child
+                cur_node.children.append(child)
+            cur_node = child
+
+    lookup = {}
+    stack = root.children[::-1]
+    while stack:
+        node = stack.pop()
+        stack.extend(node.children[::-1])
+
+        name = node.name
+        if name is None:
+            continue
+        if check_for_rank and '__' in name and name.split('__')[1] == '':
+            continue
+        lookup[name] = node
+
+    return lookup
+
+
 def get_nearest_named_ancestor(node):
     """Returns node of nearest .name'd ancestor
 
@@ -625,7 +982,7 @@ def get_nearest_named_ancestor(node):
     return curr
 
 
-def backfill_names_gap(tree, consensus_lookup, verbose=False):
+def backfill_names_gap(tree, consensus_lookup, verbose=False, context=None):
     """Fill in missing names
 
     use the consensus tree mapped by nodes_lookup to attempt to fill in missing
@@ -636,7 +993,22 @@ def backfill_names_gap(tree, consensus_lookup, verbose=False):
     We set the attribute BackFillNames here as we want to attempt to collapse
     names later if we sanely and easily can
     """
-    for node in tree.non_tips(include_self=True):
+    context = get_context(context)
+    paths = ancestor_paths(consensus_lookup, context)
+
+    # a preorder walk carries the nearest named ancestor of each node, see
+    # get_nearest_named_ancestor
+    stack = [(tree, None)]
+    while stack:
+        node, named_ancestor = stack.pop()
+
+        if node.name is not None:
+            child_ancestor = node
+        else:
+            child_ancestor = named_ancestor
+        for child in reversed(node.children):
+            if child.children:
+                stack.append((child, child_ancestor))
 
         if node.name is not None:
             node.BackFillNames = [node.name]
@@ -655,8 +1027,6 @@ def backfill_names_gap(tree, consensus_lookup, verbose=False):
             continue
 
         # find nearest ranked parent
-        named_ancestor = get_nearest_named_ancestor(node)
-
         if named_ancestor is None:
             if verbose:
                 print "Unable to find a named parent for %s" % (node.name)
@@ -667,25 +1037,75 @@ def backfill_names_gap(tree, consensus_lookup, verbose=False):
         # this is indicative of a problem with the consensus strings
         if levels < 0:
             print node.name, node.Rank, named_ancestor.Rank
-            print '\t', node.RankSafe
+            print '\t', ranksafe_ranks(node.RankSafe)
             print '\t', node.RankNames
-            print '\t', named_ancestor.RankSafe
+            print '\t', ranksafe_ranks(named_ancestor.RankSafe)
             print '\t', named_ancestor.RankNames
             node.BackFillNames = []
             continue
         elif levels == 1:
             continue
 
-        # walk consensus tree for missing names
-        names = walk_consensus_tree(consensus_lookup, node.name, levels)
-        node.BackFillNames = names
+        # the missing names are the last levels names of the lineage, as
+        # walk_consensus_tree would find them
+        path = paths[node.name]
+        node.BackFillNames = list(path[max(0, len(path) - levels):])
+
+
+def ancestor_paths(lookup, context=None):
+    """Returns the lineage of each name of a consensus lookup
 
+    Parameters
+    ----------
+    lookup : dict
+        {name: node} as returned by make_consensus_lookup or
+        make_consensus_tree
+    context : TaxonomyContext, optional
+
+    Returns
+    -------
+    dict of tuple
+        {name: lineage}, where lineage[rank] is the name of the ancestor at
+        that rank, or the empty rank, e.g. 'f__', for a gap. The last name
+        is the name itself.
+    """
+    rank_order = get_context(context).rank_order
+    paths = {}
+    node_paths = {}
+
+    for name, node in lookup.iteritems():
+        # walk up to the root or to an ancestor with a known lineage
+        chain = []
+        curr = node
+        while curr is not None and curr.Rank is not None and \
+                id(curr) not in node_paths:
+            chain.append(curr)
+            curr = curr.parent
+
+        if curr is None or curr.Rank is None:
+            path = ()
+        else:
+            path = node_paths[id(curr)]
+
+        for curr in reversed(chain):
+            if curr.name is None:
+                path = path + ('%s__' % rank_order[curr.Rank], )
+            else:
+                path = path + (curr.name, )
+            node_paths[id(curr)] = path
+
+        paths[name] = path
 
-def walk_consensus_tree(lookup, name, levels, reverse=True, verbose=False):
+    return paths
+
+
+def walk_consensus_tree(lookup, name, levels, reverse=True, verbose=False,
+                        context=None):
     """Walk up the consensus tree for n levels, return names
 
     if reverse is True, names are [::-1]
     """
+    rank_order = get_context(context).rank_order
     node = lookup[name]
     names = [name]
     curr = node.parent
@@ -702,7 +1122,7 @@ def walk_consensus_tree(lookup, name, levels, reverse=True, verbose=False):
         if curr.name is None:
             if verbose:
                 print "Gap in consensus tree! See node %s" % name
-            names.append('%s__' % RANK_ORDER[curr.Rank])
+            names.append('%s__' % rank_order[curr.Rank])
         else:
             names.append(curr.name)
         curr = curr.parent
@@ -779,29 +1199,36 @@ class TaxaName(object):
 def make_names_unique(tree, append_suffix=True, suffix_glue_char='_', verbose=False):
     """Appends on a unique number if multiple of the same names exist
 
-    ordered by number of tips, ie, _1 has more tips that _2
+    ordered by number of tips, ie, _1 has more tips that _2. Nodes with as
+    many tips are ordered as they appear in the newick, ie, _1 is to the
+    left of _2.
 
     expects .BackFillNames to be set
     """
     if verbose:
         print "Assigning unique tags to duplicate names..."
 
-    # build up a dict of the names and how many tips descend
+    # build up a dict of the names and how many tips descend. The nodes were
+    # once compared themselves on ties, which orders them by memory address:
+    # mostly, but not reliably, as they were created while parsing the
+    # newick. Their preorder index is that order made reproducible, such as
+    # on a tree restored from a checkpoint.
     name_lookup = {}
-    for node in tree.non_tips(include_self=True):
-        if node.name is None:
+    for order, node in enumerate(tree.preorder(include_self=True)):
+        if node.is_tip() or node.name is None:
             continue
         else:
             for idx, name in enumerate(node.BackFillNames):
                 if name not in name_lookup:
                     name_lookup[name] = []
-                name_info = ((node.TipStop - node.TipStart), idx, node)
+                name_info = ((node.TipStop - node.TipStart), idx, order, node)
                 name_lookup[name].append(name_info)
 
     # assign unique numbers based on the number of tips that descend
     for name, scores_and_nodes in name_lookup.items():
-        sorted_scores = sorted(scores_and_nodes)[::-1]
-        for count, (score, idx, node) in enumerate(sorted_scores):
+        sorted_scores = sorted(scores_and_nodes,
+                               key=lambda info: (-info[0], -info[1], info[2]))
+        for count, (score, idx, order, node) in enumerate(sorted_scores):
             # only assign a number of we have more than 1
             if count > 0:
                 if node.BackFillNames[idx].split('__')[1] != '':
@@ -820,7 +1247,8 @@ def make_names_unique(tree, append_suffix=True, suffix_glue_char='_', verbose=Fa
             node.name = '; '.join(node.BackFillNames)
 
 
-def pull_consensus_strings(tree, verbose=False, append_prefix=True):
+def pull_consensus_strings(tree, verbose=False, append_prefix=True,
+                           context=None):
     """Pulls consensus strings off of tree
 
     assumes .name is set
@@ -828,14 +1256,21 @@ def pull_consensus_strings(tree, verbose=False, append_prefix=True):
     if verbose:
         print "Pulling consensus strings..."
 
-    constrings = []
-    rank_order_rev = {r: i for i, r in enumerate(RANK_ORDER)}
+    return list(iter_consensus_strings(tree, append_prefix, context))
+
+
+def iter_consensus_strings(tree, append_prefix=True, context=None):
+    """Yields the consensus strings of pull_consensus_strings one at a time"""
+    context = get_context(context)
+    rank_order = context.rank_order
+
+    rank_order_rev = context.rank_index
     # start at the tip and travel up
     for tip in tree.tips():
         if append_prefix:
-            consensus_string = ['%s__' % r for r in RANK_ORDER]
+            consensus_string = ['%s__' % r for r in rank_order]
         else:
-            consensus_string = ['' for r in RANK_ORDER]
+            consensus_string = ['' for r in rank_order]
 
         tipid = tip.name
         n = tip.parent
@@ -865,8 +1300,90 @@ def pull_consensus_strings(tree, verbose=False, append_prefix=True):
                 consensus_string[rank_idx] = n.name
 
         # join strings with tip id
-        constrings.append('\t'.join([tipid, '; '.join(consensus_string)]))
-    return constrings
+        yield '\t'.join([tipid, '; '.join(consensus_string)])
+
+
+class ConsensusStrings(object):
+    """The consensus strings of the tips of a tree, built as they are read
+
+    Iterating yields the strings of pull_consensus_strings. The tips under the
+    same named node share the string of their lineage, so one string is held
+    per lineage rather than per tip.
+
+    Parameters
+    ----------
+    tipids : list of str
+        The names of the tips, in order
+    lineages : list of str
+        The consensus string of each tip, without its id
+    """
+    def __init__(self, tipids, lineages):
+        self.tipids = tipids
+        self.lineages = lineages
+
+    def __iter__(self):
+        for tipid, lineage in zip(self.tipids, self.lineages):
+            yield '\t'.join([tipid, lineage])
+
+    def __len__(self):
+        return len(self.tipids)
+
+    def __getitem__(self, idx):
+        return '\t'.join([self.tipids[idx], self.lineages[idx]])
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def consensus_strings(tree, verbose=False, append_prefix=True, context=None):
+    """Returns the consensus strings of pull_consensus_strings lazily
+
+    The names are read from the tree now, so that it may be renamed, e.g., by
+    save_bootstraps, before the strings are read. See ConsensusStrings.
+    """
+    if verbose:
+        print "Pulling consensus strings..."
+
+    context = get_context(context)
+    rank_index = context.rank_index
+    if append_prefix:
+        empty = ['%s__' % r for r in context.rank_order]
+    else:
+        empty = ['' for r in context.rank_order]
+
+    # as iter_consensus_strings walks up and overwrites, the name of a rank
+    # closest to the root wins, so a node only names the ranks its ancestors
+    # leave unnamed. A node without a name shares the lineage of its parent.
+    tipids = []
+    lineages = []
+    root = (empty, '; '.join(empty), (False,) * len(empty))
+    stack = [(tree, root)]
+    while stack:
+        node, lineage = stack.pop()
+        if not node.children:
+            tipids.append(node.name)
+            lineages.append(lineage[1])
+            continue
+
+        if node.name:
+            consensus = lineage[0][:]
+            named = list(lineage[2])
+            if ';' in node.name:
+                names = [r.strip() for r in node.name.split(';')]
+            else:
+                names = [node.name]
+            for name in names:
+                rank = rank_index[name[0]]
+                if not lineage[2][rank]:
+                    consensus[rank] = name
+                    named[rank] = True
+            lineage = (consensus, '; '.join(consensus), tuple(named))
+        stack.extend((child, lineage) for child in reversed(node.children))
+
+    return ConsensusStrings(tipids, lineages)
 
 
 def save_bootstraps(tree, verbose=False):
@@ -910,7 +1427,7 @@ def is_float(s):
         return False
 
 
-def validate_all_paths(tree):
+def validate_all_paths(tree, context=None):
     """Walk each path in the tree and make sure there aren't any conflicts"""
     # helper getpath method
     def getpath_f(n):
@@ -937,7 +1454,7 @@ def validate_all_paths(tree):
                 clean_path.append(p)
         return clean_path
 
-    rank_order_rev = {r: i for i, r in enumerate(RANK_ORDER)}
+    rank_order_rev = get_context(context).rank_index
 
     bad_tips = []
 
@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+
+"""The decorate pipeline
+
+The stages of t2t decorate, in order, along with the tree attributes and
+state each of them produces. The produced attributes are what is written to a
+checkpoint directory after a stage completes, so that a later run can resume
+from any stage without redoing the ones before it. The attributes a stage
+consumes can be released from the tree once the last stage to consume them
+has run.
+"""
+
+import os
+import gzip
+import json
+import cPickle
+from shutil import rmtree
+
+import t2t.nlevel as nl
+import t2t.sweep as sw
+import t2t.subtrees as sub
+from t2t.stats import timed
+from t2t.treecache import (tree_to_arrays, arrays_to_tree, save_tree_arrays,
+                           load_tree_arrays)
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+MANIFEST = 'manifest.json'
+TREE_DIR = 'tree'
+
+# marks an attribute that is not set on a node, e.g., RankNames on tips
+_MISSING = '__t2t_missing__'
+
+
+class CheckpointError(ValueError):
+    """A checkpoint that cannot be resumed from"""
+    pass
+
+
+class Stage(object):
+    """A step of the decorate pipeline
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage, used with --resume-from
+    func : function
+        Called with the pipeline state dict
+    attrs : tuple of str
+        The node attributes the stage sets
+    state : tuple of str
+        The keys of the pipeline state the stage sets
+    params : tuple of str
+        The keys of the pipeline state that change the stage's result
+    replay : bool
+        If True, the stage is cheap and is rerun instead of restored
+    consumes : tuple of str
+        The intermediate node attributes the stage reads, which are not
+        needed once the last stage to consume them has run
+    """
+    def __init__(self, name, func, attrs=(), state=(), params=(),
+                 replay=False, consumes=()):
+        self.name = name
+        self.func = func
+        self.attrs = attrs
+        self.state = state
+        self.params = params
+        self.replay = replay
+        self.consumes = consumes
+
+
+def _load_tree(state):
+    state['tree'] = nl.load_tree(state['tree'], state['tipname_map'],
+                                 context=state['context'])
+
+
+def _collect_names_at_ranks_counts(state):
+    state['counts'] = nl.collect_names_at_ranks_counts(
+        state['tree'], context=state['context'])
+
+
+def _decorate_ntips(state):
+    nl.decorate_ntips(state['tree'], context=state['context'])
+
+
+# the frequencies later stages look at, see decorate_name_relative_freqs
+LOW_MEMORY_RELFREQ = 0.5
+
+
+def _decorate_name_relative_freqs(state):
+    min_relfreq = LOW_MEMORY_RELFREQ if state.get('low_memory') else 0.0
+    if state.get('jobs', 1) > 1:
+        # also sets what set_ranksafe, pick_names and the scoring of
+        # name_node_score_fold set, see t2t.subtrees. Only the frequencies
+        # later stages look at are sent back from the workers.
+        sub.decorate_subtrees(state['tree'], state['counts'],
+                              state['min_count'], state['jobs'],
+                              context=state['context'],
+                              min_relfreq=LOW_MEMORY_RELFREQ)
+        state['subtrees_decorated'] = True
+        return
+
+    nl.decorate_name_relative_freqs(state['tree'], state['counts'],
+                                    state['min_count'],
+                                    context=state['context'],
+                                    min_relfreq=min_relfreq)
+
+
+def _set_ranksafe(state):
+    if not state.get('subtrees_decorated'):
+        nl.set_ranksafe(state['tree'], context=state['context'])
+
+
+def _pick_names(state):
+    if not state.get('subtrees_decorated'):
+        nl.pick_names(state['tree'], context=state['context'])
+
+
+def _name_node_score_fold(state):
+    state['score_sweep'] = None
+    if state['score_betas']:
+        state['score_sweep'] = sw.score_sweep(state['tree'],
+                                              state['score_betas'],
+                                              context=state['context'])
+    if state.get('subtrees_decorated'):
+        nl.fold_rank_names(state['tree'], context=state['context'])
+    else:
+        nl.name_node_score_fold(state['tree'], verbose=state['verbose'],
+                                context=state['context'])
+
+
+def _set_preliminary_name_and_rank(state):
+    nl.set_preliminary_name_and_rank(state['tree'], context=state['context'])
+
+
+def _make_consensus_tree(state):
+    state['contree_lookup'] = nl.make_consensus_lookup(
+        state['tipname_map'].values())
+
+
+def _backfill_names_gap(state):
+    nl.backfill_names_gap(state['tree'], state['contree_lookup'],
+                          verbose=state['verbose'], context=state['context'])
+
+
+def _commonname_promotion(state):
+    nl.commonname_promotion(state['tree'])
+
+
+def _make_names_unique(state):
+    if not state['no_suffix']:
+        nl.make_names_unique(state['tree'],
+                             suffix_glue_char=state['suffix_char'],
+                             verbose=state['verbose'])
+
+
+def _pull_consensus_strings(state):
+    # built as they are written, save_bootstraps renames the tree first
+    state['constrings'] = nl.consensus_strings(
+        state['tree'], verbose=state['verbose'], context=state['context'])
+
+
+def _save_bootstraps(state):
+    nl.save_bootstraps(state['tree'], verbose=state['verbose'])
+
+
+DECORATE_STAGES = [
+    Stage('load_tree', _load_tree,
+          attrs=('name', 'Consensus', 'Bootstrap')),
+    Stage('collect_names_at_ranks_counts', _collect_names_at_ranks_counts,
+          state=('counts',)),
+    Stage('decorate_ntips', _decorate_ntips, attrs=('NumTips',)),
+    Stage('decorate_name_relative_freqs', _decorate_name_relative_freqs,
+          attrs=('ConsensusRelFreq', 'ValidRelFreq'), params=('min_count',)),
+    Stage('set_ranksafe', _set_ranksafe, attrs=('RankSafe',),
+          consumes=('ConsensusRelFreq',)),
+    Stage('pick_names', _pick_names, attrs=('RankNames',),
+          consumes=('RankSafe', 'ConsensusRelFreq')),
+    Stage('name_node_score_fold', _name_node_score_fold,
+          attrs=('RankNames', 'RankNameScores'), state=('score_sweep',),
+          params=('score_betas',),
+          consumes=('ConsensusRelFreq', 'ValidRelFreq')),
+    Stage('set_preliminary_name_and_rank', _set_preliminary_name_and_rank,
+          attrs=('name', 'Rank')),
+    Stage('make_consensus_tree', _make_consensus_tree,
+          state=('contree_lookup',), replay=True),
+    Stage('backfill_names_gap', _backfill_names_gap,
+          attrs=('BackFillNames',), consumes=('RankSafe',)),
+    Stage('commonname_promotion', _commonname_promotion,
+          attrs=('BackFillNames', 'name')),
+    Stage('make_names_unique', _make_names_unique,
+          attrs=('BackFillNames', 'name'),
+          params=('no_suffix', 'suffix_char')),
+    Stage('pull_consensus_strings', _pull_consensus_strings,
+          state=('constrings',)),
+    Stage('save_bootstraps', _save_bootstraps, attrs=('name',)),
+]
+
+STAGE_NAMES = [s.name for s in DECORATE_STAGES]
+
+
+def _released_after(stages):
+    """Returns {stage index: the attributes no later stage consumes}"""
+    last = {}
+    for idx, stage in enumerate(stages):
+        for attr in stage.consumes:
+            last[attr] = idx
+
+    released = {}
+    for attr, idx in sorted(last.items()):
+        released.setdefault(idx, []).append(attr)
+    return released
+
+
+RELEASED_AFTER = _released_after(DECORATE_STAGES)
+
+
+def release_attrs(tree, attrs):
+    """Remove attrs from the nodes of tree"""
+    for node in tree.traverse(include_self=True):
+        node_attrs = vars(node)
+        for attr in attrs:
+            node_attrs.pop(attr, None)
+
+
+def _checkpoint_fp(checkpoint_dir, idx, stage):
+    return os.path.join(checkpoint_dir, '%02d-%s.pkl.gz' % (idx, stage.name))
+
+
+def load_manifest(checkpoint_dir):
+    """Returns the manifest of a checkpoint directory, or None"""
+    fp = os.path.join(checkpoint_dir, MANIFEST)
+    if not os.path.exists(fp):
+        return None
+    with open(fp) as fh:
+        return json.load(fh)
+
+
+def save_manifest(checkpoint_dir, manifest):
+    """Write the manifest, replacing any existing one atomically"""
+    fp = os.path.join(checkpoint_dir, MANIFEST)
+    with open(fp + '.tmp', 'w') as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.rename(fp + '.tmp', fp)
+
+
+def write_checkpoint(checkpoint_dir, idx, stage, state):
+    """Serialize what a stage produced
+
+    Node attributes are stored as one list per attribute, in preorder.
+    """
+    tree = state['tree']
+
+    if idx == 0:
+        tree_dir = os.path.join(checkpoint_dir, TREE_DIR)
+        if os.path.isdir(tree_dir):
+            rmtree(tree_dir)
+        save_tree_arrays(tree_to_arrays(tree), tree_dir)
+
+    attrs = {}
+    if stage.attrs:
+        nodes = list(tree.preorder(include_self=True))
+        for attr in stage.attrs:
+            attrs[attr] = [getattr(n, attr, _MISSING) for n in nodes]
+
+    data = {'attrs': attrs,
+            'state': {k: state[k] for k in stage.state}}
+
+    fp = _checkpoint_fp(checkpoint_dir, idx, stage)
+    fh = gzip.open(fp + '.tmp', 'wb', compresslevel=1)
+    try:
+        cPickle.dump(data, fh, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        fh.close()
+    os.rename(fp + '.tmp', fp)
+
+
+def read_checkpoint(checkpoint_dir, idx, stage, state):
+    """Restore what a stage produced onto the tree and into state"""
+    if idx == 0:
+        tree_dir = os.path.join(checkpoint_dir, TREE_DIR)
+        state['tree'] = arrays_to_tree(load_tree_arrays(tree_dir))
+
+    fh = gzip.open(_checkpoint_fp(checkpoint_dir, idx, stage), 'rb')
+    try:
+        data = cPickle.load(fh)
+    finally:
+        fh.close()
+
+    if data['attrs']:
+        nodes = list(state['tree'].preorder(include_self=True))
+        for attr, values in data['attrs'].iteritems():
+            for node, value in zip(nodes, values):
+                if value != _MISSING:
+                    setattr(node, attr, value)
+
+    state.update(data['state'])
+
+
+def _stage_params(stage, state):
+    return {k: state[k] for k in stage.params}
+
+
+def run_decorate(tree, tipname_map, min_count=2, no_suffix=False,
+                 suffix_char='_', checkpoint_dir=None, resume_from=None,
+                 inputs=None, stats=None, verbose=False, context=None,
+                 score_betas=None, low_memory=False, jobs=1):
+    """Decorate a taxonomy onto a tree
+
+    Parameters
+    ----------
+    tree : str, file or TreeNode
+        The input tree, as accepted by load_tree
+    tipname_map : dict
+        {id_: [tax, string]}, as returned by load_consensus_map
+    min_count : int
+        The minimum number of tips that must represent a name
+    no_suffix : bool
+        Do not append suffixes to polyphyletic names
+    suffix_char : str
+        The character used to glue suffixes on polyphyletic names
+    checkpoint_dir : str, optional
+        If set, the output of each stage is written to this directory
+    resume_from : str, optional
+        The name of the stage to resume from. Stages prior to it are restored
+        from checkpoint_dir.
+    inputs : dict, optional
+        Identifies the inputs, e.g., their content hashes. A checkpoint can
+        only be resumed with the same inputs.
+    stats : StageStats, optional
+        If set, the resource usage of each stage is recorded
+    verbose : bool
+    context : TaxonomyContext, optional
+        The ranks of the consensus map, defaults to the module level settings
+        of t2t.nlevel at the time of the call
+    score_betas : list of float, optional
+        If set, the names are also folded and scored under the F-beta metric
+        of each beta, see t2t.sweep.score_sweep
+    low_memory : bool
+        Only keep the frequencies of the names with a ConsensusRelFreq of at
+        least 0.5, the ones the later stages look at, and release the
+        attributes stages consume once the last stage to consume them has
+        run. RankNameScores still holds the scores of the names kept, for
+        score_tree.
+    jobs : int
+        The number of processes to decorate the subtrees of the tree in, see
+        t2t.subtrees. The names are then folded over the whole tree. Only
+        the frequencies of at least 0.5 are kept, as with low_memory. The
+        stages after decorate_name_relative_freqs are run serially when
+        resuming from them.
+
+    Returns
+    -------
+    dict
+        The pipeline state, 'tree' is the decorated tree and 'constrings'
+        the consensus strings of the tips. 'score_sweep' holds the results
+        of the score sweep, if one was requested.
+
+    Raises
+    ------
+    CheckpointError
+        If a checkpoint cannot be resumed from the requested stage
+    """
+    state = {'tree': tree,
+             'tipname_map': tipname_map,
+             'min_count': min_count,
+             'no_suffix': no_suffix,
+             'suffix_char': suffix_char,
+             'verbose': verbose,
+             'score_betas': list(score_betas) if score_betas else None,
+             'low_memory': low_memory,
+             'jobs': jobs,
+             'context': nl.get_context(context)}
+    inputs = inputs or {}
+    released = RELEASED_AFTER if low_memory else {}
+
+    start = 0
+    if resume_from is not None:
+        if checkpoint_dir is None:
+            raise CheckpointError("Resuming requires a checkpoint "
+                                  "directory")
+        if resume_from not in STAGE_NAMES:
+            raise CheckpointError("Unknown stage %s" % resume_from)
+        start = STAGE_NAMES.index(resume_from)
+
+    manifest = None
+    if checkpoint_dir is not None:
+        if not os.path.isdir(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+        manifest = load_manifest(checkpoint_dir)
+
+    if start:
+        if manifest is None:
+            raise CheckpointError("No checkpoint found in %s" %
+                                  checkpoint_dir)
+        if manifest['inputs'] != inputs:
+            raise CheckpointError("The inputs differ from those of the "
+                                  "checkpoint")
+
+        completed = manifest['completed']
+        for idx, stage in enumerate(DECORATE_STAGES[:start]):
+            if stage.replay:
+                if verbose:
+                    print "Rerunning %s..." % stage.name
+                with timed(stats, stage.name, state['tree']):
+                    stage.func(state)
+                if idx in released:
+                    release_attrs(state['tree'], released[idx])
+                continue
+
+            if stage.name not in completed:
+                raise CheckpointError("Stage %s has not been checkpointed" %
+                                      stage.name)
+            if completed[stage.name] != _stage_params(stage, state):
+                raise CheckpointError("Stage %s was run with different "
+                                      "parameters, resume from it instead" %
+                                      stage.name)
+            if verbose:
+                print "Restoring %s..." % stage.name
+            with timed(stats, stage.name, restored=True) as record:
+                read_checkpoint(checkpoint_dir, idx, stage, state)
+                record['tree'] = state['tree']
+            if idx in released:
+                release_attrs(state['tree'], released[idx])
+
+        # later stages are stale now
+        for name in STAGE_NAMES[start:]:
+            completed.pop(name, None)
+    elif checkpoint_dir is not None:
+        manifest = {'inputs': inputs, 'completed': {}}
+
+    for idx, stage in enumerate(DECORATE_STAGES[start:], start):
+        with timed(stats, stage.name) as record:
+            stage.func(state)
+            record['tree'] = state['tree']
+
+        if checkpoint_dir is not None and not stage.replay:
+            with timed(stats, 'write_checkpoint', stage=stage.name):
+                write_checkpoint(checkpoint_dir, idx, stage, state)
+            manifest['completed'][stage.name] = _stage_params(stage, state)
+            save_manifest(checkpoint_dir, manifest)
+
+        if idx in released:
+            with timed(stats, 'release_attrs', stage=stage.name):
+                release_attrs(state['tree'], released[idx])
+
+    return state
@@ -38,3 +38,20 @@ def remap_taxonomy(mapping, taxa):
                 print "%s was: %s\nnow is %s" % (m, mapping[m], tax_str)
             res[m] = tax_str
     return res
+
+
+def remap_index(mapping, index):
+    """Remaps the taxonomy of a ConsensusIndex over the OTU clusters
+
+    Yields (id, taxonomy) as remap_taxonomy returns them. Only the members of
+    the clusters are fetched from the index, the other ids stream from it.
+    """
+    reps = members_to_rep(mapping)
+    taxa = {tax_id: tax_str.split('; ')
+            for _, tax_id, tax_str in index.rows(reps)}
+    for item in remap_taxonomy(mapping, taxa).iteritems():
+        yield item
+
+    for tax_id, tax_str in index.items():
+        if tax_id not in reps:
+            yield tax_id, tax_str.split('; ')
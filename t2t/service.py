@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+"""A resident decoration service
+
+Keeps a parsed reference tree in memory and decorates consensus maps against
+it over HTTP, on a localhost port or a Unix socket. The tree is held as the
+arrays of t2t.treecache, which already carry TipStart and TipStop, and a pool
+of worker processes is forked after they are loaded so that the workers share
+the topology read-only. Each request builds its own tree from the arrays, so
+concurrent requests do not see each other's decorations.
+
+    POST /decorate?min_count=2&no_suffix=0&suffix_char=_
+
+with a consensus map as the body returns
+
+    {"tree": "<decorated newick>", "consensus_strings": ["id\\tstring", ...]}
+"""
+
+import os
+import json
+import stat
+import errno
+import socket
+from collections import deque
+from multiprocessing import Pool
+from urlparse import urlparse, parse_qs
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn, UnixStreamServer
+
+import t2t.nlevel as nl
+from t2t.compression import open_input
+from t2t.newick import (newick_tokens, write_newick, write_lines, open_output,
+                        decoration_paths)
+from t2t.pipeline import run_decorate
+from t2t.treecache import (newick_to_arrays, arrays_to_tree,
+                           load_tree_arrays_cached)
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+# the tree arrays of a worker, set by _init_worker
+_ARRAYS = None
+
+
+def _init_worker(arrays):
+    global _ARRAYS
+    _ARRAYS = arrays
+
+
+def _run_lines(arrays, lines, min_count, no_suffix, suffix_char):
+    """Returns the state of run_decorate for a consensus map"""
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        raise ValueError("The consensus map is empty")
+
+    try:
+        seed_con = lines[0].strip().split('\t')[1]
+    except IndexError:
+        raise ValueError("Unable to parse the consensus map: %r" % lines[0])
+    context = nl.TaxonomyContext.from_consensus(seed_con)
+    tipname_map = nl.load_consensus_map(lines, False, context=context)
+
+    # only the names are returned, so the frequencies are released early
+    return run_decorate(arrays_to_tree(arrays), tipname_map,
+                        min_count=min_count, no_suffix=no_suffix,
+                        suffix_char=suffix_char, context=context,
+                        low_memory=True)
+
+
+def decorate_lines(arrays, lines, min_count=2, no_suffix=False,
+                   suffix_char='_'):
+    """Decorate a consensus map onto the tree held as arrays
+
+    Parameters
+    ----------
+    arrays : dict of ndarray
+        The tree, as returned by tree_to_arrays. It is not modified.
+    lines : list of str
+        The consensus map
+    min_count, no_suffix, suffix_char
+        As for run_decorate
+
+    Returns
+    -------
+    str, nl.ConsensusStrings
+        The decorated tree as newick and the consensus strings
+
+    Raises
+    ------
+    ValueError
+        If the consensus map is empty or cannot be parsed
+    """
+    state = _run_lines(arrays, lines, min_count, no_suffix, suffix_char)
+    return ''.join(newick_tokens(state['tree'])), state['constrings']
+
+
+def write_decorated_lines(arrays, lines, basename, compress=False,
+                          min_count=2, no_suffix=False, suffix_char='_'):
+    """Decorate a consensus map onto the tree and write the result
+
+    The newick and the consensus strings are written as they are produced,
+    see decorate_lines and nw.decoration_paths.
+
+    Returns
+    -------
+    str, str
+        The paths of the decorated tree and of the consensus strings
+    """
+    state = _run_lines(arrays, lines, min_count, no_suffix, suffix_char)
+    tree_fp, strings_fp = decoration_paths(basename, compress)
+    with open_output(strings_fp, compress) as fh:
+        write_lines(state['constrings'], fh)
+    with open_output(tree_fp, compress) as fh:
+        write_newick(state['tree'], fh)
+    return tree_fp, strings_fp
+
+
+def _decorate_in_worker(lines, min_count, no_suffix, suffix_char):
+    return decorate_lines(_ARRAYS, lines, min_count, no_suffix, suffix_char)
+
+
+def _decorate_file_in_worker(path, basename, compress, min_count, no_suffix,
+                             suffix_char):
+    with open_input(path) as fh:
+        lines = fh.readlines()
+    return write_decorated_lines(_ARRAYS, lines, basename, compress,
+                                 min_count, no_suffix, suffix_char)
+
+
+class DecorationService(object):
+    """Decorates consensus maps against a tree held in memory
+
+    Parameters
+    ----------
+    tree_fp : str
+        The newick file of the reference tree
+    jobs : int
+        The number of worker processes
+    tree_cache : str, optional
+        A directory of parsed tree caches, see t2t.treecache
+    """
+    def __init__(self, tree_fp, jobs=1, tree_cache=None):
+        if jobs < 1:
+            raise ValueError("At least one worker is needed")
+
+        if tree_cache is not None:
+            self.arrays = load_tree_arrays_cached(tree_fp, tree_cache)
+        else:
+            with open_input(tree_fp) as fh:
+                self.arrays = newick_to_arrays(fh)
+
+        self.tree_fp = tree_fp
+        self.jobs = jobs
+        self.n_requests = 0
+
+        # forked after the arrays are loaded so the workers share them
+        self.pool = Pool(jobs, _init_worker, (self.arrays,))
+
+    def decorate(self, lines, min_count=2, no_suffix=False, suffix_char='_'):
+        """Decorate a consensus map, see decorate_lines"""
+        self.n_requests += 1
+        return self.pool.apply(_decorate_in_worker,
+                               (lines, min_count, no_suffix, suffix_char))
+
+    def decorate_many(self, maps, min_count=2, no_suffix=False,
+                      suffix_char='_'):
+        """Decorate several consensus maps, spread over the workers
+
+        Returns
+        -------
+        iterator of (str, list of str)
+            The result of decorate for each map, in order, as each completes
+        """
+        args = [(lines, min_count, no_suffix, suffix_char) for lines in maps]
+        return self._decorate_window(_decorate_in_worker, args)
+
+    def decorate_files(self, paths, basenames, compress=False, min_count=2,
+                       no_suffix=False, suffix_char='_'):
+        """Decorate several consensus map files, spread over the workers
+
+        Each map is read, and its decoration written, by the worker that
+        decorates it, see write_decorated_lines, so that only the maps being
+        decorated are held in memory and no result is sent back.
+
+        Parameters
+        ----------
+        paths : list of str
+            The consensus maps
+        basenames : list of str
+            The output basename of each map
+
+        Returns
+        -------
+        iterator of (str, str)
+            The paths written for each map, in order, as each completes
+        """
+        args = [(path, basename, compress, min_count, no_suffix, suffix_char)
+                for path, basename in zip(paths, basenames)]
+        return self._decorate_window(_decorate_file_in_worker, args)
+
+    def _decorate_window(self, func, args):
+        """Yields func(*a) for each of args, in order, from the workers
+
+        At most jobs calls are pending at once, and a new one is submitted
+        only once the oldest result is consumed, so the results do not
+        accumulate when they are consumed more slowly than they complete.
+        """
+        pending = deque()
+        for a in args:
+            self.n_requests += 1
+            pending.append(self.pool.apply_async(func, a))
+            if len(pending) >= self.jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def status(self):
+        """Returns a description of the service"""
+        return {'tree': self.tree_fp,
+                'n_nodes': len(self.arrays['parent']),
+                'jobs': self.jobs,
+                'n_requests': self.n_requests}
+
+    def close(self):
+        """Stop the workers"""
+        self.pool.close()
+        self.pool.join()
+
+
+def _bool(value):
+    return value.lower() in ('1', 'true', 'yes')
+
+
+class DecorationHandler(BaseHTTPRequestHandler):
+    """Serves the DecorationService of the server"""
+
+    def address_string(self):
+        # clients of a Unix socket do not have an address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'local'
+
+    def _respond(self, code, result):
+        body = json.dumps(result)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/status':
+            self._respond(404, {'error': 'Unknown path %s' % self.path})
+            return
+        self._respond(200, self.server.service.status())
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/decorate':
+            self._respond(404, {'error': 'Unknown path %s' % self.path})
+            return
+
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.getheader('Content-Length', 0))
+        lines = self.rfile.read(length).splitlines()
+
+        try:
+            params = {'min_count': int(query.get('min_count', 2)),
+                      'no_suffix': _bool(query.get('no_suffix', '0')),
+                      'suffix_char': query.get('suffix_char', '_')}
+            tree, constrings = self.server.service.decorate(lines, **params)
+        except ValueError as e:
+            self._respond(400, {'error': str(e)})
+            return
+        except Exception as e:
+            self._respond(500, {'error': '%s: %s' % (type(e).__name__, e)})
+            return
+
+        self._respond(200, {'tree': tree,
+                            'consensus_strings': list(constrings)})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        UnixStreamServer.server_bind(self)
+        self.server_name = socket.gethostname()
+        self.server_port = 0
+
+
+def clear_socket(path):
+    """Remove the Unix socket at path, left behind by a server that is gone
+
+    Nothing is done if there is nothing at path.
+
+    Parameters
+    ----------
+    path : str
+
+    Raises
+    ------
+    ValueError
+        If path exists and is not a socket, or a server still listens on it
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        raise
+
+    if not stat.S_ISSOCK(mode):
+        raise ValueError("%s exists and is not a socket" % path)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        listening = True
+    except socket.error:
+        listening = False
+    finally:
+        sock.close()
+
+    if listening:
+        raise ValueError("A server is already listening on %s" % path)
+    os.remove(path)
+
+
+def make_server(service, host='127.0.0.1', port=0, socket_path=None,
+                verbose=False):
+    """Returns an HTTP server for service
+
+    Parameters
+    ----------
+    service : DecorationService
+    host : str
+        The address to listen on
+    port : int
+        The port to listen on, 0 picks a free one
+    socket_path : str, optional
+        If set, listen on this Unix socket instead of host and port
+    verbose : bool
+        Log requests to stderr
+
+    Raises
+    ------
+    ValueError
+        If socket_path cannot be listened on, see clear_socket
+    """
+    if socket_path is not None:
+        clear_socket(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, DecorationHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), DecorationHandler)
+
+    server.service = service
+    server.verbose = verbose
+    return server
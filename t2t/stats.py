@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""Resource usage of the stages of a t2t command
+
+Records wall time, CPU time and growth of the peak resident set size for each
+stage, along with the size of the tree being worked on, so that runs can be
+compared across releases.
+
+The work of worker processes, such as with --jobs, is recorded apart, as the
+CPU time and the largest peak resident set size of the children. The kernel
+only reports children once they have exited and been waited for, so they are
+counted in the stage that joins their pool.
+"""
+
+import sys
+import json
+import time
+import resource
+from contextlib import contextmanager
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+def cpu_time(who=resource.RUSAGE_SELF):
+    """Returns the user and system CPU seconds used by this process
+
+    With resource.RUSAGE_CHILDREN, those used by its children that have
+    exited and been waited for
+    """
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    """Returns the peak resident set size of this process in bytes
+
+    With resource.RUSAGE_CHILDREN, that of the largest of its children that
+    have exited and been waited for
+    """
+    maxrss = resource.getrusage(who).ru_maxrss
+
+    # linux reports kilobytes, OS X reports bytes
+    if sys.platform == 'darwin':
+        return maxrss
+    else:
+        return maxrss * 1024
+
+
+def tree_size(tree):
+    """Returns (number of nodes, number of tips) of tree"""
+    n_nodes = 0
+    n_tips = 0
+    for node in tree.postorder(include_self=True):
+        n_nodes += 1
+        if not node.children:
+            n_tips += 1
+    return n_nodes, n_tips
+
+
+class StageStats(object):
+    """Collects the resource usage of each stage of a command
+
+    Parameters
+    ----------
+    command : str
+        The name of the command being instrumented
+    """
+    def __init__(self, command):
+        self.command = command
+        self.stages = []
+        self._sizes = {}
+        self._start_wall = time.time()
+        self._start_cpu = cpu_time()
+        self._start_rss = peak_rss()
+        self._start_children_cpu = cpu_time(resource.RUSAGE_CHILDREN)
+
+    def _tree_size(self, tree):
+        # the topology does not change within a stage, only count it once
+        key = id(tree)
+        if key not in self._sizes:
+            self._sizes[key] = tree_size(tree)
+        return self._sizes[key]
+
+    @contextmanager
+    def stage(self, name, tree=None, **info):
+        """Record the resource usage of the enclosed block
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage
+        tree : TreeNode, optional
+            If provided, the node and tip counts of the tree are recorded.
+            The tree is examined after the block, so a tree being loaded can
+            be passed through info['tree'] from inside the block.
+        info : dict
+            Additional information to record for the stage
+        """
+        record = {'name': name}
+        record.update(info)
+
+        rss = peak_rss()
+        cpu = cpu_time()
+        children_cpu = cpu_time(resource.RUSAGE_CHILDREN)
+        wall = time.time()
+
+        yield record
+
+        record['wall_time'] = time.time() - wall
+        record['cpu_time'] = cpu_time() - cpu
+        record['peak_rss'] = peak_rss()
+        record['peak_rss_delta'] = record['peak_rss'] - rss
+        record['children_cpu_time'] = (cpu_time(resource.RUSAGE_CHILDREN) -
+                                       children_cpu)
+        record['children_peak_rss'] = peak_rss(resource.RUSAGE_CHILDREN)
+
+        tree = record.pop('tree', tree)
+        if tree is not None:
+            record['n_nodes'], record['n_tips'] = self._tree_size(tree)
+
+        self.stages.append(record)
+
+    def summary(self):
+        """Returns the recorded stages along with totals for the command"""
+        return {'command': self.command,
+                'stages': self.stages,
+                'wall_time': time.time() - self._start_wall,
+                'cpu_time': cpu_time() - self._start_cpu,
+                'peak_rss': peak_rss(),
+                'peak_rss_delta': peak_rss() - self._start_rss,
+                'children_cpu_time': (cpu_time(resource.RUSAGE_CHILDREN) -
+                                      self._start_children_cpu),
+                'children_peak_rss': peak_rss(resource.RUSAGE_CHILDREN)}
+
+    def write(self, fp):
+        """Write the summary as JSON to the path fp"""
+        with open(fp, 'w') as fh:
+            json.dump(self.summary(), fh, indent=1, sort_keys=True)
+            fh.write('\n')
+
+
+@contextmanager
+def _untimed():
+    yield {}
+
+
+def timed(stats, name, tree=None, **info):
+    """Returns stats.stage(name, tree, **info), or a no-op if stats is None"""
+    if stats is None:
+        return _untimed()
+    return stats.stage(name, tree=tree, **info)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+"""Decorate the subtrees of a tree in worker processes
+
+Once the totals of the names over the tree are known, the frequencies,
+RankSafe, picked names and scores of a node depend only on the tips below it.
+The tree is cut into subtrees of about the same number of tips, which are
+decorated in forked workers sharing the tree, and the results are set back
+onto the nodes. The few nodes over the subtrees, the spine, are decorated in
+the main process from the name counts of the subtrees below them, without
+counting their tips again. Folding the names, which compares the nodes of the
+whole tree, is left to nl.fold_rank_names.
+"""
+
+from multiprocessing import Pool
+
+import t2t.nlevel as nl
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+# the number of subtrees cut per worker, so that the workers stay busy when
+# the subtrees differ in cost
+SUBTREES_PER_JOB = 4
+
+
+def cut_tree(nodes, max_tips):
+    """Cut a tree into subtrees of at most max_tips tips
+
+    Parameters
+    ----------
+    nodes : list of TreeNode
+        The nodes of the tree in preorder, with TipStart and TipStop set as
+        nl.load_tree sets them
+    max_tips : int
+
+    Returns
+    -------
+    list of tuple
+        The (start, stop) slice of nodes of each subtree, in preorder. The
+        subtrees are the largest internal nodes of at most max_tips tips.
+    list of int
+        The indices of the internal nodes that are over the subtrees, in
+        preorder
+    """
+    # a subtree spans the nodes up to its last tip
+    tip_indices = [idx for idx, node in enumerate(nodes)
+                   if not node.children]
+
+    subtrees = []
+    spine = []
+    idx = 0
+    while idx < len(nodes):
+        node = nodes[idx]
+        if not node.children:
+            idx += 1
+        elif node.TipStop - node.TipStart < max_tips:
+            stop = tip_indices[node.TipStop] + 1
+            subtrees.append((idx, stop))
+            idx = stop
+        else:
+            spine.append(idx)
+            idx += 1
+    return subtrees, spine
+
+
+def batch_subtrees(nodes, subtrees, min_tips):
+    """Group consecutive subtrees into batches of at least min_tips tips
+
+    The last batch may have fewer.
+    """
+    batches = []
+    batch = []
+    n_tips = 0
+    for start, stop in subtrees:
+        node = nodes[start]
+        batch.append((start, stop))
+        n_tips += node.TipStop - node.TipStart + 1
+        if n_tips >= min_tips:
+            batches.append(batch)
+            batch = []
+            n_tips = 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _tip_counts(tip):
+    return {rank: {name: 1} for rank, name in enumerate(tip.Consensus)
+            if name is not None}
+
+
+def _merge_counts(node, counts_of, n_ranks):
+    """The counts of node from those of its children
+
+    counts_of maps the internal children to their counts, which are removed
+    """
+    counts = {i: {} for i in range(n_ranks)}
+    for child in node.children:
+        if child.children:
+            child_counts = counts_of.pop(child)
+        else:
+            child_counts = _tip_counts(child)
+        for rank, names in child_counts.iteritems():
+            rank_counts = counts[rank]
+            for name, count in names.iteritems():
+                rank_counts[name] = rank_counts.get(name, 0) + count
+    return counts
+
+
+def decorate_node(counts, num_tips, total_counts, min_count, n_ranks,
+                  min_relfreq=0.0):
+    """Returns the decoration of an internal node
+
+    Parameters
+    ----------
+    counts : dict of dict
+        [rank][name] -> the number of tips of the node with the name
+    num_tips : int
+        The NumTips of the node
+    total_counts, min_count, min_relfreq
+        See nl.decorate_name_relative_freqs
+    n_ranks : int
+
+    Returns
+    -------
+    tuple
+        The ConsensusRelFreq, ValidRelFreq, RankSafe, RankNames and
+        RankNameScores of the node, prior to folding the names
+    """
+    relfreq, valid = nl.node_relative_freqs(counts, num_tips, total_counts,
+                                            min_count, min_relfreq)
+    ranksafe = nl.node_ranksafe(relfreq, n_ranks)
+    names = nl.node_rank_names(ranksafe, relfreq, n_ranks)
+    scores = nl.node_rank_name_scores(names, valid, relfreq)
+    return relfreq, valid, ranksafe, names, scores
+
+
+def decorate_subtree(nodes, start, stop, total_counts, min_count, n_ranks,
+                     min_relfreq=0.0):
+    """Decorate the subtree nodes[start:stop]
+
+    Returns
+    -------
+    list of tuple or None
+        The decorate_node of each node of the subtree, in preorder, None for
+        the tips
+    dict of dict
+        The counts of the names of the subtree
+    """
+    decorations = [None] * (stop - start)
+    counts_of = {}
+
+    # the children of a node follow it in preorder
+    for idx in xrange(stop - 1, start - 1, -1):
+        node = nodes[idx]
+        if not node.children:
+            continue
+
+        counts = _merge_counts(node, counts_of, n_ranks)
+        counts_of[node] = counts
+        decorations[idx - start] = decorate_node(counts, node.NumTips,
+                                                 total_counts, min_count,
+                                                 n_ranks, min_relfreq)
+
+    return decorations, counts_of[nodes[start]]
+
+
+# the tree of a worker and what it is decorated with, set by _init_worker
+_TREE = None
+
+
+def _init_worker(nodes, total_counts, min_count, n_ranks, min_relfreq):
+    global _TREE
+    _TREE = (nodes, total_counts, min_count, n_ranks, min_relfreq)
+
+
+def _decorate_batch_in_worker(batch):
+    nodes, total_counts, min_count, n_ranks, min_relfreq = _TREE
+    return [(start,) + decorate_subtree(nodes, start, stop, total_counts,
+                                        min_count, n_ranks, min_relfreq)
+            for start, stop in batch]
+
+
+def _set_decoration(node, decoration):
+    (node.ConsensusRelFreq, node.ValidRelFreq, node.RankSafe, node.RankNames,
+     node.RankNameScores) = decoration
+
+
+def decorate_subtrees(tree, total_counts, min_count, jobs, context=None,
+                      min_relfreq=0.0):
+    """Decorate the internal nodes of tree, in jobs processes
+
+    Sets what nl.decorate_name_relative_freqs, nl.set_ranksafe,
+    nl.pick_names and the scoring of nl.name_node_score_fold set, with the
+    same values. The names are not folded, see nl.fold_rank_names.
+
+    Parameters
+    ----------
+    tree : TreeNode
+        As left by nl.decorate_ntips
+    total_counts : dict of dict
+        The return data from nl.collect_names_at_ranks_counts
+    min_count : int
+    jobs : int
+        The number of worker processes
+    context : TaxonomyContext, optional
+    min_relfreq : float
+        See nl.decorate_name_relative_freqs
+    """
+    n_ranks = nl.get_context(context).n_ranks
+    nodes = list(tree.preorder(include_self=True))
+    n_tips = tree.TipStop - tree.TipStart + 1
+    max_tips = max(1, n_tips // (jobs * SUBTREES_PER_JOB))
+
+    subtrees, spine = cut_tree(nodes, max_tips)
+    batches = batch_subtrees(nodes, subtrees, max_tips)
+
+    for node in nodes:
+        if not node.children:
+            node.ConsensusRelFreq = None
+            node.ValidRelFreq = None
+            node.RankSafe = 0
+
+    # forked workers share the tree rather than receive a copy of it
+    counts_of = {}
+    if batches:
+        pool = Pool(min(jobs, len(batches)), _init_worker,
+                    (nodes, total_counts, min_count, n_ranks, min_relfreq))
+        try:
+            for results in pool.imap_unordered(_decorate_batch_in_worker,
+                                               batches):
+                for start, decorations, counts in results:
+                    for node, decoration in zip(nodes[start:], decorations):
+                        if decoration is not None:
+                            _set_decoration(node, decoration)
+                    counts_of[nodes[start]] = counts
+        finally:
+            pool.close()
+            pool.join()
+
+    # the spine, from the counts of the subtrees below it
+    for idx in reversed(spine):
+        node = nodes[idx]
+        counts = _merge_counts(node, counts_of, n_ranks)
+        counts_of[node] = counts
+        _set_decoration(node, decorate_node(counts, node.NumTips,
+                                            total_counts, min_count, n_ranks,
+                                            min_relfreq))
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+
+"""Compare decorations under several scoring settings in one run
+
+name_node_score_fold keeps a name on the node with the best score under a
+single metric. The score sweep gathers the precision and recall of every
+candidate name once, then scores and folds them for several F-beta metrics
+at the same time, reporting the score_tree of each.
+
+The min_count sweep counts the names of each node once, and derives the
+frequencies, picked names and scores of several min_count values from those
+counts.
+"""
+
+from multiprocessing import Pool
+
+from numpy import array, asarray, cumsum, lexsort, unique, zeros
+
+import t2t.nlevel as nl
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+# F1, F0.5 and F2, the metrics of t2t.nlevel
+DEFAULT_BETAS = (1.0, 0.5, 2.0)
+
+
+def fbeta(precision, recall, beta):
+    """Returns the F-beta score of precision and recall
+
+    Computed as nl.fmeasure, nl.fpoint5measure and nl.f2measure are, so that
+    a beta of 1, 0.5 or 2 gives the same scores as those. precision and recall
+    may be arrays.
+    """
+    betasqrd = asarray(beta, dtype=float) ** 2
+    return (1 + betasqrd) * ((precision * recall) /
+                             ((betasqrd * precision) + recall))
+
+
+def metric_label(beta):
+    """Returns the name of an F-beta metric, e.g., F0.5"""
+    return 'F%g' % beta
+
+
+def collect_candidates(tree, context=None):
+    """Gather the names picked for the internal nodes, prior to the fold
+
+    Expects the tree as left by nl.pick_names
+
+    Parameters
+    ----------
+    tree : TreeNode
+    context : TaxonomyContext, optional
+
+    Returns
+    -------
+    dict
+        One entry per candidate (node, rank, name), in the order
+        name_node_score_fold visits them. 'nodes' are the nodes, and 'rank',
+        'group', 'precision', 'recall', 'num_tips', 'size' and 'order' are
+        arrays of their rank, the index of their (rank, name), their
+        ValidRelFreq and ConsensusRelFreq, their NumTips, their total number
+        of tips and the postorder index of their node.
+    """
+    n_ranks = nl.get_context(context).n_ranks
+    nodes = []
+    rows = []
+
+    for idx, node in enumerate(tree.non_tips(include_self=True)):
+        for rank in range(n_ranks):
+            name = node.RankNames[rank]
+            if name is None:
+                continue
+
+            nodes.append(node)
+            rows.append((idx, rank, name, node.ValidRelFreq[rank][name],
+                         node.ConsensusRelFreq[rank][name], node.NumTips,
+                         node.TipStop - node.TipStart + 1))
+
+    candidates = _candidate_arrays(rows)
+    candidates['nodes'] = nodes
+    return candidates
+
+
+def _candidate_arrays(rows):
+    """Returns the candidates of collect_candidates, without 'nodes'
+
+    rows are the (order, rank, name, precision, recall, num_tips, size) of
+    each candidate
+    """
+    group_ids = {}
+    groups = []
+    for row in rows:
+        key = row[1:3]
+        if key not in group_ids:
+            group_ids[key] = len(group_ids)
+        groups.append(group_ids[key])
+
+    columns = zip(*rows) or [()] * 7
+    order, ranks, _, precision, recall, num_tips, size = columns
+    return {'rank': array(ranks, dtype=int),
+            'group': array(groups, dtype=int),
+            'precision': array(precision, dtype=float),
+            'recall': array(recall, dtype=float),
+            'num_tips': array(num_tips, dtype=int),
+            'size': array(size, dtype=int),
+            'order': array(order, dtype=int)}
+
+
+def fold_candidates(candidates, scores):
+    """Returns which candidates keep their name under scores
+
+    Each (rank, name) is kept by its best scoring candidate. Ties go to the
+    candidate with the fewest tips and then to the last in postorder, as
+    name_node_score_fold does with nl.min_tips.
+
+    Parameters
+    ----------
+    candidates : dict
+        As returned by collect_candidates
+    scores : np.array of float
+        The score of each candidate
+
+    Returns
+    -------
+    np.array of bool
+    """
+    group = candidates['group']
+    keep = zeros(len(group), dtype=bool)
+    if not len(group):
+        return keep
+
+    best = lexsort((-candidates['order'], candidates['size'], -scores,
+                    group))
+    _, first = unique(group[best], return_index=True)
+    keep[best[first]] = True
+    return keep
+
+
+def score_sweep(tree, betas=DEFAULT_BETAS, context=None):
+    """Fold and score the names of a tree under several F-beta metrics
+
+    The tree is not changed, run name_node_score_fold to decorate it.
+
+    Parameters
+    ----------
+    tree : TreeNode
+        As left by nl.pick_names
+    betas : iterable of float
+        The betas of the metrics to compare
+    context : TaxonomyContext, optional
+
+    Returns
+    -------
+    list of dict
+        One per beta, in order, with the 'beta', the 'metric' label, the
+        'score' score_tree would give the tree folded under it and the number
+        of 'names' the tree keeps.
+    """
+    return _sweep_candidates(collect_candidates(tree, context), betas)
+
+
+def _sweep_candidates(candidates, betas):
+    """Fold and score candidates under the metric of each beta"""
+    betas = [float(b) for b in betas]
+    precision = candidates['precision']
+    recall = candidates['recall']
+    num_tips = candidates['num_tips']
+
+    # one row of scores per metric
+    scores = fbeta(precision, recall, asarray(betas)[:, None])
+
+    results = []
+    for beta, row in zip(betas, scores):
+        keep = fold_candidates(candidates, row)
+
+        # summed in order, as score_tree does
+        kept_tips = num_tips[keep]
+        score = None
+        if kept_tips.sum():
+            score = cumsum(row[keep] * kept_tips)[-1] / kept_tips.sum()
+
+        results.append({'beta': beta,
+                        'metric': metric_label(beta),
+                        'score': score,
+                        'names': int(keep.sum())})
+    return results
+
+
+def count_names(tree, context=None):
+    """Count the names of the tips of each internal node, in one pass
+
+    Expects the tree as left by nl.load_tree, and does not change it
+
+    Parameters
+    ----------
+    tree : TreeNode
+    context : TaxonomyContext, optional
+
+    Returns
+    -------
+    list of tuple
+        The [rank][name] counts, number of informative tips and total number
+        of tips of each internal node, in postorder
+    dict of dict
+        [rank][name] -> the count of the name over the tree, as
+        nl.collect_names_at_ranks_counts
+    """
+    n_ranks = nl.get_context(context).n_ranks
+    missing = [None] * n_ranks
+    node_counts = []
+    stats = {}
+
+    for node in tree.postorder(include_self=True):
+        if node.is_tip():
+            counts = {rank: {name: 1}
+                      for rank, name in enumerate(node.Consensus)
+                      if name is not None}
+            stats[node] = (counts, int(node.Consensus != missing), 1)
+            continue
+
+        counts = {i: {} for i in range(n_ranks)}
+        num_tips = 0
+        size = 0
+        for child in node.children:
+            child_counts, child_tips, child_size = stats.pop(child)
+            num_tips += child_tips
+            size += child_size
+            for rank, names in child_counts.iteritems():
+                rank_counts = counts[rank]
+                for name, count in names.iteritems():
+                    rank_counts[name] = rank_counts.get(name, 0) + count
+
+        stats[node] = (counts, num_tips, size)
+        node_counts.append(stats[node])
+
+    totals = {i: {} for i in range(n_ranks)}
+    if node_counts:
+        totals.update(node_counts[-1][0])
+    else:
+        # a tree of a single tip
+        totals.update(stats[tree][0])
+    return node_counts, totals
+
+
+def _min_count_candidates(node_counts, totals, min_count, n_ranks):
+    """The candidates of collect_candidates under min_count"""
+    rows = []
+    for idx, (counts, num_tips, size) in enumerate(node_counts):
+        relfreq, valid = nl.node_relative_freqs(counts, num_tips, totals,
+                                                min_count)
+        ranksafe = nl.node_ranksafe(relfreq, n_ranks)
+        names = nl.node_rank_names(ranksafe, relfreq, n_ranks)
+        for rank, name in enumerate(names):
+            if name is not None:
+                rows.append((idx, rank, name, valid[rank][name],
+                             relfreq[rank][name], num_tips, size))
+    return _candidate_arrays(rows)
+
+
+def _sweep_min_count(node_counts, totals, min_count, betas, n_ranks):
+    results = _sweep_candidates(
+        _min_count_candidates(node_counts, totals, min_count, n_ranks),
+        betas)
+    for res in results:
+        res['min_count'] = min_count
+    return results
+
+
+# the counts of a worker, set by _init_worker
+_COUNTS = None
+
+
+def _init_worker(node_counts, totals, n_ranks):
+    global _COUNTS
+    _COUNTS = (node_counts, totals, n_ranks)
+
+
+def _sweep_min_count_in_worker(args):
+    node_counts, totals, n_ranks = _COUNTS
+    min_count, betas = args
+    return _sweep_min_count(node_counts, totals, min_count, betas, n_ranks)
+
+
+def min_count_sweep(tree, min_counts, betas=(1.0,), jobs=1, context=None):
+    """Fold and score the names of a tree under several min_count values
+
+    The names of each node are counted once. For each min_count, the counts
+    are thresholded into frequencies, and the RankSafe, picked names and
+    fold follow as in the pipeline, without changing the tree.
+
+    Parameters
+    ----------
+    tree : TreeNode
+        As left by nl.load_tree
+    min_counts : iterable of int
+        See nl.decorate_name_relative_freqs
+    betas : iterable of float
+        The betas of the metrics to score each min_count with
+    jobs : int
+        The number of processes to sweep the min_count values in
+    context : TaxonomyContext, optional
+
+    Returns
+    -------
+    list of dict
+        The results of score_sweep for each min_count, in order, with the
+        'min_count' added.
+    """
+    n_ranks = nl.get_context(context).n_ranks
+    node_counts, totals = count_names(tree, context)
+    betas = [float(b) for b in betas]
+    args = [(min_count, betas) for min_count in min_counts]
+
+    if jobs == 1 or len(args) <= 1:
+        swept = [_sweep_min_count(node_counts, totals, min_count, betas,
+                                  n_ranks) for min_count, _ in args]
+    else:
+        # forked workers share the counts rather than receive a copy of them
+        # per min_count
+        pool = Pool(min(jobs, len(args)), _init_worker,
+                    (node_counts, totals, n_ranks))
+        try:
+            swept = pool.map(_sweep_min_count_in_worker, args, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    return [res for results in swept for res in results]
+
+
+def format_score_sweep(results):
+    """Returns the results of score_sweep as tab delimited lines
+
+    The results of min_count_sweep have a leading min_count column.
+    """
+    columns = ['metric', 'beta', 'score', 'names']
+    with_min_count = bool(results) and 'min_count' in results[0]
+    if with_min_count:
+        columns.insert(0, 'min_count')
+
+    lines = ['\t'.join(columns)]
+    for res in results:
+        score = 'NA' if res['score'] is None else repr(float(res['score']))
+        row = [res['metric'], '%g' % res['beta'], score, str(res['names'])]
+        if with_min_count:
+            row.insert(0, str(res['min_count']))
+        lines.append('\t'.join(row))
+    return lines
@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+
+"""Binary cache of parsed trees
+
+Parsing a large newick file dominates the runtime of the smaller t2t
+commands. The methods here flatten a parsed tree into a handful of numpy
+arrays, in preorder, which are stored as .npy files in a cache directory keyed
+by the content hash of the newick file. Later runs memory map the arrays
+instead of parsing the text again.
+
+newick_to_arrays parses a newick into the arrays directly, reading it in
+blocks and without recursion, so that trees hundreds of thousands of nodes
+deep are read as any other. A BackgroundTreeLoader parses in another process,
+and the arrays are cheap to send back as they are a few numpy arrays.
+"""
+
+import gc
+import os
+import hashlib
+from contextlib import contextmanager
+from multiprocessing import Pool
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from numpy import (array, cumsum, empty, frombuffer, isnan, load, nan, save,
+                   uint8, zeros)
+from skbio import TreeNode
+
+from t2t.compression import open_input
+from t2t.newick import CHUNK_SIZE, read_tokens
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+# bump if the layout of the arrays changes so stale caches are not reused
+CACHE_VERSION = 1
+ARRAY_NAMES = ('parent', 'length', 'named', 'name_offsets', 'name_data',
+               'tip_start', 'tip_stop')
+
+
+def file_digest(path, blocksize=2 ** 20):
+    """Returns the hex SHA1 digest of the contents of path"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        block = fh.read(blocksize)
+        while block:
+            digest.update(block)
+            block = fh.read(blocksize)
+    return digest.hexdigest()
+
+
+def tree_to_arrays(tree):
+    """Flatten a tree into arrays
+
+    Nodes are stored in preorder, so a node's parent always has a smaller
+    index than the node and children are in the order they are encountered.
+
+    Parameters
+    ----------
+    tree : TreeNode
+
+    Returns
+    -------
+    dict of ndarray
+        parent : index of the parent of each node, -1 for the root
+        length : branch length of each node, nan if not set
+        named : whether the node has a name
+        name_offsets : the names of node i are at
+            name_data[name_offsets[i]:name_offsets[i + 1]]
+        name_data : the utf-8 encoded names, concatenated
+        tip_start : the left most tip index descending from each node
+        tip_stop : the right most tip index descending from each node
+
+    """
+    nodes = list(tree.preorder(include_self=True))
+    n_nodes = len(nodes)
+    index = {id(node): idx for idx, node in enumerate(nodes)}
+
+    parent = empty(n_nodes, dtype=int)
+    length = empty(n_nodes, dtype=float)
+    named = zeros(n_nodes, dtype=bool)
+    name_lengths = zeros(n_nodes + 1, dtype=int)
+    tip_start = empty(n_nodes, dtype=int)
+    tip_stop = empty(n_nodes, dtype=int)
+
+    encoded = []
+    n_tips = 0
+    for idx, node in enumerate(nodes):
+        parent[idx] = index[id(node.parent)] if idx else -1
+        length[idx] = nan if node.length is None else node.length
+
+        if node.name is not None:
+            name = node.name
+            if isinstance(name, unicode):
+                name = name.encode('utf-8')
+            named[idx] = True
+            name_lengths[idx + 1] = len(name)
+            encoded.append(name)
+
+        if node.children:
+            tip_stop[idx] = -1
+        else:
+            tip_start[idx] = n_tips
+            tip_stop[idx] = n_tips
+            n_tips += 1
+
+    # walking backwards, the first child of a node is the last one seen
+    for idx in range(n_nodes - 1, 0, -1):
+        p = parent[idx]
+        tip_start[p] = tip_start[idx]
+        if tip_stop[idx] > tip_stop[p]:
+            tip_stop[p] = tip_stop[idx]
+
+    return {'parent': parent,
+            'length': length,
+            'named': named,
+            'name_offsets': cumsum(name_lengths),
+            'name_data': frombuffer(''.join(encoded), dtype=uint8).copy(),
+            'tip_start': tip_start,
+            'tip_stop': tip_stop}
+
+
+def newick_to_arrays(fh, block_size=CHUNK_SIZE):
+    """Parse the newick in fh into the arrays of tree_to_arrays
+
+    A node is numbered when it starts, at its ( or its first label, which
+    is its preorder index, and its tips are counted as they are read, so
+    the arrays need no further pass over the tree. Names are read as
+    load_tree reads them, without converting underscores.
+
+    Parameters
+    ----------
+    fh : file
+    block_size : int
+        The number of characters read at a time
+
+    Returns
+    -------
+    dict of ndarray
+        As tree_to_arrays
+
+    Raises
+    ------
+    ValueError
+        If the newick cannot be parsed
+    """
+    parent = []
+    length = []
+    names = []
+    tip_start = []
+    tip_stop = []
+
+    open_clades = []
+    n_tips = 0
+    current = -1
+    is_length = False
+
+    for token in read_tokens(fh, block_size=block_size):
+        if current < 0 and token != '(':
+            # the start of a tip, or of a node without a label
+            current = len(parent)
+            parent.append(open_clades[-1] if open_clades else -1)
+            length.append(nan)
+            names.append(None)
+            tip_start.append(n_tips)
+            tip_stop.append(-1)
+
+        if token in ',);':
+            if token == ';' and open_clades or token != ';' and \
+                    not open_clades:
+                raise ValueError("Could not parse newick: the " +
+                                 "parentheses are unbalanced")
+            if tip_stop[current] < 0:
+                tip_stop[current] = n_tips
+                n_tips += 1
+
+            is_length = False
+            if token == ',':
+                current = -1
+            elif token == ')':
+                current = open_clades.pop()
+                tip_stop[current] = n_tips - 1
+            else:
+                break
+        elif token == '(':
+            if current >= 0:
+                raise ValueError("Could not parse newick: a clade opens " +
+                                 "after a label")
+            open_clades.append(len(parent))
+            parent.append(open_clades[-2] if len(open_clades) > 1 else -1)
+            length.append(nan)
+            names.append(None)
+            tip_start.append(n_tips)
+            tip_stop.append(-1)
+        elif token == ':':
+            is_length = True
+        elif is_length:
+            try:
+                length[current] = float(token)
+            except ValueError:
+                raise ValueError("Could not read length as numeric type: " +
+                                 token)
+            is_length = False
+        else:
+            names[current] = token or None
+    else:
+        raise ValueError("Could not parse newick: the tree does not end " +
+                         "with ;")
+
+    name_lengths = zeros(len(names) + 1, dtype=int)
+    encoded = []
+    for idx, name in enumerate(names):
+        if name is not None:
+            if isinstance(name, unicode):
+                name = name.encode('utf-8')
+            name_lengths[idx + 1] = len(name)
+            encoded.append(name)
+
+    return {'parent': array(parent, dtype=int),
+            'length': array(length, dtype=float),
+            'named': array([n is not None for n in names], dtype=bool),
+            'name_offsets': cumsum(name_lengths),
+            'name_data': frombuffer(''.join(encoded), dtype=uint8).copy(),
+            'tip_start': array(tip_start, dtype=int),
+            'tip_stop': array(tip_stop, dtype=int)}
+
+
+@contextmanager
+def _gc_paused():
+    """Pause the cyclic garbage collector
+
+    Building a tree allocates a few objects per node, each of which counts
+    towards a collection that finds nothing to free.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def arrays_to_tree(arrays, bootstrap=False, internal_attrs=None):
+    """Build a tree from the arrays of tree_to_arrays
+
+    TipStart and TipStop are set on every node.
+
+    Parameters
+    ----------
+    arrays : dict of ndarray
+        As returned by tree_to_arrays or load_tree_arrays
+    bootstrap : bool
+        Set the Bootstrap of the internal nodes, moving a numeric name to
+        it as load_tree does
+    internal_attrs : dict, optional
+        Attributes set on each internal node, e.g., {'Consensus': value}
+
+    Returns
+    -------
+    TreeNode
+
+    """
+    parent = arrays['parent'].tolist()
+    named = arrays['named'].tolist()
+    offsets = arrays['name_offsets'].tolist()
+    lengths = arrays['length']
+    missing_length = isnan(lengths).tolist()
+    lengths = lengths.tolist()
+    tip_start = arrays['tip_start'].tolist()
+    tip_stop = arrays['tip_stop'].tolist()
+    name_data = arrays['name_data'].tobytes()
+
+    internal = zeros(len(parent), dtype=bool)
+    internal[arrays['parent'][1:]] = True
+    internal = internal.tolist()
+    internal_attrs = (internal_attrs or {}).items()
+
+    nodes = []
+    with _gc_paused():
+        for idx, p in enumerate(parent):
+            node = TreeNode()
+            if named[idx]:
+                node.name = name_data[offsets[idx]:offsets[idx + 1]]
+            if not missing_length[idx]:
+                node.length = lengths[idx]
+            node.TipStart = tip_start[idx]
+            node.TipStop = tip_stop[idx]
+
+            if internal[idx]:
+                if bootstrap:
+                    node.Bootstrap = None
+                    if node.name is not None:
+                        try:
+                            node.Bootstrap = float(node.name)
+                            node.name = None
+                        except ValueError:
+                            pass
+                for attr, value in internal_attrs:
+                    setattr(node, attr, value)
+
+            # set references directly, append() invalidates caches on every
+            # call
+            if p >= 0:
+                node.parent = nodes[p]
+                nodes[p].children.append(node)
+            nodes.append(node)
+
+    return nodes[0]
+
+
+def save_tree_arrays(arrays, path):
+    """Store the arrays as .npy files in the directory path
+
+    The arrays are written to a temporary directory first which is then
+    renamed, so a partially written cache is never picked up.
+    """
+    parent_dir = os.path.dirname(os.path.abspath(path))
+    tmp_dir = mkdtemp(dir=parent_dir)
+    try:
+        for name in ARRAY_NAMES:
+            save(os.path.join(tmp_dir, name + '.npy'), arrays[name])
+        os.rename(tmp_dir, path)
+    except OSError:
+        # another process may have won the race to create the cache
+        rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(path):
+            raise
+
+
+def load_tree_arrays(path, mmap=True):
+    """Load the arrays stored by save_tree_arrays
+
+    If mmap is True, the arrays are memory mapped read-only.
+    """
+    arrays = {}
+    for name in ARRAY_NAMES:
+        fp = os.path.join(path, name + '.npy')
+        if mmap:
+            try:
+                arrays[name] = load(fp, mmap_mode='r')
+            except ValueError:
+                # an empty array cannot be mapped
+                arrays[name] = load(fp)
+        else:
+            arrays[name] = load(fp)
+    return arrays
+
+
+def cache_path(cache_dir, digest):
+    """Returns the path of the cache entry for a digest"""
+    return os.path.join(cache_dir, 'tree-v%d-%s' % (CACHE_VERSION, digest))
+
+
+def cached_tree_path(tree_fp, cache_dir):
+    """Returns the cache entry of the newick file tree_fp, parsing if needed
+
+    The newick file is parsed as load_tree does, without converting
+    underscores, and the result is stored in cache_dir for later calls.
+    """
+    path = cache_path(cache_dir, file_digest(tree_fp))
+
+    if not os.path.isdir(path):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open_input(tree_fp) as fh:
+            save_tree_arrays(newick_to_arrays(fh), path)
+
+    return path
+
+
+def load_tree_arrays_cached(tree_fp, cache_dir, mmap=True):
+    """Returns the arrays for the newick file tree_fp, parsing if needed
+
+    See cached_tree_path
+    """
+    return load_tree_arrays(cached_tree_path(tree_fp, cache_dir), mmap=mmap)
+
+
+def load_tree_cached(tree_fp, cache_dir):
+    """Returns a TreeNode for the newick file tree_fp using the cache"""
+    return arrays_to_tree(load_tree_arrays_cached(tree_fp, cache_dir))
+
+
+def _tree_arrays_in_worker(tree_fp, cache_dir):
+    """The arrays of tree_fp, or the path of their cache entry"""
+    if cache_dir is not None:
+        return cached_tree_path(tree_fp, cache_dir)
+    with open_input(tree_fp) as fh:
+        return newick_to_arrays(fh)
+
+
+class BackgroundTreeLoader(object):
+    """Parses a newick file into its arrays in another process
+
+    The process starts with the loader, so the tree is parsed while the
+    caller does other work, such as loading the consensus map, until get is
+    called.
+
+    Parameters
+    ----------
+    tree_fp : str
+        The path of the newick file
+    cache_dir : str, optional
+        A directory of tree caches. The worker parses the tree into the cache
+        if needed, and the arrays are then memory mapped from it rather than
+        sent back.
+    """
+    def __init__(self, tree_fp, cache_dir=None):
+        self._pool = Pool(1)
+        self._result = self._pool.apply_async(_tree_arrays_in_worker,
+                                              (tree_fp, cache_dir))
+
+    def get(self):
+        """Waits for the arrays, see tree_to_arrays
+
+        Raises
+        ------
+        ValueError
+            If the newick cannot be parsed
+        """
+        try:
+            arrays = self._result.get()
+        finally:
+            self._pool.close()
+            self._pool.join()
+
+        if not isinstance(arrays, dict):
+            arrays = load_tree_arrays(arrays)
+        return arrays
+
+    def close(self):
+        """Stops the worker if it is still parsing
+
+        An error that stops the caller before get must close the loader, as
+        a pool still at work when the interpreter exits keeps it from
+        exiting.
+        """
+        self._pool.terminate()
+        self._pool.join()
@@ -1,7 +1,5 @@
 #!/usr/bin/env python
 
-from skbio import parse_fasta
-
 __author__ = "Daniel McDonald"
 __copyright__ = "Copyright 2011, The tax2tree project"
 __credits__ = ["Daniel McDonald"]
@@ -14,6 +12,8 @@ __status__ = "Development"
 
 def combine_alignments(fp1, fp2):
     """take two filepointers, combine the files"""
+    from skbio import parse_fasta
+
     seqs1 = dict(parse_fasta(fp1))
     seqs2 = dict(parse_fasta(fp2))
 
@@ -80,3 +80,19 @@ def unzip(items):
         return [list(i) for i in zip(*items)]
     else:
         return []
+
+
+class BoundedDict(dict):
+    """A dict for memoization that is emptied when it reaches maxsize
+
+    Emptying is cheaper than tracking recency and, for the skewed name
+    distributions of a taxonomy, the common keys are quickly cached again.
+    """
+    def __init__(self, maxsize):
+        super(BoundedDict, self).__init__()
+        self.maxsize = maxsize
+
+    def __setitem__(self, key, value):
+        if len(self) >= self.maxsize:
+            self.clear()
+        super(BoundedDict, self).__setitem__(key, value)
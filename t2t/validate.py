@@ -3,7 +3,7 @@
 from collections import defaultdict
 from operator import add
 
-from t2t.nlevel import (determine_rank_order,
+from t2t.nlevel import (TaxonomyContext,
                         make_consensus_tree,
                         load_consensus_map)
 from t2t.util import unzip
@@ -99,9 +99,21 @@ def get_polyphyletic(cons):
     return names
 
 
-def hierarchy_errors(tax_lines):
-    """Get errors in the taxonomy hierarchy"""
-    conmap = load_consensus_map(tax_lines, False)
+def lines_context(tax_lines):
+    """Returns a TaxonomyContext with the ranks of the first line"""
+    seed_con = tax_lines[0].strip().split('\t')[1]
+    return TaxonomyContext.from_consensus(seed_con)
+
+
+def hierarchy_errors(tax_lines, context=None):
+    """Get errors in the taxonomy hierarchy
+
+    If context is None, the ranks are those of the first line
+    """
+    if context is None:
+        context = lines_context(tax_lines)
+
+    conmap = load_consensus_map(tax_lines, False, context=context)
     names = get_polyphyletic(conmap)
     errors = []
 
@@ -113,14 +125,18 @@ def hierarchy_errors(tax_lines):
     return errors
 
 
-def flat_errors(tax_lines):
-    """Flat file errors"""
+def flat_errors(tax_lines, context=None):
+    """Flat file errors
+
+    If context is None, the ranks are those of the first line
+    """
     inc_prefix = 'Incorrect prefixes'
     inc_nlevel = 'Incorrect number of levels'
     inc_gap = 'Gaps in taxonomy'
 
-    seed_con = tax_lines[0].strip().split('\t')[1]
-    rank_order = determine_rank_order(seed_con)
+    if context is None:
+        context = lines_context(tax_lines)
+    rank_order = context.rank_order
 
     nlevels = len(rank_order)
     errors = defaultdict(list)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, main
+
+from skbio import TreeNode
+from StringIO import StringIO
+
+import t2t.nlevel as nl
+from t2t.benchmark import (make_tree, make_consensus_map, make_otu_map,
+                           run_benchmark, run_startup, write_results,
+                           read_results, compare_results, SHAPES)
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+class BenchmarkTests(TestCase):
+
+    def tearDown(self):
+        nl.set_rank_order(['d', 'p', 'c', 'o', 'f', 'g', 's'])
+
+    def test_make_tree(self):
+        """makes trees of each shape with the requested tips"""
+        for shape in SHAPES:
+            newick = make_tree(50, shape, seed=3)
+            tree = TreeNode.read(StringIO(unicode(newick)))
+            obs = sorted(n.name for n in tree.tips())
+            exp = sorted('T%d' % i for i in range(50))
+            self.assertEqual(obs, exp)
+            self.assertEqual(make_tree(50, shape, seed=3), newick)
+
+        tree = TreeNode.read(StringIO(unicode(make_tree(5, 'caterpillar'))))
+        self.assertEqual(max(len(list(t.ancestors())) for t in tree.tips()),
+                         4)
+
+    def test_make_tree_errors(self):
+        """refuses unknown shapes and tiny trees"""
+        self.assertRaises(ValueError, make_tree, 10, 'foo')
+        self.assertRaises(ValueError, make_tree, 1)
+
+    def test_make_consensus_map(self):
+        """makes 7 rank lineages that follow the tips"""
+        lines = make_consensus_map(30, missing=0.0)
+        self.assertEqual(len(lines), 30)
+        self.assertEqual(lines[0], "T0\td__D0; p__P0; c__C0; o__O0; f__F0; "
+                                   "g__G0; s__S0")
+        self.assertEqual(lines[29], "T29\td__D0; p__P0; c__C0; o__O0; "
+                                    "f__F0; g__G0; s__S2")
+
+        noisy = make_consensus_map(1000, seed=1, noise=0.5)
+        self.assertEqual(noisy, make_consensus_map(1000, seed=1, noise=0.5))
+        self.assertNotEqual(noisy, make_consensus_map(1000, seed=1))
+
+    def test_make_otu_map(self):
+        """clusters neighboring tips"""
+        self.assertEqual(make_otu_map(5, size=2),
+                         ["0\tT0\tT1", "1\tT2\tT3", "2\tT4"])
+
+    def test_run_benchmark(self):
+        """times the library entry points"""
+        records = run_benchmark(40, 'polytomous', noise=0.1, polyphyly=0.1,
+                                entry_points=('decorate', 'consistency',
+                                              'validate', 'remap'))
+        entries = set(r['entry'] for r in records)
+        self.assertEqual(entries, set(['decorate', 'consistency', 'validate',
+                                       'remap']))
+        for r in records:
+            self.assertEqual(r['n_tips'], 40)
+            self.assertTrue(r['wall_time'] >= 0)
+
+    def test_run_benchmark_startup(self):
+        """times short invocations of the script"""
+        records = run_startup(n_lines=40)
+        self.assertEqual([r['stage'] for r in records],
+                         ['version', 'validate', 'validate_flat', 'remap'])
+        self.assertEqual(set((r['n_tips'], r['shape']) for r in records),
+                         set([(40, None)]))
+        self.assertRaises(ValueError, run_benchmark, 40,
+                          entry_points=('startup',))
+
+    def test_results_roundtrip(self):
+        """compares written results"""
+        records = run_benchmark(20, entry_points=('validate',))
+        fh = StringIO()
+        write_results(records, fh)
+        fh.seek(0)
+        obs = read_results(fh)
+        self.assertEqual(obs, records)
+
+        rows = compare_results(obs, records)
+        self.assertEqual([r[1] for r in rows],
+                         ['flat_errors', 'hierarchy_errors'])
+        self.assertEqual(rows[0][:4], ('validate', 'flat_errors', 'balanced',
+                                       20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, main
+
+from t2t.cli import parse_manifest, batch_labels
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+class CliTests(TestCase):
+
+    def test_batch_labels(self):
+        """labels consensus maps by their file name"""
+        obs = batch_labels(['a/gtdb.txt', 'silva'])
+        self.assertEqual(obs, [('gtdb', 'a/gtdb.txt'), ('silva', 'silva')])
+
+        obs = batch_labels(['a/gtdb.txt.gz', 'b/silva.bz2'])
+        self.assertEqual(obs, [('gtdb', 'a/gtdb.txt.gz'),
+                               ('silva', 'b/silva.bz2')])
+
+        obs = batch_labels(['a/gtdb.txt', 'b/gtdb.txt'], [None, 'other'])
+        self.assertEqual(obs, [('gtdb', 'a/gtdb.txt'),
+                               ('other', 'b/gtdb.txt')])
+
+        self.assertRaises(ValueError, batch_labels,
+                          ['a/gtdb.txt', 'b/gtdb.txt'])
+
+    def test_parse_manifest(self):
+        """parses paths and labels relative to the manifest"""
+        lines = ["# maps", "gtdb.txt", "", "ncbi\tx/ncbi.txt\n"]
+        obs = parse_manifest(lines, 'maps')
+        self.assertEqual(obs, [('gtdb', 'maps/gtdb.txt'),
+                               ('ncbi', 'maps/x/ncbi.txt')])
+
+        self.assertRaises(ValueError, parse_manifest, ["a\tb\tc"])
+        self.assertRaises(ValueError, parse_manifest, ["a\tx", "a\ty"])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+import os
+import bz2
+import gzip
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+import t2t.compression as cz
+from t2t.compression import (sniff_compression, codec_from_path,
+                             strip_compression_ext, open_input, open_output,
+                             is_compressed)
+from t2t.nlevel import load_tree
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+class CompressionTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.data = ''.join('T%d\td__A; p__B%d\n' % (i, i % 3)
+                            for i in range(500))
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def _path(self, name):
+        return os.path.join(self.tmp_dir, name)
+
+    def test_sniff_compression(self):
+        """recognizes codecs by their leading bytes, not the extension"""
+        for opener, codec in ((open, None), (gzip.open, 'gzip'),
+                              (bz2.BZ2File, 'bz2')):
+            fp = self._path('data.txt')
+            fh = opener(fp, 'wb')
+            fh.write(self.data)
+            fh.close()
+            self.assertEqual(sniff_compression(fp), codec)
+
+        fp = self._path('empty.gz')
+        open(fp, 'w').close()
+        self.assertEqual(sniff_compression(fp), None)
+
+    def test_codec_from_path(self):
+        """maps the extensions of codecs"""
+        self.assertEqual(codec_from_path('a/tree.gz'), 'gzip')
+        self.assertEqual(codec_from_path('tree.BZ2'), 'bz2')
+        self.assertEqual(codec_from_path('tree.zst'), 'zstd')
+        self.assertEqual(codec_from_path('tree.txt'), None)
+        self.assertEqual(strip_compression_ext('a/map.txt.gz'), 'a/map.txt')
+        self.assertEqual(strip_compression_ext('a/map.txt'), 'a/map.txt')
+
+    def test_round_trip(self):
+        """reads back what was written, seeking to the start"""
+        for name in ('plain.txt', 'data.gz', 'data.bz2'):
+            fp = self._path(name)
+            with open_output(fp) as fh:
+                fh.write(self.data)
+            self.assertEqual(sniff_compression(fp), codec_from_path(fp))
+
+            fh = open_input(fp)
+            self.assertEqual(is_compressed(fh), name != 'plain.txt')
+            self.assertEqual(fh.name, fp)
+            self.assertEqual(fh.readline(), 'T0\td__A; p__B0\n')
+            fh.seek(0)
+            self.assertEqual(''.join(fh), self.data)
+            fh.close()
+
+        fh = open_input(self._path('data.gz'))
+        self.assertRaises(IOError, fh.seek, 10)
+        fh.close()
+
+    def test_load_tree(self):
+        """parses a compressed newick"""
+        fp = self._path('tree.gz')
+        with open_output(fp) as fh:
+            fh.write("((a,b)c,d)e;\n")
+        tree = load_tree(open_input(fp), {})
+        self.assertEqual([n.name for n in tree.postorder()],
+                         ['a', 'b', 'c', 'd', 'e'])
+
+    def test_zstd_missing(self):
+        """explains how to install zstd support"""
+        if cz.zstandard is not None:
+            return
+        fp = self._path('data.zst')
+        self.assertRaises(IOError, open_output, fp)
+        with open(fp, 'wb') as fh:
+            fh.write('\x28\xb5\x2f\xfd\x00')
+        self.assertRaises(IOError, open_input, fp)
+
+
+if __name__ == '__main__':
+    main()
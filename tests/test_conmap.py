@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+import os
+import gzip
+import sqlite3
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+from skbio import TreeNode
+from StringIO import StringIO
+
+from t2t.nlevel import (load_consensus_map, load_tree, TaxonomyContext,
+                        ConsensusMapError)
+from t2t.conmap import (load_consensus_map_parallel, chunk_offsets,
+                        encode_consensus_map, merge_matrices, ConsensusIndex,
+                        build_index)
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+class ConmapTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.lines = ["T%d\td__D%d; p__P%d; c__C%d" % (i, i % 2, i % 3, i % 5)
+                      for i in range(100)]
+        self.lines[7] = "T7\td__D1; p__uncultured; c__"
+        self.lines[8] = "T3\td__D0; p__; c__C3"
+        self.fp = self._write(self.lines)
+        self.context = TaxonomyContext(['d', 'p', 'c'])
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def _write(self, lines, name='map.txt'):
+        fp = os.path.join(self.tmp_dir, name)
+        with open(fp, 'w') as f:
+            f.write('\n'.join(lines))
+            f.write('\n')
+        return fp
+
+    def test_chunk_offsets(self):
+        """splits a file into ranges that start on a line"""
+        offsets = chunk_offsets(self.fp, 100)
+        self.assertEqual(offsets[0][0], 0)
+        self.assertEqual(offsets[-1][1], os.path.getsize(self.fp))
+        data = open(self.fp).read()
+        for (start, stop), (next_start, _) in zip(offsets, offsets[1:]):
+            self.assertEqual(stop, next_start)
+            self.assertEqual(data[stop - 1], '\n')
+
+        empty = os.path.join(self.tmp_dir, 'empty.txt')
+        open(empty, 'w').close()
+        self.assertEqual(chunk_offsets(empty), [])
+
+    def test_load_consensus_map_parallel(self):
+        """matches the serial loader, including for repeated ids"""
+        exp = load_consensus_map(self.lines, False, context=self.context)
+        for jobs in (1, 3):
+            obs = load_consensus_map_parallel(self.fp, False,
+                                              context=self.context,
+                                              jobs=jobs, chunk_size=200)
+            self.assertEqual(obs, exp)
+        self.assertEqual(obs['T3'], [None, None, None])
+
+        exp = load_consensus_map(self.lines, True, check_bad=False,
+                                 context=self.context)
+        obs = load_consensus_map_parallel(self.fp, True, check_bad=False,
+                                          context=self.context, jobs=2,
+                                          chunk_size=200)
+        self.assertEqual(obs, exp)
+
+    def test_load_consensus_map_parallel_gzip(self):
+        """loads a gzipped map serially"""
+        fp = os.path.join(self.tmp_dir, 'map.txt.gz')
+        with gzip.open(fp, 'wb') as f:
+            f.write('\n'.join(self.lines))
+        exp = load_consensus_map(self.lines, False, context=self.context)
+        obs = load_consensus_map_parallel(fp, False, context=self.context,
+                                          jobs=3, chunk_size=200)
+        self.assertEqual(obs, exp)
+
+    def test_load_consensus_map_parallel_encoded(self):
+        """returns a matrix of name codes"""
+        obs = load_consensus_map_parallel(self.fp, False,
+                                          context=self.context, jobs=2,
+                                          chunk_size=200, encoded=True)
+        self.assertEqual(len(obs), 99)
+        self.assertEqual(obs.codes.shape, (99, 3))
+        self.assertEqual(obs.names[0], None)
+        self.assertEqual(len(obs.names), len(set(obs.names)))
+        row = obs.codes[obs.ids.index('T10')]
+        self.assertEqual([obs.names[c] for c in row], ['d__D0', 'p__P1',
+                                                       'c__C0'])
+
+        mapping = obs.to_dict()
+        self.assertTrue(mapping['T0'] is mapping['T30'])
+
+    def test_merge_matrices(self):
+        """recodes names and keeps the last row of an id"""
+        a = encode_consensus_map({'x': ['a', 'b'], 'y': ['a', None]}, 2)
+        b = encode_consensus_map({'x': ['c', 'b']}, 2)
+        obs = merge_matrices([a, b], 2).to_dict()
+        self.assertEqual(obs, {'x': ['c', 'b'], 'y': ['a', None]})
+
+    def test_load_consensus_map_errors(self):
+        """reports the line number of the first bad line"""
+        lines = self.lines[:]
+        lines[61] = "T61\td__D0; p__P0"
+        lines[80] = "T80 d__D0; p__P0; c__C0"
+        fp = self._write(lines, 'bad.txt')
+
+        for loader in (lambda: load_consensus_map(lines, False,
+                                                  context=self.context),
+                       lambda: load_consensus_map_parallel(
+                           fp, False, context=self.context, jobs=2,
+                           chunk_size=200)):
+            with self.assertRaises(ConsensusMapError) as cm:
+                loader()
+            self.assertEqual(cm.exception.lineno, 62)
+            self.assertEqual(str(cm.exception), "Line 62 of the consensus "
+                                                "map: expected 3 ranks, "
+                                                "found 2")
+
+        lines[61] = self.lines[61]
+        fp = self._write(lines, 'bad.txt')
+        with self.assertRaises(ValueError) as cm:
+            load_consensus_map_parallel(fp, False, context=self.context,
+                                        jobs=2, chunk_size=200)
+        self.assertEqual(cm.exception.lineno, 81)
+
+    def test_consensus_index(self):
+        """builds an index once and keeps the last line of an id"""
+        index_dir = os.path.join(self.tmp_dir, 'index')
+        index = ConsensusIndex.from_file(self.fp, index_dir)
+        self.assertEqual(len(os.listdir(index_dir)), 1)
+        self.assertEqual(len(index), 99)
+
+        items = list(index.items())
+        self.assertEqual(items[0], ('T0', 'd__D0; p__P0; c__C0'))
+        self.assertEqual(dict(items)['T3'], 'd__D0; p__; c__C3')
+        self.assertEqual(list(index.lines())[1], 'T1\td__D1; p__P1; c__C1')
+
+        obs = index.rows(['T10', 'T2', 'missing', 'T2'])
+        self.assertEqual(obs, [(3, 'T2', 'd__D0; p__P2; c__C2'),
+                               (11, 'T10', 'd__D0; p__P1; c__C0')])
+        index.close()
+
+        mtime = os.path.getmtime(index.path)
+        with ConsensusIndex.from_file(self.fp, index_dir) as index:
+            self.assertEqual(os.path.getmtime(index.path), mtime)
+        self.assertRaises(sqlite3.ProgrammingError, len, index)
+
+    def test_indexed_consensus_map(self):
+        """loads lineages on demand as load_consensus_map does"""
+        index = ConsensusIndex.from_file(self.fp, self.tmp_dir)
+        exp = load_consensus_map(self.lines, True, context=self.context)
+        obs = index.consensus_map(True, context=self.context)
+
+        self.assertEqual(obs.fetch(['T1', 'T7', 'foo']),
+                         {'T1': exp['T1'], 'T7': exp['T7']})
+        self.assertEqual(obs['T3'], exp['T3'])
+        self.assertEqual(obs.get('foo', 'x'), 'x')
+        self.assertTrue('T5' in obs)
+        self.assertFalse('foo' in obs)
+        self.assertRaises(KeyError, obs.__getitem__, 'foo')
+        self.assertEqual(sorted(map(tuple, obs.values())),
+                         sorted(set(map(tuple, exp.values()))))
+
+    def test_indexed_consensus_map_load_tree(self):
+        """load_tree fetches the lineages of the tips"""
+        index = ConsensusIndex.from_file(self.fp, self.tmp_dir)
+        tipname_map = index.consensus_map(False, context=self.context)
+        newick = u"((T1,T2)a,('T10',X));"
+        obs = load_tree(TreeNode.read(StringIO(newick)), tipname_map,
+                        self.context)
+        exp = load_consensus_map(self.lines, False, context=self.context)
+        self.assertEqual([t.Consensus for t in obs.tips()],
+                         [exp['T1'], exp['T2'], exp['T10'],
+                          [None, None, None]])
+
+    def test_indexed_consensus_map_errors(self):
+        """reports the line number in the file"""
+        lines = self.lines[:]
+        lines[61] = "T61\td__D0; p__P0"
+        path = os.path.join(self.tmp_dir, 'bad.sqlite')
+        build_index(lines, path)
+        tipname_map = ConsensusIndex(path).consensus_map(
+            False, context=self.context)
+        self.assertEqual(tipname_map.fetch(['T1']).keys(), ['T1'])
+        with self.assertRaises(ConsensusMapError) as cm:
+            tipname_map.fetch(['T1', 'T61'])
+        self.assertEqual(cm.exception.lineno, 62)
+        self.assertRaises(ConsensusMapError, tipname_map.values)
+
+        lines[50] = "T50 d__D0; p__P0; c__C0"
+        with self.assertRaises(ConsensusMapError) as cm:
+            build_index(lines, path)
+        self.assertEqual(cm.exception.lineno, 51)
+        self.assertFalse(os.path.exists(path + '.tmp'))
+        self.assertEqual(len(ConsensusIndex(path)), 99)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@
 
 from t2t.consensus import get_consensus_stats, taxa_score, hash_cons, \
     taxa_score_hash, merge_taxa_strings_and_scores
+from t2t.nlevel import TaxonomyContext, set_rank_order
 from unittest import TestCase, main
 from numpy import array, array_equal
 
@@ -136,6 +137,26 @@ class ConsensusTests(TestCase):
         for k in exp:
             self.assertTrue(array_equal(obs[k], exp[k]))
 
+    def test_taxa_score_hash_context(self):
+        """scores with the ranks of the context"""
+        master = {'a': ['k__k1', 'p__p1', 's__s1'],
+                  'b': ['k__k1', 'p__p2', 's__s2']}
+        rep1 = {'a': ['k__k1', 'p__p1', 's__s9'],
+                'b': ['k__k1', 'p__p2', 's__s2']}
+        exp = {'a': [1.0, 1.0, 0.0], 'b': [1.0, 1.0, 1.0]}
+
+        # the module level rank order is not used
+        set_rank_order(['x'])
+        try:
+            context = TaxonomyContext(['k', 'p', 's'])
+            for f in (taxa_score, taxa_score_hash):
+                obs = f(master, [rep1], context)
+                self.assertEqual(obs.keys(), exp.keys())
+                for k in exp:
+                    self.assertTrue(array_equal(obs[k], exp[k]))
+        finally:
+            set_rank_order(['d', 'p', 'c', 'o', 'f', 'g', 's'])
+
     def test_hash_cons(self):
         """test turning consensus strings into hashes"""
         input = {
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, main
+
+from skbio import TreeNode
+from StringIO import StringIO
+
+import t2t.nlevel as nl
+from t2t.benchmark import make_tree, make_consensus_map
+from t2t.cli import fetch
+from t2t.fetch import scan_newick, unknown_ranks, iter_lineages
+from t2t.pipeline import run_decorate
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+def _read(newick):
+    return TreeNode.read(StringIO(unicode(newick)), convert_underscores=False)
+
+
+def _write(tree):
+    fp = StringIO()
+    tree.write(fp)
+    return fp.getvalue()
+
+
+class FetchTests(TestCase):
+
+    def setUp(self):
+        lines = make_consensus_map(300, seed=4, noise=0.1, polyphyly=0.2,
+                                   missing=0.3)
+        self.context = nl.TaxonomyContext.from_consensus(
+            lines[0].split('\t')[1])
+        tipname_map = nl.load_consensus_map(lines, False,
+                                            context=self.context)
+        self.decorated = {}
+        for shape in ('balanced', 'caterpillar', 'polytomous'):
+            newick = make_tree(300, shape=shape, seed=5, support=0)
+            state = run_decorate(_read(newick), tipname_map,
+                                 context=self.context)
+            self.decorated[shape] = _write(state['tree'])
+
+    def test_scan_newick(self):
+        """scans the nodes of the newick in postorder"""
+        for newick in self.decorated.values() + ["((a,b)c,'d e'f)g;", "a;"]:
+            tree = _read(newick)
+            nodes = list(tree.postorder(include_self=True))
+            index = {id(n): i for i, n in enumerate(nodes)}
+
+            obs = scan_newick(StringIO(newick))
+            self.assertEqual(obs.names, [n.name for n in nodes])
+            self.assertEqual(obs.parents,
+                             [index[id(n.parent)] if n.parent else -1
+                              for n in nodes])
+            self.assertEqual(obs.first_tips,
+                             [index[id(n if n.is_tip() else next(n.tips()))]
+                              for n in nodes])
+            self.assertEqual([obs.names[i] for i in obs.tips],
+                             [n.name for n in nodes if n.is_tip()])
+
+    def test_iter_lineages(self):
+        """matches the consensus strings of the tree"""
+        for newick in self.decorated.values():
+            exp = nl.pull_consensus_strings(_read(newick),
+                                            context=self.context)
+            scanned = scan_newick(StringIO(newick))
+            self.assertEqual(unknown_ranks(scanned, self.context), [])
+            self.assertEqual(list(iter_lineages(scanned,
+                                                context=self.context)), exp)
+
+            exp = nl.pull_consensus_strings(_read(newick), append_prefix=False,
+                                            context=self.context)
+            self.assertEqual(list(iter_lineages(scanned, append_prefix=False,
+                                                context=self.context)), exp)
+
+    def test_iter_lineages_repeated_rank(self):
+        """keeps the name of a rank closest to the root"""
+        newick = "(((a,b)'g__B',c)'g__A; f__F',(d,e)'g__C; g__D')'p__P';"
+        exp = nl.pull_consensus_strings(_read(newick), context=self.context)
+        obs = list(iter_lineages(scan_newick(StringIO(newick)),
+                                 context=self.context))
+        self.assertEqual(obs, exp)
+        self.assertEqual(obs[0], "a\td__; p__P; c__; o__; f__F; g__A; s__")
+        self.assertEqual(obs[3], "d\td__; p__P; c__; o__; f__; g__D; s__")
+
+    def test_unknown_ranks(self):
+        """reports the first tip and the lineage of each node"""
+        newick = "((a,(b,c)x__X)'d__A; q__B',(d,e)0.5)'k__K';"
+        context = nl.TaxonomyContext(['k', 'd', 'p'])
+        obs = unknown_ranks(scan_newick(StringIO(newick)), context)
+        self.assertEqual(obs, ["Unknown rank: x__X",
+                               "\tA tip ID from the clade: b",
+                               "\tCurrent lineage in tree: k__K; "
+                               "d__A; q__B; x__X",
+                               "Unknown rank: d__A; q__B",
+                               "\tA tip ID from the clade: a",
+                               "\tCurrent lineage in tree: k__K; d__A; q__B",
+                               "Unknown rank: 0.5",
+                               "\tA tip ID from the clade: d",
+                               "\tCurrent lineage in tree: k__K; 0.5"])
+
+    def test_fetch(self):
+        """fetches the lineages or the unknown ranks"""
+        newick = self.decorated['balanced']
+        res, error = fetch(StringIO(newick), context=self.context)
+        self.assertFalse(error)
+        self.assertEqual(list(res), nl.pull_consensus_strings(
+            _read(newick), context=self.context))
+
+        res, error = fetch(StringIO("((a,b)x__X,c);"), context=self.context)
+        self.assertTrue(error)
+        self.assertEqual(res[0], "Unknown rank: x__X")
+
+
+if __name__ == '__main__':
+    main()
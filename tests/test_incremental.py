@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+import os
+import random
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+from skbio import TreeNode
+from StringIO import StringIO
+
+import t2t.nlevel as nl
+from t2t.benchmark import make_tree, make_consensus_map
+from t2t.incremental import (IncrementalDecoration, parse_insertions,
+                             parse_lineage_diff)
+from t2t.pipeline import run_decorate
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+def _read(newick):
+    return TreeNode.read(StringIO(unicode(newick)), convert_underscores=False)
+
+
+def _write(tree):
+    fp = StringIO()
+    tree.write(fp)
+    return fp.getvalue()
+
+
+def remove_tips(newick, n, seed=0):
+    """Remove up to n tips that are the second child of a pair
+
+    Returns the tree with the tips, with the supports of their parents
+    dropped, the tree without them and the insertions that restore them.
+    """
+    tree = _read(newick)
+    rng = random.Random(seed)
+    candidates = [t for t in tree.tips() if len(t.parent.children) == 2 and
+                  t.parent.children[1] is t and t.parent.parent is not None]
+    n = min(n, len(candidates))
+    removed = [t.name for t in rng.sample(candidates, n)]
+    for name in removed:
+        tree.find(name).parent.name = None
+    full = _write(tree)
+
+    insertions = []
+    for name in removed:
+        tip = tree.find(name)
+        parent = tip.parent
+        sibling = parent.children[0]
+        tips = list(sibling.tips()) or [sibling]
+        insertions.append((name, [tips[0].name, tips[-1].name], tip.length))
+
+        grandparent = parent.parent
+        idx = [c is parent for c in grandparent.children].index(True)
+        grandparent.children[idx] = sibling
+        sibling.parent = grandparent
+        tree.invalidate_caches()
+
+    return full, _write(tree), insertions[::-1]
+
+
+class IncrementalTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.lines = make_consensus_map(400, seed=3, noise=0.1,
+                                        polyphyly=0.1, missing=0.3)
+        self.context = nl.TaxonomyContext.from_consensus(
+            self.lines[0].split('\t')[1])
+        self.tipname_map = nl.load_consensus_map(self.lines, False,
+                                                 context=self.context)
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def _full(self, newick, tipname_map, **kwargs):
+        state = run_decorate(_read(newick), tipname_map,
+                             context=self.context, **kwargs)
+        return _write(state['tree']), state['constrings']
+
+    def _check_insert(self, newick, n, seed=0, **kwargs):
+        full, partial, insertions = remove_tips(newick, n, seed)
+        removed = set(name for name, _, _ in insertions)
+        partial_map = {k: v for k, v in self.tipname_map.items()
+                       if k not in removed}
+
+        decoration = IncrementalDecoration(_read(partial), partial_map,
+                                           context=self.context, **kwargs)
+        constrings = decoration.decorate()
+        self.assertEqual((_write(decoration.tree), constrings),
+                         self._full(partial, partial_map, **kwargs))
+
+        decoration.insert_tips(insertions, self.tipname_map)
+        constrings = decoration.decorate()
+        self.assertEqual((_write(decoration.tree), constrings),
+                         self._full(full, self.tipname_map, **kwargs))
+        return decoration
+
+    def test_insert_tips(self):
+        """matches a full decoration of the tree with the new tips"""
+        for shape in ('balanced', 'caterpillar', 'polytomous'):
+            newick = make_tree(400, shape=shape, seed=5)
+            for seed in range(3):
+                self._check_insert(newick, 25, seed)
+
+    def test_insert_tips_options(self):
+        """keeps to min_count and the suffix options"""
+        newick = make_tree(400, seed=2)
+        self._check_insert(newick, 30, min_count=5)
+        self._check_insert(newick, 30, no_suffix=True)
+        self._check_insert(newick, 30, suffix_char='.')
+
+    def test_insert_tips_root(self):
+        """places a tip beside the whole tree"""
+        newick = make_tree(400, seed=1)
+        tipname_map = dict(self.tipname_map)
+        tipname_map['new'] = tipname_map['T0']
+
+        decoration = IncrementalDecoration(_read(newick), self.tipname_map,
+                                           context=self.context)
+        decoration.insert_tips([('new', ['T0', 'T399'], 0.1)], tipname_map)
+        constrings = decoration.decorate()
+
+        full = '(%s,new:0.1);' % newick.strip().rstrip(';')
+        self.assertEqual((_write(decoration.tree), constrings),
+                         self._full(full, tipname_map))
+
+    def test_insert_tips_errors(self):
+        """rejects tips in the tree and anchors that are not"""
+        decoration = IncrementalDecoration(_read(make_tree(10)),
+                                           self.tipname_map,
+                                           context=self.context)
+        self.assertRaises(ValueError, decoration.insert_tips,
+                          [('T1', ['T2'], None)], self.tipname_map)
+        self.assertRaises(ValueError, decoration.insert_tips,
+                          [('new', ['T2', 'foo'], None)], self.tipname_map)
+
+    def test_update_lineages(self):
+        """matches a full decoration with the changed lineages"""
+        rng = random.Random(1)
+        empty = '; '.join('%s__' % r for r in self.context.rank_order)
+        for shape in ('balanced', 'caterpillar'):
+            newick = make_tree(400, shape=shape, seed=6)
+            decoration = IncrementalDecoration(_read(newick),
+                                               dict(self.tipname_map),
+                                               context=self.context)
+            lines = self.lines[:]
+            for step in range(3):
+                diff = []
+                for idx in rng.sample(range(len(lines)), 20):
+                    id_, old = lines[idx].split('\t')
+                    new = rng.choice([empty, rng.choice(lines).split('\t')[1]])
+                    lines[idx] = '%s\t%s' % (id_, new)
+                    diff.append('\t'.join([id_, old, new]))
+                # an id that is not in the tree
+                id_, new = 'new%d' % step, self.lines[step].split('\t')[1]
+                diff.append('\t'.join([id_, empty, new]))
+                lines.append('%s\t%s' % (id_, new))
+
+                decoration.update_lineages(
+                    parse_lineage_diff(diff, self.context))
+                constrings = decoration.decorate()
+                tipname_map = nl.load_consensus_map(lines, False,
+                                                    context=self.context)
+                self.assertEqual(decoration.tipname_map, tipname_map)
+                self.assertEqual((_write(decoration.tree), constrings),
+                                 self._full(newick, tipname_map))
+
+    def test_update_lineages_stale(self):
+        """rejects a diff whose old lineage is not the current one"""
+        decoration = IncrementalDecoration(_read(make_tree(20)),
+                                           dict(self.tipname_map),
+                                           context=self.context)
+        t1 = self.tipname_map['T1']
+        empty = [None] * self.context.n_ranks
+        diff = [('T1', t1, empty), ('T2', self.tipname_map['T2'], t1),
+                ('T1', t1, empty)]
+        self.assertRaises(ValueError, decoration.update_lineages, diff)
+        self.assertEqual(decoration.tipname_map['T1'], t1)
+        self.assertEqual(decoration.tree.find('T1').Consensus, t1)
+
+    def test_save_load(self):
+        """a saved decoration is updated as the original"""
+        newick = make_tree(400, seed=4)
+        full, partial, insertions = remove_tips(newick, 20)
+        decoration = IncrementalDecoration(_read(partial), self.tipname_map,
+                                           min_count=3, context=self.context)
+        fp = os.path.join(self.tmp_dir, 'decoration.pkl.gz')
+        decoration.save(fp)
+
+        loaded = IncrementalDecoration.load(fp)
+        self.assertEqual(loaded.context.rank_order, self.context.rank_order)
+        self.assertEqual(loaded.min_count, 3)
+        for d in (decoration, loaded):
+            d.insert_tips(insertions, self.tipname_map)
+        self.assertEqual(loaded.decorate(), decoration.decorate())
+        self.assertEqual(_write(loaded.tree), _write(decoration.tree))
+
+    def test_parse_insertions(self):
+        """parses tips, anchors and optional lengths"""
+        lines = ["# new tips", "a\tx,y\t0.5", "", "b\tz"]
+        self.assertEqual(parse_insertions(lines), [('a', ['x', 'y'], 0.5),
+                                                   ('b', ['z'], None)])
+        self.assertRaises(ValueError, parse_insertions, ["a"])
+        self.assertRaises(ValueError, parse_insertions, ["a\t,"])
+        self.assertRaises(ValueError, parse_insertions, ["a\tx\tfoo"])
+
+    def test_parse_lineage_diff(self):
+        """cleans the old and new lineages"""
+        context = nl.TaxonomyContext(['d', 'p', 'c'])
+        lines = ["x\td__A; p__B; c__\td__A; p__uncultured; c__C", "",
+                 "y\td__; p__; c__\td__A; p__D; c__E"]
+        self.assertEqual(parse_lineage_diff(lines, context),
+                         [('x', ['d__A', 'p__B', None],
+                           ['d__A', None, 'c__C']),
+                          ('y', [None, None, None],
+                           ['d__A', 'p__D', 'c__E'])])
+        with self.assertRaises(ValueError) as cm:
+            parse_lineage_diff(lines + ["z\td__A; p__B\td__A"], context)
+        self.assertEqual(str(cm.exception), "Line 4 of the lineage diff: "
+                                            "expected 3 ranks, found 2")
+        self.assertRaises(ValueError, parse_lineage_diff, ["x\td__A"],
+                          context)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import os
+import gzip
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+from skbio import TreeNode
+from StringIO import StringIO
+
+from t2t.benchmark import make_tree
+from t2t.newick import (newick_tokens, line_tokens, write_newick,
+                        write_lines, open_output, decoration_paths,
+                        BackgroundWriter, read_tokens, newick_nodes)
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+class ChunkFile(object):
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+
+class FailingFile(object):
+    def write(self, data):
+        raise IOError("disk full")
+
+    def close(self):
+        pass
+
+
+class NewickTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def _skbio(self, tree):
+        fp = StringIO()
+        tree.write(fp)
+        return fp.getvalue()
+
+    def test_newick_tokens(self):
+        """writes the newick TreeNode.write does"""
+        newicks = [u"((a:1,b:2.5)'x; y':0.1,(c,'d''s e',f)'1.0:h')r;",
+                   u"(a,(b,(c,(d)e)));", u"a;", u";",
+                   make_tree(50, shape='polytomous', seed=1)]
+        for newick in newicks:
+            tree = TreeNode.read(StringIO(unicode(newick)), format='newick',
+                                 convert_underscores=False)
+            for node in tree.traverse(include_self=True):
+                if node.name == 'f':
+                    node.name = 'f g'
+            self.assertEqual(''.join(newick_tokens(tree)), self._skbio(tree))
+
+    def test_read_tokens(self):
+        """reads labels across blocks"""
+        newick = "(c_1,'d''s e' [x],f)'x''':2;\n"
+        for block_size in (1, 2, 3, 100):
+            obs = list(read_tokens(StringIO(newick), block_size=block_size))
+            self.assertEqual(obs, ['(', 'c_1', ',', "d's e", ',', 'f', ')',
+                                   "x'", ':', '2', ';'])
+        self.assertEqual(list(read_tokens(StringIO("(a_b);"),
+                                          convert_underscores=True)),
+                         ['(', 'a b', ')', ';'])
+        for newick in ("(a,'b);", "(a,[b);", "(a b,c);"):
+            self.assertRaises(ValueError, list, read_tokens(StringIO(newick)))
+
+    def test_newick_nodes(self):
+        """yields the nodes TreeNode.read reads"""
+        newicks = [u"((a:1,b:2.5)'x; y':0.1,(c,'d''s e',f)'1.0:h')r;",
+                   u"(a,(b,(c,(d)e)));", u"a:3;", u";",
+                   make_tree(50, shape='polytomous', seed=1)]
+        for newick in newicks:
+            tree = TreeNode.read(StringIO(unicode(newick)), format='newick',
+                                 convert_underscores=False)
+            exp = [(n.name, n.length, len(n.children))
+                   for n in tree.postorder(include_self=True)]
+            obs = list(newick_nodes(read_tokens(StringIO(newick),
+                                                block_size=7)))
+            self.assertEqual(obs, exp)
+
+        for newick in ("(a,b;", "a,b);", "(a,b)", "(a:x);", "a(b);"):
+            self.assertRaises(ValueError, list,
+                              newick_nodes(read_tokens(StringIO(newick))))
+
+    def test_line_tokens(self):
+        """joins lines with newlines"""
+        for lines in ([], ['a'], ['a', 'b\tc', '']):
+            self.assertEqual(''.join(line_tokens(lines)), '\n'.join(lines))
+            self.assertEqual(''.join(line_tokens(iter(lines))),
+                             '\n'.join(lines))
+
+    def test_write_newick(self):
+        """writes in chunks of about the chunk size"""
+        tree = TreeNode.read(StringIO(unicode(make_tree(100, seed=2))))
+        fh = ChunkFile()
+        write_newick(tree, fh, chunk_size=64)
+        chunks = fh.chunks
+        self.assertTrue(len(chunks) > 10)
+        self.assertTrue(all(len(c) >= 64 for c in chunks[:-1]))
+        self.assertEqual(''.join(chunks), self._skbio(tree))
+
+    def test_write_lines_gzip(self):
+        """writes plain and gzipped output"""
+        lines = ['x%d\td__A; p__B' % i for i in range(1000)]
+        for compress in (False, True):
+            path = os.path.join(self.tmp_dir, 'out%s' % compress)
+            with BackgroundWriter(open_output(path, compress),
+                                  max_chunks=2) as fh:
+                write_lines(lines, fh, chunk_size=100)
+            opener = gzip.open if compress else open
+            self.assertEqual(opener(path, 'rb').read(), '\n'.join(lines))
+
+    def test_decoration_paths(self):
+        """compresses the consensus strings as the tree"""
+        self.assertEqual(decoration_paths('out'),
+                         ('out', 'out-consensus-strings'))
+        self.assertEqual(decoration_paths('out', compress=True),
+                         ('out.gz', 'out-consensus-strings.gz'))
+        self.assertEqual(decoration_paths('out.bz2'),
+                         ('out.bz2', 'out-consensus-strings.bz2'))
+        self.assertEqual(decoration_paths('out.txt'),
+                         ('out.txt', 'out.txt-consensus-strings'))
+        self.assertEqual(decoration_paths('out.gz', compress=True),
+                         ('out.gz', 'out-consensus-strings.gz'))
+        self.assertEqual(decoration_paths('out.bz2', compress=True),
+                         ('out.gz', 'out-consensus-strings.gz'))
+
+    def test_background_writer_error(self):
+        """raises the error of the thread"""
+        fh = BackgroundWriter(FailingFile(), max_chunks=1)
+        with self.assertRaises(IOError):
+            for _ in range(10):
+                fh.write('x')
+            fh.close()
+        self.assertRaises(IOError, fh.close)
+
+
+if __name__ == '__main__':
+    main()
@@ -19,13 +19,17 @@ __status__ = "Development"
 from unittest import TestCase, main
 from t2t.nlevel import (load_consensus_map, collect_names_at_ranks_counts,
                         load_tree, decorate_name_relative_freqs, decorate_name_counts,
-                        set_ranksafe,
+                        set_ranksafe, ranksafe_ranks, node_rank_names,
                         pick_names, has_badname, get_nearest_named_ancestor,
                         walk_consensus_tree, make_consensus_tree,
+                        make_consensus_lookup, ancestor_paths,
                         backfill_names_gap, commonname_promotion,
+                        make_names_unique, pull_consensus_strings,
+                        consensus_strings, save_bootstraps,
                         decorate_ntips, decorate_ntips_rank,
                         name_node_score_fold,
-                        validate_all_paths, score_tree)
+                        validate_all_paths, score_tree, TaxonomyContext)
+import t2t.nlevel as nl
 
 from skbio import TreeNode
 from StringIO import StringIO
@@ -69,6 +73,58 @@ class NLevelTests(TestCase):
         data = "asdasdsad dsasda dasd as"
         self.assertFalse(has_badname(data))
 
+    def test_taxonomy_context(self):
+        """carries its own rank order and bad names"""
+        context = TaxonomyContext.from_consensus("k__a; p__b; s__c",
+                                                 bad_names=['foo'])
+        self.assertEqual(context.rank_order, ['k', 'p', 's'])
+        self.assertEqual(context.n_ranks, 3)
+        self.assertEqual(context.rank_index, {'k': 0, 'p': 1, 's': 2})
+        self.assertTrue(context.has_badname('a foo b'))
+        self.assertFalse(context.has_badname('uncultured'))
+        self.assertTrue(has_badname('a foo b', context))
+        self.assertEqual(nl.RANK_ORDER, ['d', 'p', 'c', 'o', 'f', 'g', 's'])
+
+        context = TaxonomyContext()
+        self.assertEqual(context.rank_order, nl.RANK_ORDER)
+        self.assertTrue(context.has_badname('uncultured'))
+
+    def test_load_consensus_map_context(self):
+        """uses the ranks of the context"""
+        data = ["foo	a; b; c", "bar	d; e; uncultured"]
+        context = TaxonomyContext(['k', 'p', 's'])
+        exp = {'foo': ['k__a', 'p__b', 's__c'],
+               'bar': ['k__d', 'p__e', 's__']}
+        obs = load_consensus_map(data, True, context=context)
+        self.assertEqual(obs, exp)
+        self.assertRaises(ValueError, load_consensus_map, data, True)
+
+    def test_load_consensus_map_shared(self):
+        """identical lineages share a list and names are cleaned once"""
+        data = ["foo\td__a; p__b; c__uncultured",
+                "bar\td__a; p__b; c__uncultured",
+                "baz\td__a; p__b; c__",
+                "qux\td__a; p__b; c__c"]
+        context = TaxonomyContext(['d', 'p', 'c'])
+        obs = load_consensus_map(data, False, context=context)
+        self.assertEqual(obs['foo'], ['d__a', 'p__b', None])
+        self.assertEqual(obs['baz'], ['d__a', 'p__b', None])
+        self.assertTrue(obs['foo'] is obs['bar'])
+        self.assertFalse(obs['foo'] is obs['baz'])
+        self.assertTrue(obs['foo'][0] is obs['qux'][0])
+
+        self.assertEqual(context.clean_name('c__uncultured'),
+                         ('c__uncultured', False, True))
+        self.assertEqual(context.clean_name('c__'), ('c__', True, False))
+        self.assertEqual(context.clean_name('None'), ('None', True, False))
+
+        # options are part of the key
+        obs = load_consensus_map(data, False, check_bad=False,
+                                 context=context)
+        self.assertEqual(obs['foo'], ['d__a', 'p__b', 'c__uncultured'])
+        obs = load_consensus_map(["foo\ta; b; "], True, context=context)
+        self.assertEqual(obs['foo'], ['d__a', 'p__b', 'c__'])
+
     def test_load_consensus_map(self):
         """correctly returns a consensus map"""
         data = ["foo\ta; b; c; d; e; f; g",
@@ -171,6 +227,16 @@ class NLevelTests(TestCase):
 
         self.assertEqual(tree.ConsensusRelFreq, exp_root)
 
+        decorate_name_relative_freqs(tree, total_counts, 1, min_relfreq=0.6)
+        self.assertEqual(tree.ConsensusRelFreq, {0: {'1': .6},
+                                                 1: {'2': 1.0},
+                                                 3: {'4': 1.0},
+                                                 4: {'a': 1.0},
+                                                 5: {'6': 4.0 / 6},
+                                                 6: {'7': 1.0, '8': 1.0}})
+        self.assertEqual(tree.ValidRelFreq[4], {'a': 0.5})
+        self.assertFalse(2 in tree.ValidRelFreq)
+
     def test_decorate_name_counts(self):
         """correctly decorate relative frequency information on a tree"""
         data = StringIO(u"((a,b)c,(d,(e,f)g)h,(i,j)k)l;")
@@ -219,7 +285,11 @@ class NLevelTests(TestCase):
         set_ranksafe(tree)
 
         exp_root = [True, False, True, False, True, True, False]
-        self.assertEqual(tree.RankSafe, exp_root)
+        self.assertEqual(tree.RankSafe,
+                         sum(1 << i for i, safe in enumerate(exp_root)
+                             if safe))
+        self.assertEqual(ranksafe_ranks(tree.RankSafe), [0, 2, 4, 5])
+        self.assertEqual(tree.children[0].children[0].RankSafe, 0)
 
     def test_name_node_score_fold(self):
         """hate taxonomy"""
@@ -335,6 +405,18 @@ class NLevelTests(TestCase):
         self.assertEqual(tree.children[2].RankNames, expc2)
         self.assertEqual(tree.children[1].children[1].RankNames, expc1c1)
 
+    def test_node_rank_names(self):
+        """places names from the first safe rank to the next unsafe one"""
+        relfreq = {0: {'a': 1.0}, 1: {'b': 0.4, 'c': 0.6}, 2: {},
+                   3: {'d': 0.5, 'e': 0.5}, 4: {'f': 0.9}}
+        self.assertEqual(node_rank_names(0b10011, relfreq, 5),
+                         ['a', 'c', None, None, None])
+        self.assertEqual(node_rank_names(0b10010, relfreq, 5),
+                         [None, 'c', None, None, None])
+        self.assertEqual(node_rank_names(0b10000, relfreq, 5),
+                         [None, None, None, None, 'f'])
+        self.assertEqual(node_rank_names(0, relfreq, 5), [None] * 5)
+
     def test_walk_consensus_tree(self):
         """correctly walk consensus tree"""
         data = [['a', 'b', 'c', 'd', 'e', 'f', 'g'],
@@ -390,6 +472,37 @@ class NLevelTests(TestCase):
         self.assertEqual(fp.getvalue().strip(), exp_str)
         self.assertNotIn(None, lookup)
 
+    def test_make_consensus_lookup(self):
+        """matches the lookup of make_consensus_tree"""
+        data = [['a', 'b', 'c', 'd', 'e', 'f', 'g'],
+                ['a', 'b', 'c', None, None, 'x', 'y'],
+                ['h', 'i', 'j', 'k', 'l', 'm', 'n'],
+                ['h', 'i', 'j', 'k', 'l', 'm', 'q'],
+                ['h', 'i', 'j', 'k', 'l', 'm', 'n'],
+                ['h', 'i', 'c', 'k', 'z', 'm', 'n'],
+                ['a', 'i', 'j', 'k', 'l', 'f', 'g']]
+        _, exp = make_consensus_tree(data, check_for_rank=False)
+        obs = make_consensus_lookup(data + data[:3], check_for_rank=False)
+
+        def path(node):
+            result = []
+            while node is not None:
+                result.append((node.name, node.Rank))
+                node = node.parent
+            return result
+
+        self.assertEqual(sorted(obs), sorted(exp))
+        for name in exp:
+            self.assertEqual(path(obs[name]), path(exp[name]))
+
+        for name, levels in [('n', 3), ('a', 3), ('x', 4), ('g', 7)]:
+            self.assertEqual(walk_consensus_tree(obs, name, levels),
+                             walk_consensus_tree(exp, name, levels))
+
+        data = [['d__a', 'p__b', 'c__'], ['d__a', 'p__c', 'c__e']]
+        self.assertEqual(sorted(make_consensus_lookup(data)),
+                         ['c__e', 'd__a', 'p__b', 'p__c'])
+
     def test_decorate_ntips(self):
         """correctly decorate the tree with the NumTips param"""
         data = StringIO(u"(((a,b)c,(d,e,f)g)h,(i,j)k)l;")
@@ -442,6 +555,24 @@ class NLevelTests(TestCase):
         self.assertEqual(obs_t, exp_t)
         self.assertEqual(obs_t2, exp_t2)
 
+    def test_ancestor_paths(self):
+        """gives the lineage of each name, with gaps"""
+        data = [['a', 'b', 'c', 'd', 'e', 'f', 'g'],
+                ['a', 'b', 'c', None, None, 'x', 'y'],
+                ['h', 'i', 'j', 'k', 'l', 'm', 'n']]
+        lookup = make_consensus_lookup(data, check_for_rank=False)
+        obs = ancestor_paths(lookup)
+        self.assertEqual(obs['y'], ('a', 'b', 'c', 'o__', 'f__', 'x', 'y'))
+        self.assertEqual(obs['h'], ('h', ))
+        self.assertEqual(obs['l'], ('h', 'i', 'j', 'k', 'l'))
+
+        _, tree_lookup = make_consensus_tree(data, check_for_rank=False)
+        self.assertEqual(ancestor_paths(tree_lookup), obs)
+
+        context = TaxonomyContext(['k', 'p', 'c', 'o', 'f', 'g', 's'])
+        self.assertEqual(ancestor_paths(lookup, context)['x'],
+                         ('a', 'b', 'c', 'o__', 'f__', 'x'))
+
     def test_backfill_names_gap(self):
         """correctly backfill names"""
         consensus_tree = TreeNode.read(StringIO(u"(((s1,s2)g1,(s3,s4)g2,(s5,s6)g3)f1)o1;"))
@@ -512,5 +643,41 @@ class NLevelTests(TestCase):
 
         self.assertEqual(fp.getvalue().strip(), exp)
 
+    def test_make_names_unique(self):
+        """numbers duplicates by size, then from left to right"""
+        t = load_tree(TreeNode.read(StringIO(
+            u"(((a,b)x,(c,d)y)z,((e,f)w,(g,h,i)v)u)r;")), {})
+        names = {'x': ['g__A'], 'y': ['f__B', 'g__A'], 'z': ['f__B'],
+                 'w': ['g__A'], 'v': ['g__A'], 'u': ['g__'], 'r': ['g__']}
+        nodes = {}
+        for n in t.non_tips(include_self=True):
+            nodes[n.name] = n
+            n.BackFillNames = list(names[n.name])
+
+        make_names_unique(t)
+        obs = {label: n.name for label, n in nodes.items()}
+        self.assertEqual(obs, {'x': 'g__A_2', 'y': 'f__B_1; g__A_1',
+                               'z': 'f__B', 'w': 'g__A_3', 'v': 'g__A',
+                               'u': 'g__', 'r': 'g__'})
+
+    def test_consensus_strings(self):
+        """builds the strings of pull_consensus_strings when read"""
+        t = load_tree(TreeNode.read(StringIO(
+            u"(((a,b)'g__B',c)'g__A; f__F',(d,(e,f)0.9)'p__P; g__ ',"
+            u"g)'d__D';")), {})
+        for append_prefix in (True, False):
+            exp = pull_consensus_strings(t, append_prefix=append_prefix)
+            obs = consensus_strings(t, append_prefix=append_prefix)
+            self.assertEqual(list(obs), exp)
+            self.assertEqual(len(obs), 7)
+            self.assertEqual(obs[6], exp[6])
+
+        exp = pull_consensus_strings(t)
+        obs = consensus_strings(t)
+        save_bootstraps(t)
+        self.assertEqual(obs, exp)
+        self.assertEqual(exp[0], "a\td__D; p__; c__; o__; f__F; g__A; s__")
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+from StringIO import StringIO
+from threading import Thread
+
+import t2t.nlevel as nl
+from t2t.pipeline import (run_decorate, load_manifest, STAGE_NAMES,
+                          CheckpointError)
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+class PipelineTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.checkpoint_dir = os.path.join(self.tmp_dir, 'checkpoints')
+        nl.determine_rank_order(cons_lines[0].split('\t')[1])
+        self.inputs = {'tree': 'x', 'consensus_map': 'y'}
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+        nl.set_rank_order(['d', 'p', 'c', 'o', 'f', 'g', 's'])
+
+    def _run(self, **kwargs):
+        tipname_map = nl.load_consensus_map(cons_lines, False)
+        state = run_decorate(StringIO(tree_str), tipname_map, **kwargs)
+        fp = StringIO()
+        state['tree'].write(fp)
+        return fp.getvalue(), state['constrings']
+
+    def test_run_decorate(self):
+        """runs the full pipeline"""
+        obs_tree, obs_cons = self._run()
+        self.assertEqual(obs_tree, exp_tree)
+        self.assertEqual(obs_cons, exp_cons)
+
+    def test_run_decorate_context(self):
+        """concurrent runs with different ranks do not interfere"""
+        lines2 = [line.replace('f__F; ', '') for line in cons_lines]
+
+        def run(lines, results, n=1):
+            context = nl.TaxonomyContext.from_consensus(
+                lines[0].split('\t')[1])
+            tipname_map = nl.load_consensus_map(lines, False,
+                                                context=context)
+            for _ in range(n):
+                state = run_decorate(StringIO(tree_str), tipname_map,
+                                     context=context)
+                fp = StringIO()
+                state['tree'].write(fp)
+                results.append((fp.getvalue(), state['constrings']))
+
+        exp = []
+        run(lines2, exp)
+        self.assertEqual(exp[0][1][0], "a\tg__; s__X")
+
+        nl.set_rank_order(['x'])
+        results = {7: [], 2: []}
+        threads = [Thread(target=run, args=(cons_lines, results[7], 5)),
+                   Thread(target=run, args=(lines2, results[2], 5))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results[7], [(exp_tree, exp_cons)] * 5)
+        self.assertEqual(results[2], exp * 5)
+
+    def test_run_decorate_checkpoints(self):
+        """checkpoints every stage"""
+        obs = self._run(checkpoint_dir=self.checkpoint_dir,
+                        inputs=self.inputs)
+        self.assertEqual(obs, (exp_tree, exp_cons))
+
+        manifest = load_manifest(self.checkpoint_dir)
+        self.assertEqual(manifest['inputs'], self.inputs)
+        exp = set(STAGE_NAMES) - set(['make_consensus_tree'])
+        self.assertEqual(set(manifest['completed']), exp)
+
+    def test_run_decorate_resume(self):
+        """resuming from any stage gives the same result"""
+        self._run(checkpoint_dir=self.checkpoint_dir, inputs=self.inputs)
+        for stage in STAGE_NAMES:
+            obs = self._run(checkpoint_dir=self.checkpoint_dir,
+                            inputs=self.inputs, resume_from=stage)
+            self.assertEqual(obs, (exp_tree, exp_cons))
+
+    def test_run_decorate_resume_naming(self):
+        """naming stages can be rerun with new parameters"""
+        obs = self._run(checkpoint_dir=self.checkpoint_dir,
+                        inputs=self.inputs, suffix_char='#')
+        self.assertEqual(obs[1][4], "e\tf__F; g__G#1; s__Z")
+        obs = self._run(checkpoint_dir=self.checkpoint_dir,
+                        inputs=self.inputs, resume_from='make_names_unique')
+        self.assertEqual(obs, (exp_tree, exp_cons))
+
+    def test_run_decorate_low_memory(self):
+        """releases the frequencies without changing the result"""
+        tipname_map = nl.load_consensus_map(cons_lines, False)
+        state = run_decorate(StringIO(tree_str), tipname_map,
+                             low_memory=True)
+        fp = StringIO()
+        state['tree'].write(fp)
+        self.assertEqual((fp.getvalue(), state['constrings']),
+                         (exp_tree, exp_cons))
+        for node in state['tree'].traverse(include_self=True):
+            for attr in ('ConsensusRelFreq', 'ValidRelFreq', 'RankSafe'):
+                self.assertFalse(hasattr(node, attr))
+        self.assertEqual(state['tree'].RankNameScores[-3], 1.0)
+
+        self._run(checkpoint_dir=self.checkpoint_dir, inputs=self.inputs,
+                  low_memory=True)
+        for stage in ('pick_names', 'backfill_names_gap'):
+            obs = self._run(checkpoint_dir=self.checkpoint_dir,
+                            inputs=self.inputs, resume_from=stage,
+                            low_memory=True)
+            self.assertEqual(obs, (exp_tree, exp_cons))
+
+    def test_run_decorate_resume_errors(self):
+        """refuses to resume from inconsistent checkpoints"""
+        self.assertRaises(CheckpointError, self._run,
+                          resume_from='pick_names')
+        self.assertRaises(CheckpointError, self._run,
+                          checkpoint_dir=self.checkpoint_dir,
+                          inputs=self.inputs, resume_from='pick_names')
+
+        self._run(checkpoint_dir=self.checkpoint_dir, inputs=self.inputs)
+        self.assertRaises(CheckpointError, self._run,
+                          checkpoint_dir=self.checkpoint_dir,
+                          inputs={'tree': 'z', 'consensus_map': 'y'},
+                          resume_from='pick_names')
+        self.assertRaises(CheckpointError, self._run,
+                          checkpoint_dir=self.checkpoint_dir,
+                          inputs=self.inputs, min_count=1,
+                          resume_from='pick_names')
+
+
+tree_str = u"((a,b),(c,d),(e,f));"
+cons_lines = ["a\tf__F; g__G; s__X",
+              "b\tf__F; g__G; s__X",
+              "c\tf__F; g__H; s__Y",
+              "d\tf__F; g__H; s__Y",
+              "e\tf__F; g__G; s__Z",
+              "f\tf__F; g__G; s__Z"]
+exp_tree = "((a,b)'g__G; s__X',(c,d)'g__H; s__Y',(e,f)'g__G_1; s__Z')'f__F';\n"
+exp_cons = ["a\tf__F; g__G; s__X",
+            "b\tf__F; g__G; s__X",
+            "c\tf__F; g__H; s__Y",
+            "d\tf__F; g__H; s__Y",
+            "e\tf__F; g__G_1; s__Z",
+            "f\tf__F; g__G_1; s__Z"]
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,12 @@
 #!/usr/bin/env python
 
-from t2t.remap import parse_otu_map, members_to_rep, remap_taxonomy
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from t2t.conmap import ConsensusIndex
+from t2t.remap import (parse_otu_map, members_to_rep, remap_taxonomy,
+                       remap_index)
 from unittest import TestCase, main
 
 
@@ -42,5 +48,26 @@ class RemapTests(TestCase):
         obs = remap_taxonomy(mapping, tax)
         self.assertEqual(obs, exp)
 
+    def test_remap_index(self):
+        mapping = {"2": ["2", "3", "4"],
+                   "5": ["5", "6"],
+                   "7": ["7"]}
+        tmp_dir = mkdtemp()
+        try:
+            fp = os.path.join(tmp_dir, 'tax.txt')
+            with open(fp, 'w') as fh:
+                fh.write("3\ta; b; c\n7\tx; y; z\n8\tfoo; bar\n")
+            with ConsensusIndex.from_file(fp, tmp_dir) as index:
+                obs = list(remap_index(mapping, index))
+        finally:
+            rmtree(tmp_dir)
+
+        self.assertEqual(len(obs), 5)
+        self.assertEqual(dict(obs), {"2": ["a", "b", "c"],
+                                     "3": ["a", "b", "c"],
+                                     "4": ["a", "b", "c"],
+                                     "7": ["x", "y", "z"],
+                                     "8": ['foo', 'bar']})
+
 if __name__ == '__main__':
     main()
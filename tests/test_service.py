@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+import os
+import gzip
+import json
+import socket
+import httplib
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Thread
+from unittest import TestCase, main
+
+import t2t.nlevel as nl
+from t2t.service import DecorationService, make_server, clear_socket
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, 'localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+class ServiceTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.tree_fp = os.path.join(self.tmp_dir, 'tree.ntree')
+        with open(self.tree_fp, 'w') as fh:
+            fh.write(tree_str)
+        self.service = DecorationService(self.tree_fp, jobs=2)
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.service.close()
+        rmtree(self.tmp_dir)
+        nl.set_rank_order(['d', 'p', 'c', 'o', 'f', 'g', 's'])
+
+    def _serve(self, **kwargs):
+        self.server = make_server(self.service, **kwargs)
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def _request(self, conn, method, path, body=None):
+        conn.request(method, path, body)
+        resp = conn.getresponse()
+        result = resp.status, json.loads(resp.read())
+        conn.close()
+        return result
+
+    def test_decorate(self):
+        """decorates against the resident tree"""
+        obs = self.service.decorate(cons_lines)
+        self.assertEqual(obs, (exp_tree, exp_cons))
+
+        # requests do not see each other's decorations
+        obs = self.service.decorate(cons_lines, suffix_char='#')
+        self.assertEqual(obs[1][4], "e\tf__F; g__G#1; s__Z")
+        obs = self.service.decorate(cons_lines)
+        self.assertEqual(obs, (exp_tree, exp_cons))
+        self.assertEqual(self.service.status()['n_requests'], 3)
+
+    def test_decorate_many(self):
+        """decorates several consensus maps"""
+        other = [line.replace('g__H', 'g__I') for line in cons_lines]
+        obs = list(self.service.decorate_many([cons_lines, other,
+                                               cons_lines]))
+        self.assertEqual(obs[0], (exp_tree, exp_cons))
+        self.assertEqual(obs[1][0], exp_tree.replace('g__H', 'g__I'))
+        self.assertEqual(obs[2], (exp_tree, exp_cons))
+
+    def test_decorate_files(self):
+        """reads each consensus map in the worker decorating it"""
+        other = [line.replace('g__H', 'g__I') for line in cons_lines]
+        paths = [os.path.join(self.tmp_dir, name)
+                 for name in ('a.txt', 'b.txt.gz', 'c.txt', 'd.txt')]
+        for path, lines in zip(paths, [cons_lines, other, cons_lines, []]):
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'wb') as fh:
+                fh.write('\n'.join(lines))
+
+        basenames = [os.path.join(self.tmp_dir, 'out%d' % i)
+                     for i in range(4)]
+        results = self.service.decorate_files(paths, basenames)
+        self.assertEqual(next(results), (basenames[0],
+                                         basenames[0] + '-consensus-strings'))
+        next(results)
+        self.assertEqual(next(results), (basenames[2],
+                                         basenames[2] + '-consensus-strings'))
+        self.assertRaises(ValueError, next, results)
+        self.assertEqual(self.service.status()['n_requests'], 4)
+
+        for basename, tree, cons in [(basenames[0], exp_tree, exp_cons),
+                                     (basenames[2], exp_tree, exp_cons)]:
+            self.assertEqual(open(basename).read(), tree)
+            self.assertEqual(open(basename + '-consensus-strings').read(),
+                             '\n'.join(cons))
+        self.assertEqual(open(basenames[1]).read(),
+                         exp_tree.replace('g__H', 'g__I'))
+
+        results = self.service.decorate_files(paths[:1], basenames[:1],
+                                              compress=True)
+        self.assertEqual(next(results), (basenames[0] + '.gz',
+                                         basenames[0] +
+                                         '-consensus-strings.gz'))
+        self.assertEqual(gzip.open(basenames[0] + '.gz').read(), exp_tree)
+
+    def test_decorate_errors(self):
+        """refuses unparseable consensus maps"""
+        self.assertRaises(ValueError, self.service.decorate, [])
+        self.assertRaises(ValueError, self.service.decorate, ['foo'])
+
+    def test_http(self):
+        """serves over a port"""
+        self._serve(port=0)
+        host, port = self.server.server_address[:2]
+
+        body = '\n'.join(cons_lines)
+        obs = self._request(httplib.HTTPConnection(host, port), 'POST',
+                            '/decorate', body)
+        self.assertEqual(obs, (200, {'tree': exp_tree,
+                                     'consensus_strings': exp_cons}))
+
+        status, obs = self._request(httplib.HTTPConnection(host, port),
+                                    'POST', '/decorate?no_suffix=1', body)
+        self.assertEqual(obs['consensus_strings'][0], "a\tf__F; g__G; s__X")
+
+        status, obs = self._request(httplib.HTTPConnection(host, port),
+                                    'POST', '/decorate', 'foo')
+        self.assertEqual(status, 400)
+
+        status, obs = self._request(httplib.HTTPConnection(host, port),
+                                    'GET', '/status')
+        self.assertEqual(status, 200)
+        self.assertEqual(obs['n_nodes'], 10)
+
+        status, obs = self._request(httplib.HTTPConnection(host, port),
+                                    'GET', '/foo')
+        self.assertEqual(status, 404)
+
+    def test_unix_socket(self):
+        """serves over a Unix socket"""
+        path = os.path.join(self.tmp_dir, 'sock')
+        self._serve(socket_path=path)
+
+        obs = self._request(UnixHTTPConnection(path), 'POST', '/decorate',
+                            '\n'.join(cons_lines))
+        self.assertEqual(obs, (200, {'tree': exp_tree,
+                                     'consensus_strings': exp_cons}))
+
+    def test_clear_socket(self):
+        """removes only a socket no server listens on"""
+        path = os.path.join(self.tmp_dir, 'sock')
+        clear_socket(path)
+
+        with open(path, 'w') as fh:
+            fh.write('data')
+        self.assertRaises(ValueError, clear_socket, path)
+        self.assertRaises(ValueError, make_server, self.service,
+                          socket_path=path)
+        self.assertEqual(open(path).read(), 'data')
+        os.remove(path)
+
+        # a socket left behind by a closed server
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.close()
+        clear_socket(path)
+        self.assertFalse(os.path.exists(path))
+
+        self._serve(socket_path=path)
+        self.assertRaises(ValueError, clear_socket, path)
+        self.assertTrue(os.path.exists(path))
+
+
+tree_str = "((a,b),(c,d),(e,f));"
+cons_lines = ["a\tf__F; g__G; s__X",
+              "b\tf__F; g__G; s__X",
+              "c\tf__F; g__H; s__Y",
+              "d\tf__F; g__H; s__Y",
+              "e\tf__F; g__G; s__Z",
+              "f\tf__F; g__G; s__Z"]
+exp_tree = "((a,b)'g__G; s__X',(c,d)'g__H; s__Y',(e,f)'g__G_1; s__Z')'f__F';\n"
+exp_cons = ["a\tf__F; g__G; s__X",
+            "b\tf__F; g__G; s__X",
+            "c\tf__F; g__H; s__Y",
+            "d\tf__F; g__H; s__Y",
+            "e\tf__F; g__G_1; s__Z",
+            "f\tf__F; g__G_1; s__Z"]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import subprocess
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+import t2t
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(t2t.__file__)))
+script = os.path.join(root, 'scripts', 't2t')
+
+# runs the script in-process and reports the modules it imported
+runner = """
+import runpy, sys
+sys.argv = ['t2t'] + sys.argv[1:]
+try:
+    runpy.run_path(%r, run_name='__main__')
+except SystemExit:
+    pass
+sys.stderr.write('MODULES %%s\\n' %% ' '.join(sorted(sys.modules)))
+""" % script
+
+
+class StartupTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.cons_fp = os.path.join(self.tmp_dir, 'cons.txt')
+        self.otu_fp = os.path.join(self.tmp_dir, 'otus.txt')
+        self.out_fp = os.path.join(self.tmp_dir, 'out.txt')
+        with open(self.cons_fp, 'w') as fh:
+            fh.write("a\tf__F; g__G; s__X\nb\tf__F; g__G; s__Y\n")
+        with open(self.otu_fp, 'w') as fh:
+            fh.write("0\ta\tc\n1\tb\n")
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def _modules(self, *args):
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.pathsep.join([root] + filter(None, [
+            env.get('PYTHONPATH')]))
+        proc = subprocess.Popen([sys.executable, '-c', runner] + list(args),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, env=env)
+        out, err = proc.communicate()
+        for line in err.splitlines():
+            if line.startswith('MODULES '):
+                return set(line.split()[1:])
+        self.fail("Script did not run: %s" % err)
+
+    def test_version(self):
+        """--version does not import the library"""
+        obs = self._modules('--version')
+        self.assertNotIn('skbio', obs)
+        self.assertNotIn('numpy', obs)
+        self.assertNotIn('t2t.nlevel', obs)
+
+    def test_remap(self):
+        """remap does not import skbio or numpy"""
+        obs = self._modules('remap', '-i', self.otu_fp, '-m', self.cons_fp,
+                            '-o', self.out_fp)
+        self.assertIn('t2t.remap', obs)
+        self.assertNotIn('skbio', obs)
+        self.assertNotIn('numpy', obs)
+        self.assertEqual(open(self.out_fp).read().splitlines(),
+                         ["a\tf__F; g__G; s__X",
+                          "c\tf__F; g__G; s__X",
+                          "b\tf__F; g__G; s__Y"])
+
+    def test_validate_flat(self):
+        """flat validation does not import skbio"""
+        obs = self._modules('validate', '-t', self.cons_fp,
+                            '--no-hierarchy-errors')
+        self.assertIn('t2t.validate', obs)
+        self.assertNotIn('skbio', obs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import os
+import json
+from multiprocessing import Pool
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+from skbio import TreeNode
+from StringIO import StringIO
+
+from t2t.stats import StageStats, timed, tree_size
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+class StatsTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.tree = TreeNode.read(StringIO(u"((a,b)c,(d,e)f)g;"))
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def test_tree_size(self):
+        """counts nodes and tips"""
+        self.assertEqual(tree_size(self.tree), (7, 4))
+
+    def test_stage(self):
+        """records a stage"""
+        stats = StageStats('test')
+        with stats.stage('foo', self.tree, extra=1):
+            pass
+        with stats.stage('bar') as record:
+            record['tree'] = self.tree
+
+        self.assertEqual([s['name'] for s in stats.stages], ['foo', 'bar'])
+        foo, bar = stats.stages
+        self.assertEqual(foo['extra'], 1)
+        self.assertEqual((foo['n_nodes'], foo['n_tips']), (7, 4))
+        self.assertEqual((bar['n_nodes'], bar['n_tips']), (7, 4))
+        self.assertNotIn('tree', bar)
+        for key in ('wall_time', 'cpu_time', 'peak_rss', 'peak_rss_delta'):
+            self.assertTrue(foo[key] >= 0)
+
+    def test_stage_children(self):
+        """records the workers joined in the stage"""
+        stats = StageStats('test')
+        with stats.stage('foo'):
+            pool = Pool(1)
+            pool.map(sum, [range(10 ** 6)] * 4)
+            pool.close()
+            pool.join()
+
+        foo = stats.stages[0]
+        self.assertTrue(foo['children_cpu_time'] > 0)
+        self.assertTrue(foo['children_peak_rss'] > 0)
+        self.assertTrue(stats.summary()['children_cpu_time'] >=
+                        foo['children_cpu_time'])
+
+    def test_timed(self):
+        """timed is a no-op without stats"""
+        with timed(None, 'foo', self.tree) as record:
+            record['tree'] = self.tree
+
+        stats = StageStats('test')
+        with timed(stats, 'foo'):
+            pass
+        self.assertEqual(len(stats.stages), 1)
+
+    def test_write(self):
+        """writes the stages as JSON"""
+        stats = StageStats('test')
+        with stats.stage('foo'):
+            pass
+        fp = os.path.join(self.tmp_dir, 'stats.json')
+        stats.write(fp)
+        obs = json.load(open(fp))
+        self.assertEqual(obs['command'], 'test')
+        self.assertEqual(obs['stages'][0]['name'], 'foo')
+        self.assertTrue(obs['wall_time'] >= obs['stages'][0]['wall_time'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, main
+
+from skbio import TreeNode
+from StringIO import StringIO
+
+import t2t.nlevel as nl
+from t2t.benchmark import make_tree, make_consensus_map
+from t2t.newick import newick_tokens
+from t2t.pipeline import run_decorate
+from t2t.subtrees import cut_tree, batch_subtrees, decorate_subtrees
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+class SubtreesTests(TestCase):
+
+    def setUp(self):
+        lines = make_consensus_map(300, seed=2, noise=0.1, polyphyly=0.2,
+                                   missing=0.3)
+        self.context = nl.TaxonomyContext.from_consensus(
+            lines[0].split('\t')[1])
+        self.tipname_map = nl.load_consensus_map(lines, False,
+                                                 context=self.context)
+
+    def _tree(self, shape):
+        """Returns a tree as left by decorate_ntips, and its total counts"""
+        tree = nl.load_tree(TreeNode.read(StringIO(unicode(
+            make_tree(300, shape=shape, seed=3)))), self.tipname_map,
+            context=self.context)
+        counts = nl.collect_names_at_ranks_counts(tree, self.context)
+        nl.decorate_ntips(tree, self.context)
+        return tree, counts
+
+    def test_cut_tree(self):
+        """cuts the largest subtrees of at most max_tips tips"""
+        tree = nl.load_tree(TreeNode.read(StringIO(
+            u"(((a,b)c,(d,e)f)g,(h,(i,j)k)l,m)r;")), {})
+        nodes = list(tree.preorder(include_self=True))
+        names = [n.name for n in nodes]
+
+        subtrees, spine = cut_tree(nodes, 2)
+        self.assertEqual([names[start] for start, _ in subtrees],
+                         ['c', 'f', 'k'])
+        self.assertEqual([[n.name for n in nodes[start:stop]]
+                          for start, stop in subtrees],
+                         [['c', 'a', 'b'], ['f', 'd', 'e'],
+                          ['k', 'i', 'j']])
+        self.assertEqual([names[idx] for idx in spine], ['r', 'g', 'l'])
+
+        subtrees, spine = cut_tree(nodes, 10)
+        self.assertEqual(subtrees, [(0, len(nodes))])
+        self.assertEqual(spine, [])
+
+        batches = batch_subtrees(nodes, cut_tree(nodes, 2)[0], 3)
+        self.assertEqual([[names[start] for start, _ in b] for b in batches],
+                         [['c', 'f'], ['k']])
+
+    def test_decorate_subtrees(self):
+        """sets what the serial stages set"""
+        for shape in ('balanced', 'caterpillar', 'polytomous'):
+            exp, counts = self._tree(shape)
+            nl.decorate_name_relative_freqs(exp, counts, 2, self.context,
+                                            min_relfreq=0.5)
+            nl.set_ranksafe(exp, self.context)
+            nl.pick_names(exp, self.context)
+            nl.name_node_score_fold(exp, context=self.context)
+
+            for jobs in (1, 2, 3):
+                obs, counts = self._tree(shape)
+                decorate_subtrees(obs, counts, 2, jobs, self.context,
+                                  min_relfreq=0.5)
+                nl.fold_rank_names(obs, context=self.context)
+
+                for o, e in zip(obs.preorder(include_self=True),
+                                exp.preorder(include_self=True)):
+                    self.assertEqual(o.ConsensusRelFreq, e.ConsensusRelFreq)
+                    self.assertEqual(o.ValidRelFreq, e.ValidRelFreq)
+                    self.assertEqual(o.RankSafe, e.RankSafe)
+                    if not e.is_tip():
+                        self.assertEqual(o.RankNames, e.RankNames)
+                        self.assertEqual(o.RankNameScores, e.RankNameScores)
+
+    def test_run_decorate_jobs(self):
+        """decorates as a single process does"""
+        newick = unicode(make_tree(300, shape='polytomous', seed=3))
+        exp = run_decorate(TreeNode.read(StringIO(newick)), self.tipname_map,
+                           context=self.context, score_betas=[1.0, 2.0])
+        obs = run_decorate(TreeNode.read(StringIO(newick)), self.tipname_map,
+                           context=self.context, score_betas=[1.0, 2.0],
+                           jobs=2)
+        self.assertEqual(''.join(newick_tokens(obs['tree'])),
+                         ''.join(newick_tokens(exp['tree'])))
+        self.assertEqual(obs['constrings'], exp['constrings'])
+        self.assertEqual(obs['score_sweep'], exp['score_sweep'])
+
+
+if __name__ == '__main__':
+    main()
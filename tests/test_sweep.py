@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+from unittest import TestCase, main
+
+from skbio import TreeNode
+from StringIO import StringIO
+
+import t2t.nlevel as nl
+from t2t.benchmark import make_tree, make_consensus_map
+from t2t.pipeline import DECORATE_STAGES, STAGE_NAMES, run_decorate
+from t2t.sweep import (fbeta, collect_candidates, fold_candidates,
+                       score_sweep, format_score_sweep, count_names,
+                       min_count_sweep)
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+class SweepTests(TestCase):
+
+    def setUp(self):
+        lines = make_consensus_map(300, seed=2, noise=0.1, polyphyly=0.2,
+                                   missing=0.3)
+        self.context = nl.TaxonomyContext.from_consensus(
+            lines[0].split('\t')[1])
+        self.tipname_map = nl.load_consensus_map(lines, False,
+                                                 context=self.context)
+
+    def _run(self, shape, last, **kwargs):
+        """Returns the state of the pipeline up to the stage last"""
+        tree = TreeNode.read(StringIO(unicode(make_tree(300, shape=shape,
+                                                        seed=3))))
+        state = {'tree': tree, 'tipname_map': self.tipname_map,
+                 'min_count': 2, 'context': self.context}
+        state.update(kwargs)
+        for stage in DECORATE_STAGES[:STAGE_NAMES.index(last) + 1]:
+            stage.func(state)
+        return state
+
+    def _picked(self, shape):
+        return self._run(shape, 'pick_names')['tree']
+
+    def test_fbeta(self):
+        """matches the F-scores of nlevel"""
+        for p, r in [(0.5, 0.25), (1.0, 0.3), (0.123, 0.987)]:
+            self.assertEqual(fbeta(p, r, 1), nl.fmeasure(p, r))
+            self.assertEqual(fbeta(p, r, 0.5), nl.fpoint5measure(p, r))
+            self.assertEqual(fbeta(p, r, 2), nl.f2measure(p, r))
+
+    def test_score_sweep(self):
+        """matches folding and scoring the tree under each metric"""
+        metrics = [(1, nl.fmeasure), (0.5, nl.fpoint5measure),
+                   (2, nl.f2measure),
+                   (0.25, lambda p, r: fbeta(p, r, 0.25))]
+        for shape in ('balanced', 'caterpillar', 'polytomous'):
+            tree = self._picked(shape)
+            obs = score_sweep(tree, [b for b, _ in metrics], self.context)
+            self.assertEqual([o['metric'] for o in obs],
+                             ['F1', 'F0.5', 'F2', 'F0.25'])
+
+            candidates = collect_candidates(tree, self.context)
+            picked = [(n, n.RankNames[:])
+                      for n in tree.non_tips(include_self=True)]
+            for res, (beta, score_f) in zip(obs, metrics):
+                for node, names in picked:
+                    node.RankNames = names[:]
+                nl.name_node_score_fold(tree, score_f, context=self.context)
+
+                self.assertEqual(res['score'], nl.score_tree(tree))
+                kept = [(id(n), r) for n in tree.non_tips(include_self=True)
+                        for r, name in enumerate(n.RankNames)
+                        if name is not None]
+                self.assertEqual(res['names'], len(kept))
+
+                keep = fold_candidates(candidates,
+                                       fbeta(candidates['precision'],
+                                             candidates['recall'], beta))
+                self.assertEqual([(id(n), r) for n, r, k in
+                                  zip(candidates['nodes'],
+                                      candidates['rank'], keep) if k], kept)
+
+    def test_run_decorate_score_betas(self):
+        """reports the sweep without changing the decoration"""
+        tree = make_tree(300, seed=3)
+        exp = run_decorate(StringIO(unicode(tree)), self.tipname_map,
+                           context=self.context)
+        self.assertEqual(exp['score_sweep'], None)
+
+        obs = run_decorate(StringIO(unicode(tree)), self.tipname_map,
+                           context=self.context, score_betas=[1, 2])
+        self.assertEqual(obs['constrings'], exp['constrings'])
+        self.assertEqual(obs['score_sweep'][0]['score'],
+                         nl.score_tree(obs['tree']))
+        self.assertEqual([o['beta'] for o in obs['score_sweep']], [1., 2.])
+
+    def test_count_names(self):
+        """counts the names of each node as the pipeline does"""
+        tree = self._run('balanced', 'decorate_ntips')['tree']
+        nl.decorate_name_counts(tree, context=self.context)
+        node_counts, totals = count_names(tree, self.context)
+
+        nodes = list(tree.non_tips(include_self=True))
+        self.assertEqual(len(node_counts), len(nodes))
+        for node, (counts, num_tips, size) in zip(nodes, node_counts):
+            self.assertEqual(counts, node.TaxaCount)
+            self.assertEqual(num_tips, node.NumTips)
+            self.assertEqual(size, len(list(node.tips())))
+        self.assertEqual(totals, nl.collect_names_at_ranks_counts(
+            tree, context=self.context))
+
+    def test_min_count_sweep(self):
+        """matches the pipeline run with each min_count"""
+        for shape in ('balanced', 'polytomous'):
+            tree = self._run(shape, 'load_tree')['tree']
+            for jobs in (1, 2):
+                obs = min_count_sweep(tree, [1, 3, 10], [1, 2], jobs=jobs,
+                                      context=self.context)
+                self.assertEqual([(o['min_count'], o['beta']) for o in obs],
+                                 [(1, 1.), (1, 2.), (3, 1.), (3, 2.),
+                                  (10, 1.), (10, 2.)])
+                for idx, min_count in enumerate([1, 3, 10]):
+                    state = self._run(shape, 'name_node_score_fold',
+                                      min_count=min_count,
+                                      score_betas=[1, 2], verbose=False)
+                    self.assertEqual(obs[2 * idx:2 * idx + 2],
+                                     [dict(res, min_count=min_count)
+                                      for res in state['score_sweep']])
+
+    def test_format_score_sweep(self):
+        """writes a row per metric"""
+        obs = format_score_sweep([{'metric': 'F0.5', 'beta': 0.5,
+                                   'score': 0.75, 'names': 3},
+                                  {'metric': 'F2', 'beta': 2.0,
+                                   'score': None, 'names': 0}])
+        self.assertEqual(obs, ['metric\tbeta\tscore\tnames',
+                               'F0.5\t0.5\t0.75\t3', 'F2\t2\tNA\t0'])
+
+        obs = format_score_sweep([{'metric': 'F1', 'beta': 1.0,
+                                   'score': 0.5, 'names': 2,
+                                   'min_count': 5}])
+        self.assertEqual(obs, ['min_count\tmetric\tbeta\tscore\tnames',
+                               '5\tF1\t1\t0.5\t2'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+from numpy import isnan
+from numpy.testing import assert_equal
+from skbio import TreeNode
+from StringIO import StringIO
+
+from t2t.benchmark import make_tree
+from t2t.newick import newick_tokens
+from t2t.nlevel import load_tree, TaxonomyContext
+from t2t.treecache import (tree_to_arrays, arrays_to_tree, save_tree_arrays,
+                           load_tree_arrays, load_tree_cached, cache_path,
+                           file_digest, newick_to_arrays,
+                           BackgroundTreeLoader)
+
+__author__ = "Daniel McDonald"
+__copyright__ = "Copyright 2011, The tax2tree project"
+__credits__ = ["Daniel McDonald"]
+__license__ = "BSD"
+__version__ = "1.0"
+__maintainer__ = "Daniel McDonald"
+__email__ = "mcdonadt@colorado.edu"
+__status__ = "Development"
+
+
+class TreeCacheTests(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.newick = u"((a:1,b:2)c:0.5,(d,(e,f)'0.95':3)h,(i,j)k)l;"
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def _newick(self, tree):
+        fp = StringIO()
+        tree.write(fp)
+        return fp.getvalue()
+
+    def test_tree_to_arrays(self):
+        """flattens a tree in preorder"""
+        t = TreeNode.read(StringIO(u"((a:1,b)c,d)e;"))
+        obs = tree_to_arrays(t)
+        self.assertEqual(obs['parent'].tolist(), [-1, 0, 1, 1, 0])
+        self.assertEqual(obs['length'][2], 1.0)
+        self.assertTrue(isnan(obs['length'][3]))
+        self.assertEqual(obs['tip_start'].tolist(), [0, 0, 0, 1, 2])
+        self.assertEqual(obs['tip_stop'].tolist(), [2, 1, 0, 1, 2])
+        self.assertEqual(obs['name_data'].tobytes(), 'ecabd')
+
+    def test_newick_to_arrays(self):
+        """parses into the arrays of the parsed tree"""
+        newicks = [self.newick, u"((a:1,b)c,d)e;", u"(,(,));", u"a;",
+                   u"(((a)));", make_tree(200, shape='caterpillar', seed=1),
+                   make_tree(200, shape='polytomous', seed=2)]
+        for newick in newicks:
+            exp = tree_to_arrays(TreeNode.read(StringIO(newick),
+                                               convert_underscores=False))
+            obs = newick_to_arrays(StringIO(newick), block_size=5)
+            self.assertEqual(sorted(obs), sorted(exp))
+            for name in exp:
+                self.assertEqual(obs[name].dtype, exp[name].dtype)
+                assert_equal(obs[name], exp[name])
+
+        self.assertRaises(ValueError, newick_to_arrays, StringIO("(a,b"))
+        self.assertRaises(ValueError, newick_to_arrays, StringIO("(a,b));"))
+
+    def test_newick_to_arrays_deep(self):
+        """parses a tree deeper than the recursion limit"""
+        n = 5000
+        newick = '(' * (n - 1) + 'T0,T1)' + \
+            ''.join(',T%d)' % i for i in range(2, n)) + ';'
+        obs = newick_to_arrays(StringIO(newick))
+        self.assertEqual(obs['parent'].size, 2 * n - 1)
+        self.assertEqual(obs['tip_stop'][0], n - 1)
+        self.assertEqual(''.join(newick_tokens(arrays_to_tree(obs))),
+                         newick + '\n')
+
+    def test_arrays_to_tree_load_tree(self):
+        """sets the attributes load_tree sets on the internal nodes"""
+        newick = u"((a,b)0.5,(c,d)'0.9:x',e)x;"
+        obs = arrays_to_tree(newick_to_arrays(StringIO(newick)),
+                             bootstrap=True,
+                             internal_attrs={'Consensus': [None]})
+        exp = load_tree(TreeNode.read(StringIO(newick),
+                                      convert_underscores=False), {},
+                        context=TaxonomyContext(['x']))
+        for o, e in zip(obs.traverse(include_self=True),
+                        exp.traverse(include_self=True)):
+            self.assertEqual(o.name, e.name)
+            self.assertEqual((o.TipStart, o.TipStop),
+                             (e.TipStart, e.TipStop))
+            if not e.is_tip():
+                self.assertEqual(o.Bootstrap, e.Bootstrap)
+                self.assertEqual(o.Consensus, e.Consensus)
+
+    def test_arrays_to_tree(self):
+        """round trips a tree through arrays"""
+        t = TreeNode.read(StringIO(self.newick), convert_underscores=False)
+        obs = arrays_to_tree(tree_to_arrays(t))
+        self.assertEqual(self._newick(obs), self._newick(t))
+
+        # the cached tip ranges match those from load_tree
+        exp = load_tree(StringIO(self.newick), {})
+        for o, e in zip(obs.traverse(include_self=True),
+                        exp.traverse(include_self=True)):
+            self.assertEqual((o.TipStart, o.TipStop),
+                             (e.TipStart, e.TipStop))
+
+    def test_save_load_tree_arrays(self):
+        """arrays survive a trip to disk"""
+        t = TreeNode.read(StringIO(self.newick), convert_underscores=False)
+        path = os.path.join(self.tmp_dir, 'cache')
+        save_tree_arrays(tree_to_arrays(t), path)
+        obs = arrays_to_tree(load_tree_arrays(path))
+        self.assertEqual(self._newick(obs), self._newick(t))
+
+    def test_load_tree_cached(self):
+        """parses once, then reuses the cache"""
+        tree_fp = os.path.join(self.tmp_dir, 'tree.ntree')
+        with open(tree_fp, 'w') as fh:
+            fh.write(self.newick)
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+        obs = load_tree_cached(tree_fp, cache_dir)
+        path = cache_path(cache_dir, file_digest(tree_fp))
+        self.assertTrue(os.path.isdir(path))
+
+        # a tampered cache entry is what gets returned on reuse
+        t = TreeNode.read(StringIO(u"(x,y);"))
+        rmtree(path)
+        save_tree_arrays(tree_to_arrays(t), path)
+        obs2 = load_tree_cached(tree_fp, cache_dir)
+        self.assertEqual([n.name for n in obs2.tips()], ['x', 'y'])
+        self.assertEqual([n.name for n in obs.tips()],
+                         ['a', 'b', 'd', 'e', 'f', 'i', 'j'])
+
+    def test_background_tree_loader(self):
+        """parses in a worker, through the cache if given"""
+        tree_fp = os.path.join(self.tmp_dir, 'tree.ntree')
+        with open(tree_fp, 'w') as fh:
+            fh.write(self.newick)
+        exp = newick_to_arrays(StringIO(self.newick))
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+        for cache in (None, cache_dir, cache_dir):
+            obs = BackgroundTreeLoader(tree_fp, cache).get()
+            self.assertEqual(sorted(obs), sorted(exp))
+            for name in exp:
+                assert_equal(obs[name], exp[name])
+        self.assertTrue(os.path.isdir(cache_path(cache_dir,
+                                                 file_digest(tree_fp))))
+
+        bad_fp = os.path.join(self.tmp_dir, 'bad.ntree')
+        with open(bad_fp, 'w') as fh:
+            fh.write('(a,b')
+        loader = BackgroundTreeLoader(bad_fp)
+        self.assertRaises(ValueError, loader.get)
+        loader.close()
+
+        # closed without waiting for the arrays
+        loader = BackgroundTreeLoader(tree_fp)
+        loader.close()
+        self.assertFalse(any(p.is_alive() for p in loader._pool._pool))
+
+        # the arrays load as the newick does
+        obs = load_tree(BackgroundTreeLoader(tree_fp).get(), {})
+        self.assertEqual([n.name for n in obs.tips()],
+                         ['a', 'b', 'd', 'e', 'f', 'i', 'j'])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 from unittest import TestCase, main
-from t2t.util import combine_alignments, reroot, unzip
+from t2t.util import combine_alignments, reroot, unzip, BoundedDict
 from skbio import TreeNode
 
 from StringIO import StringIO
@@ -66,5 +66,14 @@ class UtilTests(TestCase):
         for u, l in zip(unzipped, lists):
             self.assertEqual(u, l)
 
+    def test_bounded_dict(self):
+        """empties when full"""
+        d = BoundedDict(2)
+        d['a'] = 1
+        d['b'] = 2
+        self.assertEqual(d, {'a': 1, 'b': 2})
+        d['c'] = 3
+        self.assertEqual(d, {'c': 3})
+
 if __name__ == '__main__':
     main()